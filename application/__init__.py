@@ -1,9 +1,10 @@
 from flask import Flask 
 from flask_sqlalchemy import SQLAlchemy
 import os
+from .sharding import ShardedSession
 
 # global accessible libraries
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": ShardedSession})
 
 def create_app():
     """Initialize the core application."""
@@ -12,11 +13,60 @@ def create_app():
     app.config.from_object(config_type)
 
     # Initialize Plugins
+    from .engine import engine_options, init_engine_profile
+    from .sharding import shard_binds, init_shards
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+    app.config["SQLALCHEMY_BINDS"] = {**app.config.get("SQLALCHEMY_BINDS", {}), **shard_binds(app.config)}
     db.init_app(app)
+    init_engine_profile(app, db)
+    init_shards(app, db)
+    if app.config["METRICS"]:
+        from .metrics import init_metrics
+        init_metrics(app, db)
+
+    from .cache import plant_cache
+    plant_cache.configure(app.config["PLANT_CACHE_SIZE"], app.config["PLANT_CACHE_TTL"])
+    from .dose_model import dose_models
+    dose_models.configure(app.config["PLANT_CACHE_SIZE"], app.config["DOSE_MODEL_TTL"])
+    from .turbidity import turbidity_monitor
+    turbidity_monitor.configure(app.config["TURBIDITY_WINDOW"], app.config["TURBIDITY_EWMA_ALPHA"],
+                                app.config["TURBIDITY_MIN_READINGS"], app.config["TURBIDITY_ALERT_Z"],
+                                app.config["TURBIDITY_ALERTS_KEPT"])
+
+    if app.config["WRITE_BEHIND"]:
+        from .write_behind import WriteBehindQueue
+        app.extensions["write_behind"] = WriteBehindQueue(
+            app,
+            maxsize=app.config["WRITE_BEHIND_MAX_QUEUE"],
+            flush_interval=app.config["WRITE_BEHIND_FLUSH_MS"] / 1000,
+            flush_items=app.config["WRITE_BEHIND_FLUSH_ITEMS"]).start()
+
+    if app.config["IDEMPOTENCY"]:
+        from .idempotency import IdempotencyStore
+        app.extensions["idempotency"] = IdempotencyStore(
+            app,
+            ttl=app.config["IDEMPOTENCY_TTL"],
+            maxsize=app.config["IDEMPOTENCY_CACHE_SIZE"],
+            evict_interval=app.config["IDEMPOTENCY_EVICT_INTERVAL"]).start()
+
+    if app.config["FAST_JSON"]:
+        from .serializers import FastJSONProvider
+        app.json = FastJSONProvider(app)
 
     with app.app_context():
+        # a mismatched schema fails here, before the routes are imported
+        from .schema import prepare_schema, schema_cli
+        prepare_schema(app)
+        app.cli.add_command(schema_cli)
+        # warm started by the first request, the CLI commands never read the readings
+        app.before_request(turbidity_monitor.warm_start_once)
+
         from . import routes
-        
-        db.create_all()
+        from .rollups import rollups_cli
+        app.cli.add_command(rollups_cli)
+        from .calibration import calibrations_cli
+        app.cli.add_command(calibrations_cli)
+        from .archive import archive_cli
+        app.cli.add_command(archive_cli)
 
         return app
\ No newline at end of file
@@ -0,0 +1,151 @@
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, insert, update, delete, func, or_
+from .models import db, DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry, ArchiveModels
+from .sharding import fan_out
+
+
+def archive_cutoff(days, now=None):
+    """
+    Timestamp before which entries are archived, aligned on midnight.
+
+    Days are never split between the hot and archive tables, so a day's rollup
+    can always be recomputed from a single table.
+
+    :param days: archive horizon in days
+    :param now: current time, defaults to datetime.now()
+    """
+    midnight = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight - timedelta(days=days)
+
+def _copy(session, model_class, where):
+    """
+    Copy the rows of a hot table matching a condition into its archive, with one INSERT .. SELECT.
+    """
+    hot = model_class.__table__
+    archived = ArchiveModels[model_class].__table__
+    names = [column.name for column in archived.columns if column.name in hot.c]
+    session.execute(insert(archived).from_select(names, select(*[hot.c[name] for name in names]).where(where)))
+
+def _delete_dosage_entries(session, dosage_ids):
+    """
+    Delete dosage entries and their sections, which reference each other.
+    """
+    dosage = DosageEntry.__table__
+    session.execute(update(dosage).where(dosage.c.id.in_(dosage_ids)).values(calibration_id=None, change_dose_id=None))
+    for section in (ChangeDoseSection.__table__, CalibrationSection.__table__):
+        session.execute(delete(section).where(section.c.dosage_entry_id.in_(dosage_ids)))
+    session.execute(delete(dosage).where(dosage.c.id.in_(dosage_ids)))
+
+
+# -- ARCHIVAL ------------------------------------------------------
+def archive_entries(session, before, chunk_size=1000):
+    """
+    Move the entries created before a timestamp to the archive tables, in chunks.
+
+    Every chunk is copied with one INSERT .. SELECT per table, removed from the hot
+    tables and committed. Soft-deleted dosage entries are left for purge_deleted_entries().
+    The daily rollups keep counting the archived entries, so they are not touched.
+
+    :param session: session to execute the statements in
+    :param before: exclusive upper bound of the archived created_at, see archive_cutoff()
+    :param chunk_size: number of entries per chunk and table
+    :return: dictionary of the number of dosage and raw water entries archived
+    """
+    counts = {"dosage_entries": 0, "raw_water_entries": 0}
+    dosage = DosageEntry.__table__
+    old_dosage = (
+        select(dosage.c.id)
+        .where(dosage.c.created_at < before, dosage.c.is_deleted.is_(False))
+        .order_by(dosage.c.id)
+        .limit(chunk_size))
+    while True:
+        dosage_ids = session.scalars(old_dosage).all()
+        if not dosage_ids:
+            break
+        for model_class in (CalibrationSection, ChangeDoseSection):
+            _copy(session, model_class, model_class.__table__.c.dosage_entry_id.in_(dosage_ids))
+        _copy(session, DosageEntry, dosage.c.id.in_(dosage_ids))
+        _delete_dosage_entries(session, dosage_ids)
+        session.commit()
+        counts["dosage_entries"] += len(dosage_ids)
+
+    raw_water = RawWaterEntry.__table__
+    old_raw_water = select(raw_water.c.id).where(raw_water.c.created_at < before).order_by(raw_water.c.id).limit(chunk_size)
+    while True:
+        raw_water_ids = session.scalars(old_raw_water).all()
+        if not raw_water_ids:
+            break
+        _copy(session, RawWaterEntry, raw_water.c.id.in_(raw_water_ids))
+        session.execute(delete(raw_water).where(raw_water.c.id.in_(raw_water_ids)))
+        session.commit()
+        counts["raw_water_entries"] += len(raw_water_ids)
+    return counts
+
+def purge_deleted_entries(session, before, chunk_size=1000):
+    """
+    Remove the dosage entries soft-deleted before a timestamp, with their sections, in chunks.
+
+    Their tombstones stay in the change log and they were already retracted from the rollups.
+
+    :param session: session to execute the statements in
+    :param before: exclusive upper bound of the deletion time (updated_at, unknown counts as old)
+    :param chunk_size: number of entries per chunk
+    :return: number of dosage entries purged
+    """
+    dosage = DosageEntry.__table__
+    deleted = (
+        select(dosage.c.id)
+        .where(dosage.c.is_deleted.is_(True), or_(dosage.c.updated_at < before, dosage.c.updated_at.is_(None)))
+        .order_by(dosage.c.id)
+        .limit(chunk_size))
+    purged = 0
+    while True:
+        dosage_ids = session.scalars(deleted).all()
+        if not dosage_ids:
+            return purged
+        _delete_dosage_entries(session, dosage_ids)
+        session.commit()
+        purged += len(dosage_ids)
+
+
+# -- READS ------------------------------------------------------
+def reaches_archive(model_class, start):
+    """
+    Whether a time range starting at `start` can contain archived entries of a hot model.
+
+    Looks up the newest archived entry, a single index lookup.
+
+    :param model_class: DosageEntry or RawWaterEntry
+    :param start: inclusive start of the time range, None for unbounded
+    """
+    archived = ArchiveModels[model_class]
+    newest = db.session.scalar(select(func.max(archived.created_at)))
+    return newest is not None and (start is None or start <= newest)
+
+
+# -- COMMANDS ------------------------------------------------------
+archive_cli = AppGroup("archive", help="Move old entries out of the hot tables.")
+
+@archive_cli.command("run")
+@click.option("--days", type=int, help="Archive horizon in days, defaults to ARCHIVE_AFTER_DAYS.")
+@click.option("--chunk-size", type=int, help="Entries per transaction, defaults to ARCHIVE_CHUNK_SIZE.")
+def archive_command(days, chunk_size):
+    """Archive the entries older than the horizon and purge the old soft-deleted ones."""
+    config = current_app.config
+    chunk_size = chunk_size or config["ARCHIVE_CHUNK_SIZE"]
+    purge_before = datetime.now() - timedelta(days=config["PURGE_DELETED_AFTER_DAYS"])
+    purged = sum(fan_out(lambda: purge_deleted_entries(db.session, purge_before, chunk_size)))
+    click.echo(f"Purged {purged} soft-deleted dosage entries.")
+
+    days = days if days is not None else config["ARCHIVE_AFTER_DAYS"]
+    if days is None:
+        click.echo("ARCHIVE_AFTER_DAYS is not set, nothing archived.")
+        return
+    before = archive_cutoff(days)
+    counts = {"dosage_entries": 0, "raw_water_entries": 0}
+    for shard_counts in fan_out(lambda: archive_entries(db.session, before, chunk_size)):
+        counts = {key: counts[key] + shard_counts[key] for key in counts}
+    click.echo(f"Archived {counts['dosage_entries']} dosage and {counts['raw_water_entries']} raw water entries.")
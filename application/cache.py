@@ -0,0 +1,162 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select
+from .models import db, Plant, Configuration
+from .serializers import serializer_for
+
+
+class LRUCache:
+    """
+    Thread-safe in-process cache bounded by size and entry age.
+
+    The least recently used entry is evicted when the cache is full and entries older
+    than `ttl` seconds are dropped when read. Keeps hit, miss, eviction and expiration counters.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def configure(self, maxsize, ttl):
+        """
+        Resize the cache and change its TTL, dropping every entry.
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self._data.clear()
+
+    def get(self, key, default=None):
+        """
+        Get a cached value, counting the lookup as a hit or a miss.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Cache a value, evicting the least recently used entries beyond maxsize.
+        """
+        with self._lock:
+            self._data[key] = (value, self._clock() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        Read-through lookup: on a miss, call `loader()` and cache its result unless it is None.
+        """
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        """
+        Drop the given keys from the cache.
+        """
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        """
+        Drop every entry and reset the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        """
+        Current size and counters of the cache.
+        """
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations}
+
+
+# -- PLANT DIRECTORY ------------------------------------------------------
+# serialized Plant and Configuration snapshots, keyed by ("id", plant_id) and ("name", plant_name)
+plant_cache = LRUCache()
+
+def _load_plant(*criteria):
+    """
+    Load a plant and its configuration with one query.
+
+    :return: dictionary with the serialized "plant" and "configuration", None if the plant does not exist
+    """
+    row = db.session.execute(
+        select(Plant, Configuration)
+        .join(Configuration, Configuration.id == Plant.config_id)
+        .where(*criteria)).first()
+    if row is None:
+        return None
+    plant, config = row
+    return {"plant": serializer_for(Plant)(plant), "configuration": serializer_for(Configuration)(config)}
+
+def _cache_plant(snapshot):
+    plant_cache.set(("id", snapshot["plant"]["id"]), snapshot)
+    plant_cache.set(("name", snapshot["plant"]["name"]), snapshot)
+    return snapshot
+
+def plant_by_id(plant_id):
+    """
+    Read-through lookup of a plant and its configuration by plant id.
+
+    :param plant_id: id of the plant
+    :return: dictionary with the serialized "plant" and "configuration", None if the plant does not exist
+    """
+    snapshot = plant_cache.get(("id", plant_id))
+    if snapshot is None:
+        snapshot = _load_plant(Plant.id == plant_id)
+        if snapshot is not None:
+            _cache_plant(snapshot)
+    return snapshot
+
+def plant_by_name(name):
+    """
+    Read-through lookup of a plant and its configuration by plant name.
+
+    :param name: name of the plant
+    :return: dictionary with the serialized "plant" and "configuration", None if the plant does not exist
+    """
+    snapshot = plant_cache.get(("name", name))
+    if snapshot is None:
+        snapshot = _load_plant(Plant.name == name)
+        if snapshot is not None:
+            _cache_plant(snapshot)
+    return snapshot
+
+def invalidate_plant(plant_id=None, name=None):
+    """
+    Drop a plant from the cache after it, or its configuration, was written.
+
+    :param plant_id: id of the plant
+    :param name: name of the plant
+    """
+    keys = []
+    if plant_id is not None:
+        keys.append(("id", plant_id))
+    if name is not None:
+        keys.append(("name", name))
+    plant_cache.invalidate(*keys)
@@ -0,0 +1,133 @@
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, update, bindparam
+from .models import db, User, DosageEntry, CalibrationSection, Configuration, Plant, ArchiveModels
+from .rollups import rebuild_rollups
+from .changes import record_changes
+from .sharding import use_shard
+
+# calibration values measured by the operator, the other ones are derived on the server
+CALIBRATION_INPUTS = ("slider_position", "inflow_rate", "starting_volume", "ending_volume", "elapsed_seconds")
+CALIBRATION_DERIVED = ("calculated_flow_rate", "calculated_chemical_dose", "slider_pos_chem_dose_ratio")
+
+
+def compute_calibrations(slider_position, inflow_rate, starting_volume, ending_volume, elapsed_seconds, chemical_concentration):
+    """
+    Derive the calculated values of a batch of calibrations, column by column.
+
+    Each argument is a column (list) of the batch, except chemical_concentration which is
+    the plant's Configuration value shared by the whole batch:
+
+        calculated_flow_rate       = (starting_volume - ending_volume) / elapsed_seconds
+        calculated_chemical_dose   = calculated_flow_rate * chemical_concentration / inflow_rate
+        slider_pos_chem_dose_ratio = slider_position / calculated_chemical_dose (0 without any dose)
+
+    :return: tuple of the calculated_flow_rate, calculated_chemical_dose and slider_pos_chem_dose_ratio columns
+    """
+    flow_rates = [(start - end) / seconds for start, end, seconds in zip(starting_volume, ending_volume, elapsed_seconds)]
+    doses = [flow * chemical_concentration / inflow for flow, inflow in zip(flow_rates, inflow_rate)]
+    ratios = [position / dose if dose else 0.0 for position, dose in zip(slider_position, doses)]
+    return flow_rates, doses, ratios
+
+def derive_calibrations(calibrations, chemical_concentration):
+    """
+    Fill in the calculated values of calibration payloads, overwriting any sent by the client.
+
+    :param calibrations: list of calibration dictionaries holding CALIBRATION_INPUTS
+    :param chemical_concentration: chemical concentration of the plant's Configuration
+    """
+    if not calibrations:
+        return
+    columns = [[c[field] for c in calibrations] for field in CALIBRATION_INPUTS]
+    for field, values in zip(CALIBRATION_DERIVED, compute_calibrations(*columns, chemical_concentration)):
+        for calibration, value in zip(calibrations, values):
+            calibration[field] = value
+
+def plant_concentration(session, plant_id):
+    """
+    Chemical concentration of a plant, read in the caller's write transaction.
+
+    Locks the configuration row where the backend supports it, so a concurrent configuration
+    update waits for the transaction and its recompute then covers the calibrations written in it.
+
+    :param session: session of the write transaction
+    :param plant_id: id of the plant
+    :return: the chemical concentration of the plant's Configuration
+    """
+    return session.execute(
+        select(Configuration.chemical_concentration)
+        .join(Plant, Plant.config_id == Configuration.id)
+        .where(Plant.id == plant_id)
+        .with_for_update(of=Configuration)).scalar_one()
+
+
+# -- BULK RECOMPUTE ------------------------------------------------------
+def recompute_plant_calibrations(session, plant_id, chemical_concentration, chunk_size=1000, commit=True):
+    """
+    Rewrite the calculated values of every calibration of a plant, in chunks.
+
+    Each chunk is read with one keyset query, computed column-wise and written back
+    with one executemany UPDATE, then committed unless `commit` is False, in which case
+    the whole recompute stays in the caller's transaction. Archived calibrations are rewritten too.
+
+    :param session: session to execute the statements in
+    :param plant_id: id of the plant
+    :param chemical_concentration: new chemical concentration of the plant
+    :param chunk_size: number of calibrations per chunk
+    :param commit: commit after each chunk
+    :return: number of calibrations rewritten
+    """
+    rewritten = 0
+    for calibration, entry in ((CalibrationSection, DosageEntry),
+                               (ArchiveModels[CalibrationSection], ArchiveModels[DosageEntry])):
+        table = calibration.__table__
+        write = (
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values({field: bindparam(f"b_{field}") for field in CALIBRATION_DERIVED}))
+        read = (
+            select(calibration.id, *[getattr(calibration, field) for field in CALIBRATION_INPUTS])
+            .join(entry, entry.id == calibration.dosage_entry_id)
+            .join(User, User.id == entry.user_id)
+            .where(User.plant_id == plant_id)
+            .order_by(calibration.id)
+            .limit(chunk_size))
+
+        after_id = 0
+        while True:
+            rows = session.execute(read.where(calibration.id > after_id)).all()
+            if not rows:
+                break
+            ids, *columns = zip(*rows)
+            derived = compute_calibrations(*columns, chemical_concentration)
+            session.execute(write, [
+                {"b_id": calibration_id, **{f"b_{field}": values[i] for field, values in zip(CALIBRATION_DERIVED, derived)}}
+                for i, calibration_id in enumerate(ids)])
+            if calibration is CalibrationSection:
+                record_changes(session, "upsert", {CalibrationSection: [(calibration_id, plant_id) for calibration_id in ids]})
+            if commit:
+                session.commit()
+            rewritten += len(ids)
+            after_id = ids[-1]
+    return rewritten
+
+
+# -- COMMANDS ------------------------------------------------------
+calibrations_cli = AppGroup("calibrations", help="Maintain the calculated calibration values.")
+
+@calibrations_cli.command("recompute")
+@click.option("--plant-id", type=int, required=True, help="Plant whose calibrations are recomputed.")
+@click.option("--chunk-size", type=int, default=1000, show_default=True)
+def recompute_command(plant_id, chunk_size):
+    """Recompute the calibrations of a plant from its current chemical concentration."""
+    concentration = db.session.scalar(
+        select(Configuration.chemical_concentration)
+        .join(Plant, Plant.config_id == Configuration.id)
+        .where(Plant.id == plant_id))
+    if concentration is None:
+        raise click.ClickException(f"Plant {plant_id} not found.")
+    with use_shard(plant_id):
+        rewritten = recompute_plant_calibrations(db.session, plant_id, concentration, chunk_size)
+        rebuild_rollups(db.session, plant_id)
+        db.session.commit()
+    click.echo(f"Recomputed {rewritten} calibrations.")
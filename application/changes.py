@@ -0,0 +1,166 @@
+from sqlalchemy import event, insert, literal, select, union_all
+from .models import db, Plant, Configuration, User, DosageEntry, CalibrationSection, ChangeDoseSection, \
+    RawWaterEntry, ChangeLog, EntryChangeLog, ArchiveModels
+from .serializers import row_select, serialize_rows
+
+# tables clients can sync incrementally, by table name
+SyncedModels = {
+    model_class.__tablename__: model_class
+    for model_class in (Configuration, Plant, User, DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry)}
+
+# tables whose writes are logged in the entry change log, in the same database as their rows
+EntryModels = (DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry)
+
+
+def _log_of(model_class):
+    return EntryChangeLog if model_class in EntryModels else ChangeLog
+
+def record_changes(session, op, changes):
+    """
+    Append writes of synced tables to their change log with one INSERT per log, in the caller's transaction.
+
+    :param session: session to execute the statement in
+    :param op: "upsert" or "delete"
+    :param changes: dictionary of model to iterable of (row id, plant id) of its written rows
+    """
+    values = {}
+    for model_class, rows in changes.items():
+        values.setdefault(_log_of(model_class), []).extend(
+            {"table_name": model_class.__tablename__, "row_id": row_id, "op": op, "plant_id": plant_id}
+            for row_id, plant_id in rows)
+    for log_class, log_values in values.items():
+        if log_values:
+            session.execute(insert(log_class.__table__), log_values)
+
+def record_changes_from(session, op, statements):
+    """
+    Append writes of synced tables to their change log with a single INSERT .. SELECT per log.
+
+    Used before set-based deletes, when the affected ids are not known to the application.
+
+    :param session: session to execute the statement in
+    :param op: "upsert" or "delete"
+    :param statements: dictionary of model to SELECT of (row id, plant id) of its written rows
+    """
+    selects = {}
+    for model_class, statement in statements.items():
+        selects.setdefault(_log_of(model_class), []).append(
+            statement.add_columns(literal(model_class.__tablename__), literal(op)))
+    for log_class, log_selects in selects.items():
+        session.execute(
+            insert(log_class.__table__).from_select(
+                ["row_id", "plant_id", "table_name", "op"],
+                union_all(*log_selects) if len(log_selects) > 1 else log_selects[0]))
+
+
+# -- ORM WRITES ------------------------------------------------------
+# set-based writes record their changes explicitly, writes flushed by the ORM are recorded here
+def _plant_of(connection, target):
+    """
+    Plant of a row written through the ORM, looked up when the row does not reference it directly.
+    """
+    if isinstance(target, Plant):
+        return target.id
+    if isinstance(target, User):
+        return target.plant_id
+    if isinstance(target, Configuration):
+        return connection.scalar(select(Plant.id).where(Plant.config_id == target.id))
+    if isinstance(target, (DosageEntry, RawWaterEntry)):
+        user_id = target.user_id
+    else:
+        user_id = select(DosageEntry.user_id).where(DosageEntry.id == target.dosage_entry_id).scalar_subquery()
+    return connection.scalar(select(User.plant_id).where(User.id == user_id))
+
+def _listen(op, log_table):
+    def record(mapper, connection, target):
+        connection.execute(insert(log_table).values(
+            table_name=mapper.local_table.name, row_id=target.id, op=op, plant_id=_plant_of(connection, target)))
+    return record
+
+for _model_class in SyncedModels.values():
+    _log_table = _log_of(_model_class).__table__
+    event.listen(_model_class, "after_insert", _listen("upsert", _log_table))
+    event.listen(_model_class, "after_update", _listen("upsert", _log_table))
+    event.listen(_model_class, "after_delete", _listen("delete", _log_table))
+
+
+# -- SYNC ------------------------------------------------------
+def parse_sync_token(token):
+    """
+    Sequence numbers of the catalog and entry change logs a sync token resumes after.
+
+    Tokens issued before the entry change log existed are a single catalog sequence number,
+    every entry change logged since then follows them.
+
+    :param token: "<catalog seq>:<entry seq>" or "<catalog seq>"
+    :return: tuple of (catalog sequence number, entry sequence number)
+    :raise ValueError: when the numbers are not integers
+    """
+    catalog_seq, _, entry_seq = token.partition(":")
+    return int(catalog_seq), int(entry_seq or 0)
+
+def sync_token(since):
+    """
+    Sync token of a tuple of (catalog sequence number, entry sequence number), see parse_sync_token().
+    """
+    return "%d:%d" % since
+
+def _read_log(log_class, since, plant_id, limit):
+    statement = select(log_class.seq, log_class.table_name, log_class.row_id, log_class.op).where(log_class.seq > since)
+    if plant_id is not None:
+        statement = statement.where(log_class.plant_id == plant_id)
+    return db.session.execute(statement.order_by(log_class.seq).limit(limit)).all()
+
+def changes_since(since, plant_id=None, limit=1000):
+    """
+    Compact set of the rows changed after a pair of change log sequence numbers.
+
+    Each changed row appears once: its current serialized values if it still exists,
+    otherwise its id among the deleted ones. Entries moved to the archive tables since they
+    were logged still exist, their ids are listed under "archived" instead. The catalog
+    changes are consumed before the entry changes, so the plants and users an entry
+    references reach the client first.
+
+    :param since: tuple of the sequence numbers of the last catalog and entry changes the client has
+    :param plant_id: only return the changes of this plant, None for every plant
+    :param limit: maximum number of change log entries consumed
+    :return: tuple of (changes by table name, sequence numbers of the last consumed changes, whether more changes follow)
+    """
+    catalog_since, entry_since = since
+    catalog_log = _read_log(ChangeLog, catalog_since, plant_id, limit + 1)
+    entry_log = []
+    if len(catalog_log) <= limit:
+        entry_log = _read_log(EntryChangeLog, entry_since, plant_id, limit - len(catalog_log) + 1)
+    has_more = len(catalog_log) + len(entry_log) > limit
+    catalog_log = catalog_log[:limit]
+    entry_log = entry_log[:limit - len(catalog_log)]
+
+    # the latest operation of each row wins, entries logged in the catalog before the
+    # entry change log existed are older than the ones in it
+    latest = {}
+    for _, table_name, row_id, op in (*catalog_log, *entry_log):
+        latest.setdefault(table_name, {})[row_id] = op
+
+    changes = {}
+    for table_name, ops in latest.items():
+        model_class = SyncedModels[table_name]
+        upserted_ids = [row_id for row_id, op in ops.items() if op == "upsert"]
+        upserted = []
+        if upserted_ids:
+            upserted = serialize_rows(model_class, db.session.execute(
+                row_select(model_class).where(model_class.id.in_(upserted_ids)).order_by(model_class.id)))
+        found = {row["id"] for row in upserted}
+        # rows gone since their upsert are reported deleted, their tombstone follows later in the log
+        missing = [row_id for row_id in ops if row_id not in found]
+        if model_class not in ArchiveModels:
+            changes[table_name] = {"upserted": upserted, "deleted": sorted(missing)}
+            continue
+        archived = set()
+        if missing:
+            archive = ArchiveModels[model_class]
+            archived = set(db.session.scalars(select(archive.id).where(archive.id.in_(missing))))
+        changes[table_name] = {"upserted": upserted, "deleted": sorted(set(missing) - archived),
+                               "archived": sorted(archived)}
+
+    last_seqs = (catalog_log[-1].seq if catalog_log else catalog_since, entry_log[-1].seq if entry_log else entry_since)
+    return changes, last_seqs, has_more
@@ -0,0 +1,113 @@
+import threading
+from sqlalchemy import select, func
+from .models import db, User, DosageEntry, CalibrationSection
+from .cache import LRUCache
+
+
+class DoseModel:
+    """
+    Least squares line of a plant's slider position against its calculated chemical dose.
+
+    Only the running sums of the calibrations are kept, so adding calibrations and
+    predicting a slider position are O(1) whatever the size of the history.
+    """
+
+    def __init__(self, count=0, sum_dose=0.0, sum_slider=0.0, sum_dose_sq=0.0, sum_dose_slider=0.0, last_calibration_id=0):
+        self.count = count
+        self.sum_dose = sum_dose
+        self.sum_slider = sum_slider
+        self.sum_dose_sq = sum_dose_sq
+        self.sum_dose_slider = sum_dose_slider
+        # calibrations up to this id were counted when the model was loaded
+        self.last_calibration_id = last_calibration_id
+        # ids of the calibrations counted since, batches can be recorded out of commit order
+        self.added_ids = set()
+
+    def add(self, calibration_id, dose, slider_position):
+        """
+        Count a calibration, ignoring the ones the model already holds.
+        """
+        if calibration_id <= self.last_calibration_id or calibration_id in self.added_ids:
+            return
+        self.count += 1
+        self.sum_dose += dose
+        self.sum_slider += slider_position
+        self.sum_dose_sq += dose * dose
+        self.sum_dose_slider += dose * slider_position
+        self.added_ids.add(calibration_id)
+
+    def fit(self):
+        """
+        Slope and intercept of the line, None when fewer than two distinct doses were calibrated.
+        """
+        if self.count < 2:
+            return None
+        variance = self.sum_dose_sq - self.sum_dose * self.sum_dose / self.count
+        if variance <= 1e-12 * max(self.sum_dose_sq, 1.0):
+            return None
+        slope = (self.sum_dose_slider - self.sum_dose * self.sum_slider / self.count) / variance
+        intercept = (self.sum_slider - slope * self.sum_dose) / self.count
+        return slope, intercept
+
+    def recommend(self, target_dose):
+        """
+        Slider position expected to produce a target dose, None if the model cannot be fitted.
+        """
+        line = self.fit()
+        if line is None:
+            return None
+        slope, intercept = line
+        return intercept + slope * target_dose
+
+
+# -- PLANT MODELS ------------------------------------------------------
+# DoseModel of each plant, keyed by plant id
+dose_models = LRUCache()
+# serializes the incremental updates of the cached models
+_update_lock = threading.Lock()
+
+def _load_model(plant_id):
+    """
+    Build the model of a plant from its calibration history with one aggregate query.
+    """
+    dose = CalibrationSection.calculated_chemical_dose
+    slider = CalibrationSection.slider_position
+    row = db.session.execute(
+        select(func.count(CalibrationSection.id), func.sum(dose), func.sum(slider),
+               func.sum(dose * dose), func.sum(dose * slider), func.max(CalibrationSection.id))
+        .join(DosageEntry, DosageEntry.id == CalibrationSection.dosage_entry_id)
+        .join(User, User.id == DosageEntry.user_id)
+        .where(User.plant_id == plant_id, DosageEntry.is_deleted.is_(False))).one()
+    count, sum_dose, sum_slider, sum_dose_sq, sum_dose_slider, last_id = row
+    return DoseModel(count, sum_dose or 0.0, sum_slider or 0.0, sum_dose_sq or 0.0, sum_dose_slider or 0.0, last_id or 0)
+
+def dose_model(plant_id):
+    """
+    Read-through lookup of the dose model of a plant.
+
+    :param plant_id: id of the plant
+    :return: DoseModel of the plant's calibrations that are not deleted
+    """
+    return dose_models.get_or_load(plant_id, lambda: _load_model(plant_id))
+
+def record_calibrations(plant_id, calibrations):
+    """
+    Add committed calibrations to the cached model of a plant.
+
+    Plants without a cached model are skipped, their model is loaded with the new calibrations on first use.
+
+    :param plant_id: id of the plant
+    :param calibrations: list of (calibration id, calculated chemical dose, slider position)
+    """
+    model = dose_models.get(plant_id)
+    if model is None:
+        return
+    with _update_lock:
+        for calibration_id, dose, slider_position in sorted(calibrations):
+            model.add(calibration_id, dose, slider_position)
+
+def invalidate_dose_model(*plant_ids):
+    """
+    Drop the models of plants whose calibrations were deleted or recomputed.
+    """
+    dose_models.invalidate(*plant_ids)
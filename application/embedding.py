@@ -0,0 +1,162 @@
+import time
+from flask import request
+from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import joinedload, selectinload
+from .models import Plant, Configuration, User, DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry
+from .serializers import serializer_for
+from .metrics import record_serialization
+
+# relationships clients can embed with ?include=, by model
+# (the entries of a user are left out, they are fetched by time range instead)
+Includes = {
+    Plant: ("configuration", "users"),
+    Configuration: ("plant",),
+    User: ("plant",),
+    DosageEntry: ("user", "calibration", "change_dose"),
+    CalibrationSection: ("dosage_entry",),
+    ChangeDoseSection: ("dosage_entry", "related_calibration"),
+    RawWaterEntry: ("user",),
+}
+# longest chain of relationships a single include can follow, bounds the number of queries
+MAX_INCLUDE_DEPTH = 3
+
+
+class Embedding:
+    """
+    Related objects to embed and fields to keep in the serialized objects of a model.
+
+    Every included relationship is eager loaded, many-to-one ones joined in the same
+    SELECT and collections with one extra SELECT .. IN, so the number of queries only
+    depends on the includes, never on the number of objects.
+
+    :param model_class: model of the serialized objects
+    :param include: comma separated relationship paths, like "configuration,users"
+    :param fields: comma separated field names to keep, prefixed by the path of an included
+        relationship for its fields, like "name,configuration.chemical_type"
+    """
+
+    def __init__(self, model_class, include=None, fields=None):
+        self.model_class = model_class
+        # tree of included relationships, name to (related model, subtree)
+        self.tree = {}
+        # kept fields by dotted path of the included relationship, "" for the serialized objects
+        self.fields = {}
+        for path in filter(None, (include or "").split(",")):
+            self._include(path.strip())
+        for field in filter(None, (fields or "").split(",")):
+            self._keep(field.strip())
+
+    def _include(self, path):
+        names = path.split(".")
+        if len(names) > MAX_INCLUDE_DEPTH:
+            raise ValueError(f"Include '{path}' is deeper than {MAX_INCLUDE_DEPTH} relationships.")
+        model_class, tree = self.model_class, self.tree
+        for name in names:
+            if name not in Includes.get(model_class, ()):
+                raise ValueError(f"Include '{path}' invalid.")
+            related = getattr(model_class, name).property.mapper.class_
+            model_class, tree = tree.setdefault(name, (related, {}))
+
+    def _keep(self, field):
+        path, _, key = field.rpartition(".")
+        model_class = self._model_at(path)
+        if model_class is None:
+            raise ValueError(f"Field '{field}' is not on the resource or an included relationship.")
+        if key not in inspect(model_class).column_attrs:
+            raise ValueError(f"Field '{field}' invalid.")
+        # ids are always kept so clients can match the objects
+        self.fields.setdefault(path, {"id"}).add(key)
+
+    def _model_at(self, path):
+        model_class, tree = self.model_class, self.tree
+        for name in filter(None, path.split(".")):
+            if name not in tree:
+                return None
+            model_class, tree = tree[name]
+        return model_class
+
+    def __bool__(self):
+        return bool(self.tree or self.fields)
+
+    def models(self):
+        """
+        Models of every included relationship, whose tables the response depends on.
+        """
+        found = set()
+        def walk(tree):
+            for related, subtree in tree.values():
+                found.add(related)
+                walk(subtree)
+        walk(self.tree)
+        return found
+
+    def options(self):
+        """
+        Loader options eager loading every included relationship.
+        """
+        options = []
+        def walk(model_class, tree, parent):
+            for name, (related, subtree) in tree.items():
+                attribute = getattr(model_class, name)
+                load = selectinload if attribute.property.uselist else joinedload
+                # loaders are generative, every leaf gets its own option chained from the root
+                loader = load(attribute) if parent is None else getattr(parent, load.__name__)(attribute)
+                if subtree:
+                    walk(related, subtree, loader)
+                else:
+                    options.append(loader)
+        walk(self.model_class, self.tree, None)
+        return options
+
+    def _serialize(self, obj, tree, path):
+        serialized = serializer_for(type(obj))(obj)
+        keep = self.fields.get(path)
+        if keep is not None:
+            serialized = {key: value for key, value in serialized.items() if key in keep}
+        for name, (_, subtree) in tree.items():
+            related = getattr(obj, name)
+            related_path = f"{path}.{name}" if path else name
+            if related is None:
+                serialized[name] = None
+            elif isinstance(related, list):
+                serialized[name] = [self._serialize(item, subtree, related_path) for item in related]
+            else:
+                serialized[name] = self._serialize(related, subtree, related_path)
+        return serialized
+
+    def serialize(self, obj):
+        """
+        Serialize an object with its included relationships embedded under their names.
+        """
+        started = time.perf_counter()
+        serialized = self._serialize(obj, self.tree, "")
+        record_serialization(started)
+        return serialized
+
+    def serialize_all(self, objects):
+        """
+        Serialize a list of objects, see serialize().
+        """
+        started = time.perf_counter()
+        serialized = [self._serialize(obj, self.tree, "") for obj in objects]
+        record_serialization(started)
+        return serialized
+
+
+def embedding_args(model_class):
+    """
+    Parse the `include` and `fields` arguments of the current request.
+
+    :param model_class: model of the resource the route returns
+    :return: Embedding, otherwise raises ValueError if an include or field is invalid
+    """
+    return Embedding(model_class, request.args.get("include"), request.args.get("fields"))
+
+def included_models(model_class):
+    """
+    Models of the relationships the current request includes, empty if its includes are invalid.
+    """
+    try:
+        return embedding_args(model_class).models()
+    except ValueError:
+        return set()
@@ -0,0 +1,161 @@
+from sqlalchemy import event, make_url
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from .models import ARCHIVE_SCHEMA
+
+# named engine profiles, selected with the ENGINE_PROFILE setting
+#   default:  the engine Flask-SQLAlchemy builds from the URI, untouched
+#   sqlite:   WAL journaling and the SQLITE_* pragmas, set on every new connection
+#   postgres: sized connection pool with pre-ping and a server-side statement timeout
+EngineProfiles = {"default", "sqlite", "postgres"}
+
+# INSERT constructs of the databases supported, the rollups and the table versions
+# are maintained with their INSERT .. ON CONFLICT DO UPDATE
+UpsertDialects = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+
+def sqlite_pragmas(config):
+    """
+    PRAGMA statements of the sqlite profile, in the order they are executed.
+
+    :param config: application config
+    :return: list of (pragma, value) pairs
+    """
+    return [
+        ("journal_mode", "WAL"),
+        ("synchronous", config["SQLITE_SYNCHRONOUS"]),
+        ("busy_timeout", config["SQLITE_BUSY_TIMEOUT"]),
+        ("cache_size", config["SQLITE_CACHE_SIZE"]),
+        ("mmap_size", config["SQLITE_MMAP_SIZE"]),
+    ]
+
+def postgres_engine_options(config):
+    """
+    create_engine() arguments of the postgres profile.
+
+    :param config: application config
+    :return: dictionary of engine options
+    """
+    return {
+        "pool_size": config["POSTGRES_POOL_SIZE"],
+        "max_overflow": config["POSTGRES_MAX_OVERFLOW"],
+        "pool_timeout": config["POSTGRES_POOL_TIMEOUT"],
+        "pool_recycle": config["POSTGRES_POOL_RECYCLE"],
+        "pool_pre_ping": True,
+        "connect_args": {"options": f"-c statement_timeout={config['POSTGRES_STATEMENT_TIMEOUT']}"},
+    }
+
+def use_sqlite_pragmas(engine, pragmas):
+    """
+    Execute PRAGMA statements on every new DBAPI connection of an engine.
+
+    :param engine: SQLAlchemy engine of a SQLite database
+    :param pragmas: list of (pragma, value) pairs
+    """
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas:
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+def archive_execution_options(config):
+    """
+    Execution options translating the archive schema to where ARCHIVE_DATABASE puts it.
+
+    Every engine reading or creating the archive tables needs them.
+
+    :param config: application config
+    :return: dictionary of execution options
+    """
+    attached = config["ARCHIVE_DATABASE"] is not None
+    return {"schema_translate_map": {ARCHIVE_SCHEMA: ARCHIVE_SCHEMA if attached else None}}
+
+def attach_archive(engine, path):
+    """
+    Attach the SQLite file holding the archive tables to every new DBAPI connection of an engine.
+
+    :param engine: SQLAlchemy engine of a SQLite database
+    :param path: path of the archive database file, created on first use
+    """
+    @event.listens_for(engine, "connect")
+    def _attach(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (path,))
+        cursor.close()
+
+def engine_options(config):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS of the configured profile, merged over the explicit ones.
+
+    The archive tables are declared in the ARCHIVE_SCHEMA schema, which every engine
+    translates to the attached ARCHIVE_DATABASE or to the main database.
+
+    Must be called before db.init_app since Flask-SQLAlchemy creates the engines there.
+
+    :param config: application config
+    :return: dictionary of engine options
+    """
+    profile = config["ENGINE_PROFILE"]
+    if profile not in EngineProfiles:
+        raise ValueError(f"Engine profile '{profile}' invalid.")
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    backend = make_url(uri).get_backend_name()
+    if backend not in UpsertDialects:
+        raise ValueError(f"Database {backend} is not supported, use SQLite or PostgreSQL.")
+    if profile == "sqlite" and not uri.startswith("sqlite"):
+        raise ValueError(f"Engine profile 'sqlite' cannot be used with {uri.split(':', 1)[0]}.")
+    if profile == "postgres":
+        if not uri.startswith("postgres"):
+            raise ValueError(f"Engine profile 'postgres' cannot be used with {uri.split(':', 1)[0]}.")
+        options = {**postgres_engine_options(config), **options}
+
+    archive_database = config["ARCHIVE_DATABASE"]
+    if archive_database is not None and not uri.startswith("sqlite"):
+        raise ValueError(f"ARCHIVE_DATABASE cannot be used with {uri.split(':', 1)[0]}.")
+    options["execution_options"] = {**options.get("execution_options", {}), **archive_execution_options(config)}
+    return options
+
+def upsert_insert(session, model_class):
+    """
+    INSERT construct of the session's dialect for a model's table, which supports ON CONFLICT.
+
+    :param session: session the statement will be executed in
+    :param model_class: SQLAlchemy model class of the table
+    """
+    return UpsertDialects[session.get_bind(mapper=model_class).dialect.name](model_class.__table__)
+
+def begin_explicit(session, model_class):
+    """
+    Open the transaction of a session for a model's table with an explicit BEGIN on SQLite.
+
+    pysqlite emits BEGIN only before DML, so a SAVEPOINT sent first opens the transaction
+    itself and its RELEASE commits it. Beginning explicitly makes the savepoints of
+    begin_nested() commit or roll back with the rest of the session's transaction.
+
+    :param session: session whose transaction is opened
+    :param model_class: SQLAlchemy model class of a table the transaction writes
+    """
+    connection = session.connection(bind_arguments={"mapper": model_class})
+    if connection.dialect.name == "sqlite" and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN")
+
+def init_engine_profile(app, db):
+    """
+    Attach the connection listeners of the configured profile to the engines of an app,
+    and attach the archive database when ARCHIVE_DATABASE is set.
+
+    :param app: Flask application, db must already be initialized on it
+    :param db: Flask-SQLAlchemy extension
+    """
+    if app.config["ARCHIVE_DATABASE"] is not None:
+        with app.app_context():
+            attach_archive(db.engine, app.config["ARCHIVE_DATABASE"])
+    if app.config["ENGINE_PROFILE"] != "sqlite":
+        return
+    pragmas = sqlite_pragmas(app.config)
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == "sqlite":
+                use_sqlite_pragmas(engine, pragmas)
@@ -0,0 +1,233 @@
+from sqlalchemy import update, delete, bindparam, select, literal
+from .models import db, User, DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry, ArchiveModels
+from .rollups import RollupDeltas, apply_deltas
+from .utils import insert_returning_ids
+from .calibration import CALIBRATION_INPUTS, CALIBRATION_DERIVED, derive_calibrations, plant_concentration
+from .changes import record_changes, record_changes_from
+from .validation import ENTRY_SCHEMAS, CHANGE_DOSE_SCHEMA
+
+
+# -- VALIDATION ------------------------------------------------------
+def _validate_entry(item):
+    """
+    Validate a single entry against the schema of its type, see validation.py.
+
+    :return: tuple of (coerced entry, list of error messages), the entry is None if it has no valid type
+    """
+    if not isinstance(item, dict):
+        return None, ["entry must be an object"]
+    entry_type = item.get("type")
+    schema = ENTRY_SCHEMAS.get(entry_type)
+    if schema is None:
+        return None, [f"type '{entry_type}' invalid."]
+    entry, errors = schema.validate(item)
+    entry["type"] = entry_type
+    # calibration is required if changing dose
+    if item.get("change_dose") is not None and item.get("calibration") is None:
+        errors.append("change_dose requires a calibration")
+    return entry, errors
+
+def validate_entries(plant_id, items):
+    """
+    Validate the entries of a batch in one pass, with a single query for their users.
+
+    :param plant_id: id of the plant the entries are synced for
+    :param items: entry payloads
+    :return: list of (coerced entry, list of error messages) in input order, the entry is None if it has errors
+    """
+    validated = [_validate_entry(item) for item in items]
+    user_ids = plant_user_ids(plant_id, [entry.get("user_id") for entry, _ in validated if entry is not None])
+    results = []
+    for entry, errors in validated:
+        user_id = entry.get("user_id") if entry is not None else None
+        if user_id is not None and user_id not in user_ids:
+            errors.append(f"user {user_id} does not belong to plant")
+        results.append((None, errors) if errors else (entry, errors))
+    return results
+
+def plant_user_ids(plant_id, user_ids):
+    """
+    Find which of the given users belong to a plant, in a single query.
+
+    :param plant_id: id of the plant
+    :param user_ids: candidate user ids
+    :return: set of the user ids that belong to the plant
+    """
+    user_ids = {u for u in user_ids if isinstance(u, int) and not isinstance(u, bool)}
+    if not user_ids:
+        return set()
+    return set(db.session.scalars(
+        db.select(User.id).where(User.plant_id == plant_id, User.id.in_(user_ids))))
+
+
+# -- BULK INSERTS ------------------------------------------------------
+def insert_entries(session, plant_id, entries):
+    """
+    Insert a list of validated entries with set-based inserts.
+
+    Issues at most one INSERT per table plus one UPDATE linking the dosage entries
+    to their sections, and updates the plant's daily rollups; the caller owns the transaction.
+    The calculated calibration values are derived from the plant's chemical concentration, read
+    in the same transaction so a concurrent configuration update cannot leave them stale.
+
+    :param session: session to execute the statements in
+    :param plant_id: id of the plant the entries belong to
+    :param entries: validated entry payloads
+    :return: list of result dictionaries with the ids of each inserted entry, in input order
+    """
+    dosage = [e for e in entries if e["type"] == "dosage"]
+    raw_water = [e for e in entries if e["type"] == "raw_water"]
+
+    dosage_ids = insert_returning_ids(session, DosageEntry.__table__, [
+        {"user_id": e["user_id"], "created_at": e["created_at"], "is_deleted": False}
+        for e in dosage])
+    calibrated = [(e, dosage_id) for e, dosage_id in zip(dosage, dosage_ids) if e.get("calibration")]
+    if calibrated:
+        derive_calibrations([e["calibration"] for e, _ in calibrated], plant_concentration(session, plant_id))
+    calibration_ids = insert_returning_ids(session, CalibrationSection.__table__, [
+        {**{f: e["calibration"][f] for f in CALIBRATION_INPUTS + CALIBRATION_DERIVED}, "dosage_entry_id": dosage_id}
+        for e, dosage_id in calibrated])
+    calibration_by_entry = {dosage_id: c_id for (_, dosage_id), c_id in zip(calibrated, calibration_ids)}
+
+    changed = [(e, dosage_id) for e, dosage_id in zip(dosage, dosage_ids) if e.get("change_dose")]
+    change_dose_ids = insert_returning_ids(session, ChangeDoseSection.__table__, [
+        {**{f: e["change_dose"][f] for f in CHANGE_DOSE_SCHEMA.fields},
+         "dosage_entry_id": dosage_id,
+         "related_calibration_id": calibration_by_entry[dosage_id]}
+        for e, dosage_id in changed])
+    change_dose_by_entry = {dosage_id: c_id for (_, dosage_id), c_id in zip(changed, change_dose_ids)}
+
+    # link the dosage entries back to their sections
+    links = [
+        {"b_id": dosage_id,
+         "b_calibration_id": calibration_by_entry.get(dosage_id),
+         "b_change_dose_id": change_dose_by_entry.get(dosage_id)}
+        for dosage_id in calibration_by_entry]
+    if links:
+        table = DosageEntry.__table__
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(calibration_id=bindparam("b_calibration_id"), change_dose_id=bindparam("b_change_dose_id")),
+            links)
+
+    raw_water_ids = insert_returning_ids(session, RawWaterEntry.__table__, [
+        {"user_id": e["user_id"], "created_at": e["created_at"],
+         "utn": e["utn"], "turbidity_method": e.get("turbidity_method")}
+        for e in raw_water])
+
+    record_changes(session, "upsert", {
+        model_class: [(row_id, plant_id) for row_id in ids]
+        for model_class, ids in ((DosageEntry, dosage_ids), (CalibrationSection, calibration_ids),
+                                 (ChangeDoseSection, change_dose_ids), (RawWaterEntry, raw_water_ids))})
+
+    deltas = RollupDeltas()
+    for e in dosage:
+        calibration = e.get("calibration")
+        deltas.add_dosage(plant_id, e["created_at"], calibration["calculated_chemical_dose"] if calibration else None)
+    for e in raw_water:
+        deltas.add_turbidity(plant_id, e["created_at"], e["utn"])
+    apply_deltas(session, deltas)
+
+    created = {}
+    for e, dosage_id in zip(dosage, dosage_ids):
+        created[id(e)] = {
+            "type": "dosage",
+            "id": dosage_id,
+            "calibration_id": calibration_by_entry.get(dosage_id),
+            "change_dose_id": change_dose_by_entry.get(dosage_id)}
+    for e, raw_water_id in zip(raw_water, raw_water_ids):
+        created[id(e)] = {"type": "raw_water", "id": raw_water_id}
+    return [created[id(e)] for e in entries]
+
+
+# -- SOFT DELETES ------------------------------------------------------
+def soft_delete_dosage_entries(session, entry_ids, plant_id=None):
+    """
+    Mark dosage entries as deleted and retract them from the daily rollups.
+
+    Entries that do not exist, are already deleted or belong to another plant are ignored;
+    the caller owns the transaction.
+
+    :param session: session to execute the statements in
+    :param entry_ids: ids of the dosage entries to delete
+    :param plant_id: only delete the entries of this plant, None for any plant
+    :return: ids of the entries that were deleted
+    """
+    statement = (
+        select(DosageEntry.id, DosageEntry.created_at, User.plant_id, CalibrationSection.calculated_chemical_dose)
+        .join(User, User.id == DosageEntry.user_id)
+        .outerjoin(CalibrationSection, CalibrationSection.id == DosageEntry.calibration_id)
+        .where(DosageEntry.id.in_(entry_ids), DosageEntry.is_deleted.is_(False)))
+    if plant_id is not None:
+        statement = statement.where(User.plant_id == plant_id)
+    rows = session.execute(statement).all()
+    if not rows:
+        return []
+
+    deleted_ids = [row.id for row in rows]
+    session.execute(
+        update(DosageEntry.__table__)
+        .where(DosageEntry.__table__.c.id.in_(deleted_ids))
+        .values(is_deleted=True))
+    # soft deleted entries are gone for the clients
+    record_changes(session, "delete", {DosageEntry: [(row.id, row.plant_id) for row in rows]})
+
+    deltas = RollupDeltas()
+    for _, created_at, plant_id, dose in rows:
+        deltas.retract_dosage(plant_id, created_at, dose)
+    apply_deltas(session, deltas)
+    return deleted_ids
+
+
+# -- PLANT DELETION ------------------------------------------------------
+def delete_plant_entries(session, plant_id, hard=True):
+    """
+    Delete or soft delete every entry recorded by the users of a plant, with set-based statements.
+
+    Hard deletes remove the dosage entries with their calibration and change dose sections
+    and the raw water entries, archived ones included. Soft deletes only mark the dosage entries as deleted and keep
+    every row, like deleting a single user does. The caller owns the transaction.
+
+    :param session: session to execute the statements in
+    :param plant_id: id of the plant
+    :param hard: whether to remove the entry rows instead of marking them deleted
+    """
+    user_ids = select(User.id).where(User.plant_id == plant_id).scalar_subquery()
+    dosage = DosageEntry.__table__
+    if not hard:
+        record_changes_from(session, "delete", {DosageEntry: select(dosage.c.id, literal(plant_id)).where(
+            dosage.c.user_id.in_(user_ids), dosage.c.is_deleted.is_(False))})
+        session.execute(
+            update(dosage)
+            .where(dosage.c.user_id.in_(user_ids), dosage.c.is_deleted.is_(False))
+            .values(is_deleted=True))
+        return
+
+    dosage_ids = select(dosage.c.id).where(dosage.c.user_id.in_(user_ids)).scalar_subquery()
+    raw_water = RawWaterEntry.__table__
+    # tombstones of every row, before the rows are gone
+    record_changes_from(session, "delete", {
+        **{model_class: select(model_class.id, literal(plant_id)).where(model_class.dosage_entry_id.in_(dosage_ids))
+           for model_class in (ChangeDoseSection, CalibrationSection)},
+        DosageEntry: select(dosage.c.id, literal(plant_id)).where(dosage.c.user_id.in_(user_ids)),
+        RawWaterEntry: select(raw_water.c.id, literal(plant_id)).where(raw_water.c.user_id.in_(user_ids))})
+    # unlink the sections first, dosage entries and sections reference each other
+    session.execute(
+        update(dosage)
+        .where(dosage.c.user_id.in_(user_ids))
+        .values(calibration_id=None, change_dose_id=None))
+    for section in (ChangeDoseSection.__table__, CalibrationSection.__table__):
+        session.execute(delete(section).where(section.c.dosage_entry_id.in_(dosage_ids)))
+    session.execute(delete(dosage).where(dosage.c.user_id.in_(user_ids)))
+    session.execute(delete(raw_water).where(raw_water.c.user_id.in_(user_ids)))
+
+    # archived entries go too
+    archived_dosage = ArchiveModels[DosageEntry].__table__
+    archived_ids = select(archived_dosage.c.id).where(archived_dosage.c.user_id.in_(user_ids)).scalar_subquery()
+    for model_class in (ChangeDoseSection, CalibrationSection):
+        section = ArchiveModels[model_class].__table__
+        session.execute(delete(section).where(section.c.dosage_entry_id.in_(archived_ids)))
+    session.execute(delete(archived_dosage).where(archived_dosage.c.user_id.in_(user_ids)))
+    archived_raw_water = ArchiveModels[RawWaterEntry].__table__
+    session.execute(delete(archived_raw_water).where(archived_raw_water.c.user_id.in_(user_ids)))
@@ -0,0 +1,152 @@
+import csv
+import io
+import math
+from datetime import datetime
+from flask import Response, stream_with_context
+from flask import current_app as app
+from sqlalchemy import select, union_all
+from .models import db, User, DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry, ArchiveModels
+from .archive import reaches_archive
+
+ExportFormats = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# exported columns of each kind of history, in file order
+EXPORT_COLUMNS = {
+    "dosage": [
+        ("entry_id", DosageEntry.id),
+        ("created_at", DosageEntry.created_at),
+        ("user_id", DosageEntry.user_id),
+        ("user_name", User.name),
+        ("slider_position", CalibrationSection.slider_position),
+        ("inflow_rate", CalibrationSection.inflow_rate),
+        ("starting_volume", CalibrationSection.starting_volume),
+        ("ending_volume", CalibrationSection.ending_volume),
+        ("elapsed_seconds", CalibrationSection.elapsed_seconds),
+        ("calculated_flow_rate", CalibrationSection.calculated_flow_rate),
+        ("calculated_chemical_dose", CalibrationSection.calculated_chemical_dose),
+        ("slider_pos_chem_dose_ratio", CalibrationSection.slider_pos_chem_dose_ratio),
+        ("target_coagulant_dose", ChangeDoseSection.target_coagulant_dose),
+        ("new_slider_position", ChangeDoseSection.new_slider_position),
+    ],
+    "raw_water": [
+        ("entry_id", RawWaterEntry.id),
+        ("created_at", RawWaterEntry.created_at),
+        ("user_id", RawWaterEntry.user_id),
+        ("user_name", User.name),
+        ("utn", RawWaterEntry.utn),
+        ("turbidity_method", RawWaterEntry.turbidity_method),
+    ],
+}
+ExportKinds = set(EXPORT_COLUMNS)
+
+
+def _table_statement(kind, plant_id, start, end, archived=False):
+    """
+    Unordered SELECT of a plant's history in the hot tables or in the archive tables.
+    """
+    def table(model_class):
+        return ArchiveModels[model_class] if archived else model_class
+
+    entry = table(DosageEntry if kind == "dosage" else RawWaterEntry)
+    statement = (
+        select(*[
+            getattr(table(column.class_), column.key).label(name) if column.class_ is not User else column.label(name)
+            for name, column in EXPORT_COLUMNS[kind]])
+        .select_from(entry)
+        .join(User, User.id == entry.user_id)
+        .where(User.plant_id == plant_id))
+    if kind == "dosage":
+        calibration, change_dose = table(CalibrationSection), table(ChangeDoseSection)
+        statement = (
+            statement
+            .outerjoin(calibration, calibration.id == entry.calibration_id)
+            .outerjoin(change_dose, change_dose.id == entry.change_dose_id))
+        if not archived:
+            statement = statement.where(entry.is_deleted.is_(False))
+    if start is not None:
+        statement = statement.where(entry.created_at >= start)
+    if end is not None:
+        statement = statement.where(entry.created_at < end)
+    return statement
+
+def export_statement(kind, plant_id, start=None, end=None):
+    """
+    Single SELECT of a plant's history, oldest first.
+
+    Dosage entries are joined with their user and optional calibration and change dose
+    sections; deleted entries are left out. The archive tables are unioned in when the
+    time range reaches back into them.
+
+    :param kind: "dosage" or "raw_water"
+    :param plant_id: id of the plant
+    :param start: optional inclusive start of the time range
+    :param end: optional exclusive end of the time range
+    :return: Core SELECT whose columns follow EXPORT_COLUMNS[kind]
+    """
+    statement = _table_statement(kind, plant_id, start, end)
+    if reaches_archive(DosageEntry if kind == "dosage" else RawWaterEntry, start):
+        rows = union_all(statement, _table_statement(kind, plant_id, start, end, archived=True)).subquery()
+        return select(*rows.c).order_by(rows.c.created_at, rows.c.entry_id)
+    entry = DosageEntry if kind == "dosage" else RawWaterEntry
+    return statement.order_by(entry.created_at, entry.id)
+
+def _export_value(value):
+    """
+    Exported form of a value: ISO 8601 timestamps, None instead of non-finite floats.
+    """
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def stream_export(kind, export_format, statement, filename):
+    """
+    Stream the rows of an export statement as a CSV or NDJSON attachment.
+
+    Rows are read from a server-side cursor in chunks of STREAM_CHUNK_SIZE and each
+    chunk is sent before the next one is read, so memory stays flat whatever the row count.
+
+    :param kind: kind of history, selects the column names
+    :param export_format: "csv" or "ndjson"
+    :param statement: SELECT from export_statement()
+    :param filename: name of the attachment, without extension
+    :return: streamed response
+    """
+    chunk_size = app.config["STREAM_CHUNK_SIZE"]
+    names = [name for name, _ in EXPORT_COLUMNS[kind]]
+    dumps = app.json.dumps
+
+    def rows():
+        for row in db.session.execute(statement.execution_options(yield_per=chunk_size)):
+            yield [_export_value(value) for value in row]
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(names)
+        count = 0
+        for row in rows():
+            writer.writerow(row)
+            count += 1
+            if count % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_ndjson():
+        lines = []
+        for row in rows():
+            lines.append(dumps(dict(zip(names, row))))
+            if len(lines) == chunk_size:
+                yield "\n".join(lines) + "\n"
+                lines = []
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+    generate = generate_csv if export_format == "csv" else generate_ndjson
+    return Response(
+        stream_with_context(generate()),
+        mimetype=ExportFormats[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{export_format}"'})
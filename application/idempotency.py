@@ -0,0 +1,202 @@
+import atexit
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from functools import wraps
+from flask import request, current_app, make_response
+from sqlalchemy import select, insert, delete
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from .models import db, IdempotencyKey
+from .cache import LRUCache
+from .sharding import fan_out, shard_router
+from .utils import failure_response
+
+# longest key accepted, the size of the key column
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+    """
+    Responses of the POSTs sent with an Idempotency-Key header, replayed to their retries.
+
+    Every response is written to the idempotency_keys table, in its own transaction once the
+    route has committed, on the shard of the request's plant when entries are sharded. The
+    most recent ones are kept in an in-process LRU cache so a replay usually sends no query
+    at all. Responses are stored as (fingerprint, status, body, mimetype, expires_at). A
+    background thread deletes the expired keys every `evict_interval` seconds.
+
+    :param app: Flask application the evictor runs in
+    :param ttl: seconds a key is replayed for
+    :param maxsize: responses kept in memory
+    :param evict_interval: seconds between two deletions of the expired keys
+    """
+
+    def __init__(self, app, ttl=86400, maxsize=10000, evict_interval=300):
+        self.app = app
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        # keys of the requests being answered, a concurrent retry waits for them
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.replays = self.evicted = 0
+
+    def start(self):
+        """
+        Start the evictor thread, stopped when the interpreter exits.
+        """
+        self._thread = threading.Thread(target=self._run, name="idempotency-evictor", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def stop(self, timeout=None):
+        """
+        Stop the evictor thread.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def claim(self, key):
+        """
+        Mark a key as being answered.
+
+        :return: False if another request with the key is being answered
+        """
+        with self._lock:
+            if key in self._in_flight:
+                return False
+            self._in_flight.add(key)
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._in_flight.discard(key)
+
+    def lookup(self, key):
+        """
+        Stored response of a key, from the cache or with a single query.
+
+        :return: tuple of (fingerprint, status, body, mimetype, expires_at), None if unknown or expired
+        """
+        stored = self.cache.get(key)
+        if stored is None:
+            row = db.session.execute(
+                select(IdempotencyKey.fingerprint, IdempotencyKey.status, IdempotencyKey.body,
+                       IdempotencyKey.mimetype, IdempotencyKey.expires_at)
+                .where(IdempotencyKey.key == key)).first()
+            if row is None:
+                return None
+            stored = tuple(row)
+            self.cache.set(key, stored)
+        return stored if stored[4] > datetime.now() else None
+
+    def save(self, key, fingerprint, response):
+        """
+        Store the response of a key; when another process stored it first, its response is kept.
+
+        An expired row of the key the evictor has not deleted yet is replaced.
+        """
+        now = datetime.now()
+        stored = (fingerprint, response.status_code, response.get_data(), response.mimetype,
+                  now + timedelta(seconds=self.ttl))
+        try:
+            db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.expires_at <= now))
+            db.session.execute(insert(IdempotencyKey.__table__).values(
+                key=key, fingerprint=stored[0], status=stored[1], body=stored[2], mimetype=stored[3],
+                expires_at=stored[4]))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return
+        except SQLAlchemyError:
+            db.session.rollback()
+            self.app.logger.exception("Response of Idempotency-Key %s could not be stored", key)
+            return
+        self.cache.set(key, stored)
+
+    def replay(self, stored):
+        """
+        Response rebuilt from a stored one, marked with the Idempotent-Replayed header.
+        """
+        _, status, body, mimetype, _ = stored
+        self.replays += 1
+        response = current_app.response_class(body, status=status, mimetype=mimetype)
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    def evict(self):
+        """
+        Delete the expired keys from the table, of the catalog and of every shard.
+
+        :return: number of keys deleted
+        """
+        now = datetime.now()
+        def evict_expired():
+            return db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at <= now)).rowcount
+        deleted = fan_out(evict_expired)
+        if shard_router() is not None:
+            # keys of the requests of no plant
+            deleted.append(evict_expired())
+        db.session.commit()
+        self.evicted += sum(deleted)
+        return sum(deleted)
+
+    def _run(self):
+        while not self._stopped.wait(self.evict_interval):
+            with self.app.app_context():
+                try:
+                    self.evict()
+                except Exception:  # keep evicting later
+                    db.session.rollback()
+                    self.app.logger.exception("Eviction of the expired idempotency keys failed")
+                finally:
+                    db.session.remove()
+
+
+def _fingerprint():
+    digest = hashlib.sha256(f"{request.method} {request.full_path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+def idempotent(view):
+    """
+    Decorator replaying the stored response of a POST retried with the same Idempotency-Key.
+
+    A replay skips the route entirely, neither validating the payload nor reading the model
+    tables. Reusing a key for a different request is rejected with 422, and a retry arriving
+    while the first request is still being answered with 409. Server errors are not stored,
+    so the request can be retried. Requests without the header are answered as usual.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        store = current_app.extensions.get("idempotency")
+        key = request.headers.get("Idempotency-Key")
+        if store is None or key is None:
+            return view(*args, **kwargs)
+        if not 0 < len(key) <= MAX_KEY_LENGTH:
+            return failure_response(f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters.", 400)
+
+        fingerprint = _fingerprint()
+        stored = store.lookup(key)
+        if stored is None:
+            if not store.claim(key):
+                return (*failure_response("A request with this Idempotency-Key is in progress.", 409),
+                        {"Retry-After": "1"})
+            try:
+                # the first request may have been answered between the lookup and the claim
+                stored = store.lookup(key)
+                if stored is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code < 500:
+                        store.save(key, fingerprint, response)
+                    return response
+            finally:
+                store.release(key)
+        if stored[0] != fingerprint:
+            return failure_response("Idempotency-Key was already used for another request.", 422)
+        return store.replay(stored)
+    return wrapper
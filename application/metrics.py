@@ -0,0 +1,166 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+# upper bounds (seconds) of the latency histogram buckets, +Inf is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus sense: bucket counts, sum and count of observations.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics:
+    """
+    Per-route request, SQL and serialization metrics of an application.
+
+    Every value is keyed by the URL rule of the request, so the number of series stays
+    bounded by the number of routes whatever the URLs requested.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}  # route -> Histogram of request durations
+        self.requests = {}  # (method, route, status) -> count
+        self.sql_statements = {}  # route -> count
+        self.sql_seconds = {}  # route -> seconds
+        self.serialization_seconds = {}  # route -> seconds
+
+    def record(self, method, route, status, seconds, sql_statements, sql_seconds, serialization_seconds):
+        with self._lock:
+            histogram = self.latency.get(route)
+            if histogram is None:
+                histogram = self.latency[route] = Histogram()
+            histogram.observe(seconds)
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.sql_statements[route] = self.sql_statements.get(route, 0) + sql_statements
+            self.sql_seconds[route] = self.sql_seconds.get(route, 0.0) + sql_seconds
+            self.serialization_seconds[route] = self.serialization_seconds.get(route, 0.0) + serialization_seconds
+
+    def render(self, families=()):
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        :param families: extra (name, type, help, {labels: value}) metric families, labels being tuples of (name, value) pairs
+        :return: text of the exposition
+        """
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            family("http_requests_total", "counter", "Requests handled, by method, route and status.")
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+
+            family("http_request_duration_seconds", "histogram", "Time spent handling requests, by route.")
+            for route, histogram in sorted(self.latency.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f"http_request_duration_seconds_bucket{_labels(route=route, le=bound)} {cumulative}")
+                lines.append(f"http_request_duration_seconds_sum{_labels(route=route)} {histogram.sum!r}")
+                lines.append(f"http_request_duration_seconds_count{_labels(route=route)} {histogram.count}")
+
+            for name, values, help_text in (
+                    ("db_statements_total", self.sql_statements, "SQL statements executed, by route."),
+                    ("db_statement_duration_seconds_total", self.sql_seconds, "Time spent executing SQL, by route."),
+                    ("serialization_duration_seconds_total", self.serialization_seconds,
+                     "Time spent serializing models and encoding JSON, by route.")):
+                family(name, "counter", help_text)
+                for route, value in sorted(values.items()):
+                    lines.append(f"{name}{_labels(route=route)} {value!r}")
+
+        for name, kind, help_text, values in families:
+            family(name, kind, help_text)
+            for labels, value in sorted(values.items()):
+                lines.append(f"{name}{_labels(**dict(labels))} {value}")
+        return "\n".join(lines) + "\n"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+# -- REQUEST HOOKS ------------------------------------------------------
+def record_serialization(started):
+    """
+    Add the time elapsed since `started` (perf_counter) to the serialization time of the current request.
+    """
+    if has_request_context() and "metrics_started" in g:
+        g.metrics_serialization += time.perf_counter() - started
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_query_started"] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "metrics_started" in g:
+        elapsed = time.perf_counter() - conn.info["metrics_query_started"]
+        g.metrics_sql_count += 1
+        g.metrics_sql_seconds += elapsed
+        if g.metrics_statements is not None:
+            g.metrics_statements.append((elapsed, statement))
+
+def init_metrics(app, db):
+    """
+    Record the latency, SQL and serialization metrics of every request of an app.
+
+    Requests slower than SLOW_REQUEST_MS, when set, are logged with the SQL they executed.
+    Streamed responses are timed until their first byte.
+
+    :param app: Flask application, db must already be initialized on it
+    :param db: Flask-SQLAlchemy extension
+    :return: the RequestMetrics of the app, also available as app.extensions["metrics"]
+    """
+    metrics = app.extensions["metrics"] = RequestMetrics()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_seconds = 0.0
+        g.metrics_serialization = 0.0
+        g.metrics_slow_ms = app.config["SLOW_REQUEST_MS"]
+        g.metrics_statements = [] if g.metrics_slow_ms is not None else None
+
+    @app.after_request
+    def _record_request_metrics(response):
+        if "metrics_started" not in g:
+            return response
+        seconds = time.perf_counter() - g.metrics_started
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.record(request.method, route, response.status_code, seconds,
+                       g.metrics_sql_count, g.metrics_sql_seconds, g.metrics_serialization)
+        if g.metrics_slow_ms is not None and seconds * 1000 >= g.metrics_slow_ms:
+            app.logger.warning(
+                "Slow request %s %s: %.1f ms, %d SQL statements in %.1f ms\n%s",
+                request.method, request.full_path, seconds * 1000, g.metrics_sql_count, g.metrics_sql_seconds * 1000,
+                "\n".join(f"  {elapsed * 1000:8.2f} ms  {statement}" for elapsed, statement in g.metrics_statements))
+        return response
+
+    return metrics
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, DateTime, Integer, String, Boolean, ForeignKey, Float
+from sqlalchemy import Column, Date, DateTime, Integer, String, Boolean, ForeignKey, Float, Index, LargeBinary
+from sqlalchemy.orm import relationship
 from datetime import datetime 
 from . import db
 
@@ -20,7 +21,13 @@ class User(db.Model):
     phone_number = Column(String(15), unique=True, nullable=False)
 
     # Users/Operators must be associated with only one AguaClara plant 
-    plant_id = Column(Integer, ForeignKey("plants.id"), nullable=False)
+    plant_id = Column(Integer, ForeignKey("plants.id"), nullable=False, index=True)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    plant = relationship("Plant", back_populates="users")
+    # entries outlive their user, deleting a user never touches them
+    dosage_entries = relationship("DosageEntry", back_populates="user", passive_deletes="all", order_by="DosageEntry.id")
+    raw_water_entries = relationship("RawWaterEntry", back_populates="user", passive_deletes="all", order_by="RawWaterEntry.id")
 
 
 class Plant(db.Model):
@@ -34,6 +41,11 @@ class Plant(db.Model):
     name = Column(String(100), unique=True, nullable=False)
     phone_number = Column(String(15), unique=True, nullable=False)
     config_id = Column(Integer, ForeignKey("configurations.id"), nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    configuration = relationship("Configuration", back_populates="plant")
+    # plants are deleted with set-based statements that remove their users explicitly
+    users = relationship("User", back_populates="plant", passive_deletes="all", order_by="User.id")
 
 
 class Configuration(db.Model):
@@ -49,6 +61,9 @@ class Configuration(db.Model):
     chemical_concentration = Column(Float, nullable=False)
     num_filters = Column(Integer, nullable=False)
     num_clarifiers = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    plant = relationship("Plant", back_populates="configuration", uselist=False, passive_deletes="all")
 
 
 class DosageEntry(db.Model):
@@ -61,9 +76,14 @@ class DosageEntry(db.Model):
     Other optional relations: CalibrationSection, ChangeDoseSection
     """
     __tablename__ = "dosage_entries"
+    __table_args__ = (
+        # per-user time range scans for trends, also serves lookups by user_id alone
+        Index("ix_dosage_entries_user_id_created_at", "user_id", "created_at"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
-    created_at = Column(DateTime, default=datetime.now())
+    created_at = Column(DateTime, default=datetime.now, index=True)
     is_deleted = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     # SKIPPED FOR MVP: tank volumes
 
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -71,6 +91,11 @@ class DosageEntry(db.Model):
     calibration_id = Column(Integer, ForeignKey("calibrations.id"), nullable=True)
     change_dose_id = Column(Integer, ForeignKey("change_doses.id"), nullable=True)
 
+    user = relationship("User", back_populates="dosage_entries")
+    # entries and their sections reference each other, the entry's side is written after both rows exist
+    calibration = relationship("CalibrationSection", foreign_keys=[calibration_id], post_update=True)
+    change_dose = relationship("ChangeDoseSection", foreign_keys=[change_dose_id], post_update=True)
+
 
 class CalibrationSection(db.Model): 
     """
@@ -89,7 +114,9 @@ class CalibrationSection(db.Model):
     calculated_chemical_dose = Column(Float, nullable=False)
     slider_pos_chem_dose_ratio = Column(Float, nullable=False)
     
-    dosage_entry_id = Column(Integer, ForeignKey("dosage_entries.id"), nullable=False)
+    dosage_entry_id = Column(Integer, ForeignKey("dosage_entries.id"), nullable=False, index=True)
+
+    dosage_entry = relationship("DosageEntry", foreign_keys=[dosage_entry_id])
 
 
 class ChangeDoseSection(db.Model):
@@ -104,9 +131,12 @@ class ChangeDoseSection(db.Model):
     target_coagulant_dose = Column(Float, nullable=False)
     new_slider_position = Column(Float, nullable=False)
 
-    dosage_entry_id = Column(Integer, ForeignKey("dosage_entries.id"), nullable=False)
+    dosage_entry_id = Column(Integer, ForeignKey("dosage_entries.id"), nullable=False, index=True)
     related_calibration_id = Column(Integer, ForeignKey("calibrations.id"), nullable=True)
 
+    dosage_entry = relationship("DosageEntry", foreign_keys=[dosage_entry_id])
+    related_calibration = relationship("CalibrationSection")
+
 
 class RawWaterEntry(db.Model):
     """
@@ -116,12 +146,205 @@ class RawWaterEntry(db.Model):
     Do not delete associated Raw Water Entries if User is deleted. 
     """
     __tablename__ = "raw_water_entries"
+    __table_args__ = (
+        # per-user time range scans for trends, also serves lookups by user_id alone
+        Index("ix_raw_water_entries_user_id_created_at", "user_id", "created_at"),
+        # latest readings of a user, read by the turbidity monitor's warm start
+        Index("ix_raw_water_entries_user_id_id", "user_id", "id"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=datetime.now, index=True)
     utn = Column(Integer, nullable=False)
     turbidity_method = Column(String, nullable=True)
 
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
 
+    user = relationship("User", back_populates="raw_water_entries")
+
+
+class PlantDailyRollup(db.Model):
+    """
+    Plant Daily Rollup Model
+
+    Per-plant daily aggregates of the entry models, maintained incrementally in the same
+    transaction as every entry insert or soft-delete. Deleted Dosage Entries are excluded.
+    """
+    __tablename__ = "plant_daily_rollups"
+    plant_id = Column(Integer, ForeignKey("plants.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+
+    dosage_count = Column(Integer, nullable=False, default=0)
+    calibration_count = Column(Integer, nullable=False, default=0)
+    # calculated_chemical_dose of the calibrations
+    dose_sum = Column(Float, nullable=False, default=0.0)
+    dose_min = Column(Float, nullable=True)
+    dose_max = Column(Float, nullable=True)
+    # utn of the raw water entries
+    turbidity_count = Column(Integer, nullable=False, default=0)
+    turbidity_sum = Column(Float, nullable=False, default=0.0)
+    turbidity_min = Column(Float, nullable=True)
+    turbidity_max = Column(Float, nullable=True)
+
+
+class TableVersion(db.Model):
+    """
+    Table Version Model
+
+    Version counter of a table, bumped in the same transaction as every write to it.
+    Used to derive ETags for conditional GETs.
+    """
+    __tablename__ = "table_versions"
+    table_name = Column(String(100), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ChangeLog(db.Model):
+    """
+    Change Log Model
+
+    One row per write to a synced catalog table, numbered by a monotonic sequence. Deletes and
+    soft deletes are kept as tombstones so clients syncing incrementally can drop the rows.
+    Writes to the entry tables are logged in the Entry Change Log instead.
+    """
+    __tablename__ = "change_log"
+    __table_args__ = (
+        # incremental sync of a single plant
+        Index("ix_change_log_plant_id_seq", "plant_id", "seq"),
+    )
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String(100), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    # "upsert" or "delete"
+    op = Column(String(10), nullable=False)
+    # plant the row belongs to, used to sync a single plant
+    plant_id = Column(Integer, nullable=True)
+
+
+class EntryChangeLog(db.Model):
+    """
+    Entry Change Log Model
+
+    Change Log of the entry tables and their sections, kept next to the entries so it lives
+    in the shard of their plant when entries are sharded, with a sequence of its own.
+    """
+    __tablename__ = "entry_change_log"
+    __table_args__ = (
+        Index("ix_entry_change_log_plant_id_seq", "plant_id", "seq"),
+    )
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String(100), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    # "upsert" or "delete"
+    op = Column(String(10), nullable=False)
+    plant_id = Column(Integer, nullable=True)
+
+
+class IdempotencyKey(db.Model):
+    """
+    Idempotency Key Model
+
+    Response of a POST sent with an Idempotency-Key header, replayed when the client
+    retries the request with the same key until the key expires.
+    """
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True)
+    # digest of the method, path and body of the request, a reused key must match it
+    fingerprint = Column(String(64), nullable=False)
+    status = Column(Integer, nullable=False)
+    body = Column(LargeBinary, nullable=False)
+    mimetype = Column(String(100), nullable=False)
+    # expired keys are deleted in the background
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+# --------ARCHIVE--------
+# schema of the archive tables, translated to the main database or an attached SQLite file (see engine.py)
+ARCHIVE_SCHEMA = "archive"
+
+class ArchivedDosageEntry(db.Model):
+    """
+    Archived Dosage Entry Model
+
+    Dosage Entries older than the archive horizon, moved out of the hot table by archive.py.
+    Soft-deleted entries are purged instead of archived. References are kept as plain ids.
+    """
+    __tablename__ = "archived_dosage_entries"
+    __table_args__ = (
+        Index("ix_archived_dosage_entries_user_id_created_at", "user_id", "created_at"),
+        {"schema": ARCHIVE_SCHEMA},
+    )
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+    user_id = Column(Integer, nullable=False)
+    calibration_id = Column(Integer, nullable=True)
+    change_dose_id = Column(Integer, nullable=True)
+    archived_at = Column(DateTime, default=datetime.now)
+
+
+class ArchivedCalibrationSection(db.Model):
+    """
+    Archived Calibration Section Model
+
+    Calibration Sections of the Archived Dosage Entries.
+    """
+    __tablename__ = "archived_calibrations"
+    __table_args__ = {"schema": ARCHIVE_SCHEMA}
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    slider_position = Column(Float, nullable=False)
+    inflow_rate = Column(Integer, nullable=False)
+    starting_volume = Column(Integer, nullable=False)
+    ending_volume = Column(Integer, nullable=False)
+    elapsed_seconds = Column(Integer, nullable=False)
+    calculated_flow_rate = Column(Float, nullable=False)
+    calculated_chemical_dose = Column(Float, nullable=False)
+    slider_pos_chem_dose_ratio = Column(Float, nullable=False)
+
+    dosage_entry_id = Column(Integer, nullable=False, index=True)
+
+
+class ArchivedChangeDoseSection(db.Model):
+    """
+    Archived Change Dose Section Model
+
+    Change Dose Sections of the Archived Dosage Entries.
+    """
+    __tablename__ = "archived_change_doses"
+    __table_args__ = {"schema": ARCHIVE_SCHEMA}
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    target_coagulant_dose = Column(Float, nullable=False)
+    new_slider_position = Column(Float, nullable=False)
+
+    dosage_entry_id = Column(Integer, nullable=False, index=True)
+    related_calibration_id = Column(Integer, nullable=True)
+
+
+class ArchivedRawWaterEntry(db.Model):
+    """
+    Archived Raw Water Entry Model
+
+    Raw Water Entries older than the archive horizon, moved out of the hot table by archive.py.
+    """
+    __tablename__ = "archived_raw_water_entries"
+    __table_args__ = (
+        Index("ix_archived_raw_water_entries_user_id_created_at", "user_id", "created_at"),
+        {"schema": ARCHIVE_SCHEMA},
+    )
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+    utn = Column(Integer, nullable=False)
+    turbidity_method = Column(String, nullable=True)
+
+    user_id = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.now)
+
+# hot model -> its archive
+ArchiveModels = {
+    DosageEntry: ArchivedDosageEntry,
+    CalibrationSection: ArchivedCalibrationSection,
+    ChangeDoseSection: ArchivedChangeDoseSection,
+    RawWaterEntry: ArchivedRawWaterEntry,
+}
+
 
 # --------MODELS NOT USED FOR MVP--------
 # class TankVolumeSection(db.Model):
@@ -0,0 +1,369 @@
+from datetime import date, datetime, timedelta
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, insert, update, delete, bindparam, case, func, and_, or_
+from .models import db, User, DosageEntry, CalibrationSection, RawWaterEntry, PlantDailyRollup, ArchiveModels
+from .sharding import on_shards
+from .engine import upsert_insert
+
+COUNT_FIELDS = ("dosage_count", "calibration_count", "turbidity_count")
+SUM_FIELDS = ("dose_sum", "turbidity_sum")
+EXTREME_FIELDS = (("dose_min", "dose_max"), ("turbidity_min", "turbidity_max"))
+ROLLUP_FIELDS = COUNT_FIELDS + SUM_FIELDS + tuple(f for pair in EXTREME_FIELDS for f in pair)
+
+
+def empty_rollup():
+    """
+    Aggregates of a day without any entries.
+    """
+    rollup = {field: 0 for field in COUNT_FIELDS}
+    rollup.update({field: 0.0 for field in SUM_FIELDS})
+    rollup.update({field: None for pair in EXTREME_FIELDS for field in pair})
+    return rollup
+
+def _merge_extremes(rollup, lo, hi, value):
+    if rollup[lo] is None or value < rollup[lo]:
+        rollup[lo] = value
+    if rollup[hi] is None or value > rollup[hi]:
+        rollup[hi] = value
+
+def _as_date(day):
+    """
+    Normalize a day returned by the database to a date.
+    """
+    if isinstance(day, str):
+        return date.fromisoformat(day[:10])
+    if isinstance(day, datetime):
+        return day.date()
+    return day
+
+
+class RollupDeltas:
+    """
+    Changes to the daily rollups caused by a set of inserted or soft-deleted entries.
+
+    Counts and sums are applied as increments. Minimums and maximums can only be
+    merged on insert; days losing a value are recomputed from their own entries.
+    A set holds either insertions or retractions, never both.
+    """
+
+    def __init__(self):
+        self.days = {}
+        self.retracted = set()
+
+    def _rollup(self, plant_id, day):
+        key = (plant_id, day)
+        if key not in self.days:
+            self.days[key] = empty_rollup()
+        return self.days[key]
+
+    def add_dosage(self, plant_id, created_at, dose=None):
+        """
+        Record a new dosage entry, with the chemical dose of its calibration if it has one.
+        """
+        rollup = self._rollup(plant_id, created_at.date())
+        rollup["dosage_count"] += 1
+        if dose is not None:
+            rollup["calibration_count"] += 1
+            rollup["dose_sum"] += dose
+            _merge_extremes(rollup, "dose_min", "dose_max", dose)
+
+    def retract_dosage(self, plant_id, created_at, dose=None):
+        """
+        Record a soft-deleted dosage entry, with the chemical dose of its calibration if it has one.
+        """
+        rollup = self._rollup(plant_id, created_at.date())
+        rollup["dosage_count"] -= 1
+        if dose is not None:
+            rollup["calibration_count"] -= 1
+            rollup["dose_sum"] -= dose
+            self.retracted.add((plant_id, created_at.date()))
+
+    def add_turbidity(self, plant_id, created_at, utn):
+        """
+        Record a new raw water entry.
+        """
+        rollup = self._rollup(plant_id, created_at.date())
+        rollup["turbidity_count"] += 1
+        rollup["turbidity_sum"] += utn
+        _merge_extremes(rollup, "turbidity_min", "turbidity_max", utn)
+
+
+# -- INCREMENTAL MAINTENANCE ------------------------------------------------------
+def _least(column, value):
+    return case((value.is_(None), column), (column.is_(None), value), (value < column, value), else_=column)
+
+def _greatest(column, value):
+    return case((value.is_(None), column), (column.is_(None), value), (value > column, value), else_=column)
+
+def apply_deltas(session, deltas):
+    """
+    Apply rollup changes with one upsert for the added entries and one UPDATE for the retracted ones.
+
+    The upsert adds the increments to the day's row or inserts it, so concurrent syncs
+    creating the same day never conflict. Runs in the caller's transaction so the rollups
+    commit together with the entries.
+
+    :param session: session to execute the statements in
+    :param deltas: RollupDeltas to apply
+    """
+    if not deltas.days:
+        return
+    table = PlantDailyRollup.__table__
+
+    added = [
+        {"plant_id": plant_id, "day": day, **rollup}
+        for (plant_id, day), rollup in deltas.days.items() if (plant_id, day) not in deltas.retracted]
+    if added:
+        statement = upsert_insert(session, PlantDailyRollup)
+        values = {field: table.c[field] + statement.excluded[field] for field in COUNT_FIELDS + SUM_FIELDS}
+        for lo, hi in EXTREME_FIELDS:
+            values[lo] = _least(table.c[lo], statement.excluded[lo])
+            values[hi] = _greatest(table.c[hi], statement.excluded[hi])
+        session.execute(
+            statement.on_conflict_do_update(index_elements=[table.c.plant_id, table.c.day], set_=values),
+            added)
+
+    # retracted entries were counted in rows that already exist
+    retracted = {key: rollup for key, rollup in deltas.days.items() if key in deltas.retracted}
+    if retracted:
+        _increment_existing(session, retracted)
+        _recompute_dose_extremes(session, deltas.retracted)
+
+def _increment_existing(session, days):
+    """
+    Add increments to the counts and sums of existing rollup rows, with one executemany UPDATE,
+    and delete the rows left without any entry, like a rebuild would not write them.
+
+    :param days: dictionary of (plant_id, day) to the increments of the count and sum fields
+    """
+    table = PlantDailyRollup.__table__
+    session.execute(
+        update(table)
+        .where(table.c.plant_id == bindparam("b_plant_id"), table.c.day == bindparam("b_day"))
+        .values({field: table.c[field] + bindparam(f"d_{field}") for field in COUNT_FIELDS + SUM_FIELDS}),
+        [{"b_plant_id": plant_id, "b_day": day, **{f"d_{field}": rollup[field] for field in COUNT_FIELDS + SUM_FIELDS}}
+         for (plant_id, day), rollup in days.items()])
+    session.execute(
+        delete(table)
+        .where(table.c.plant_id == bindparam("b_plant_id"), table.c.day == bindparam("b_day"),
+               *[table.c[field] == 0 for field in COUNT_FIELDS]),
+        [{"b_plant_id": plant_id, "b_day": day} for plant_id, day in days])
+
+def _recompute_dose_extremes(session, keys):
+    """
+    Recompute the dose minimum and maximum of single days from their calibrations.
+
+    Only reads the hot tables, archived days are never split and cannot be soft-deleted from.
+    """
+    table = PlantDailyRollup.__table__
+    for plant_id, day in keys:
+        start = datetime.combine(day, datetime.min.time())
+        lo, hi = session.execute(
+            select(func.min(CalibrationSection.calculated_chemical_dose),
+                   func.max(CalibrationSection.calculated_chemical_dose))
+            .join(DosageEntry, DosageEntry.id == CalibrationSection.dosage_entry_id)
+            .join(User, User.id == DosageEntry.user_id)
+            .where(User.plant_id == plant_id,
+                   DosageEntry.is_deleted.is_(False),
+                   DosageEntry.created_at >= start,
+                   DosageEntry.created_at < start + timedelta(days=1))).one()
+        session.execute(
+            update(table)
+            .where(table.c.plant_id == plant_id, table.c.day == day)
+            .values(dose_min=lo, dose_max=hi))
+
+def retract_user(session, plant_id, user_id):
+    """
+    Retract the entries of a user about to be deleted from the daily rollups of its plant.
+
+    The user's entries, archived ones included, are aggregated by day over the
+    (user_id, created_at) indexes and subtracted from the stored days. The minimum and
+    maximum of a day are only recomputed, without the user's entries, on the days the user
+    held one of them. Must run before the user is deleted; the caller owns the transaction.
+
+    :param session: session to execute the statements in
+    :param plant_id: id of the user's plant
+    :param user_id: id of the user
+    """
+    user_days = compute_rollups(session, plant_id, user_id=user_id)
+    if not user_days:
+        return
+    _increment_existing(session, {
+        key: {field: -rollup[field] for field in COUNT_FIELDS + SUM_FIELDS} for key, rollup in user_days.items()})
+
+    table = PlantDailyRollup.__table__
+    extreme_fields = [field for pair in EXTREME_FIELDS for field in pair]
+    stored = session.execute(
+        select(table.c.day, *[table.c[field] for field in extreme_fields])
+        .where(table.c.plant_id == plant_id, table.c.day.in_([day for _, day in user_days])))
+    held = [
+        _as_date(day) for day, *extremes in stored
+        if any(value is not None and user_days[(plant_id, _as_date(day))][field] == value
+               for field, value in zip(extreme_fields, extremes))]
+    if not held:
+        return
+    remaining = compute_rollups(session, plant_id, exclude_user_id=user_id, days=held)
+    session.execute(
+        update(table)
+        .where(table.c.plant_id == bindparam("b_plant_id"), table.c.day == bindparam("b_day"))
+        .values({field: bindparam(f"v_{field}") for field in extreme_fields}),
+        [{"b_plant_id": plant_id, "b_day": day,
+          **{f"v_{field}": remaining.get((plant_id, day), empty_rollup())[field] for field in extreme_fields}}
+         for day in held])
+
+
+# -- REBUILD AND CONSISTENCY CHECK ------------------------------------------------------
+def compute_rollups(session, plant_id=None, user_id=None, exclude_user_id=None, days=None):
+    """
+    Compute the daily rollups from scratch with three grouped queries over the entry tables,
+    and three more over the archive tables.
+
+    :param session: session to execute the queries in
+    :param plant_id: only compute the rollups of this plant, None for every plant
+    :param user_id: only count the entries of this user, None for every user
+    :param exclude_user_id: leave out the entries of this user
+    :param days: only compute these days, None for every day
+    :return: dictionary of (plant_id, day) to rollup values
+    """
+    rollups = {}
+
+    def rollup(plant, day):
+        key = (plant, _as_date(day))
+        if key not in rollups:
+            rollups[key] = empty_rollup()
+        return rollups[key]
+
+    def for_plant(query, entry):
+        if plant_id is not None:
+            query = query.where(User.plant_id == plant_id)
+        if user_id is not None:
+            query = query.where(entry.user_id == user_id)
+        if exclude_user_id is not None:
+            query = query.where(entry.user_id != exclude_user_id)
+        if days is not None:
+            starts = [datetime.combine(day, datetime.min.time()) for day in days]
+            query = query.where(or_(*(
+                and_(entry.created_at >= start, entry.created_at < start + timedelta(days=1)) for start in starts)))
+        return query
+
+    def merge(rollup, count_field, sum_field, extremes, count, total, lo, hi):
+        rollup[count_field] += count
+        rollup[sum_field] += total
+        for value in (lo, hi):
+            _merge_extremes(rollup, *extremes, value)
+
+    for archived in (False, True):
+        def table(model_class):
+            return ArchiveModels[model_class] if archived else model_class
+        entry, calibration, raw_water = table(DosageEntry), table(CalibrationSection), table(RawWaterEntry)
+
+        def not_deleted(query):
+            # soft-deleted entries are purged instead of archived
+            return query if archived else query.where(entry.is_deleted.is_(False))
+
+        dosage_day = func.date(entry.created_at)
+        dosage = for_plant(not_deleted(
+            select(User.plant_id, dosage_day, func.count(entry.id))
+            .join(User, User.id == entry.user_id)
+            .group_by(User.plant_id, dosage_day)), entry)
+        for plant, day, count in session.execute(dosage):
+            rollup(plant, day)["dosage_count"] += count
+
+        dose = calibration.calculated_chemical_dose
+        calibrations = for_plant(not_deleted(
+            select(User.plant_id, dosage_day, func.count(calibration.id),
+                   func.sum(dose), func.min(dose), func.max(dose))
+            .join(entry, entry.id == calibration.dosage_entry_id)
+            .join(User, User.id == entry.user_id)
+            .group_by(User.plant_id, dosage_day)), entry)
+        for plant, day, count, total, lo, hi in session.execute(calibrations):
+            merge(rollup(plant, day), "calibration_count", "dose_sum", EXTREME_FIELDS[0], count, total, lo, hi)
+
+        raw_water_day = func.date(raw_water.created_at)
+        utn = raw_water.utn
+        turbidity = for_plant(
+            select(User.plant_id, raw_water_day, func.count(raw_water.id),
+                   func.sum(utn), func.min(utn), func.max(utn))
+            .join(User, User.id == raw_water.user_id)
+            # entries of the first schema have no timestamp, and no day
+            .where(raw_water.created_at.is_not(None))
+            .group_by(User.plant_id, raw_water_day), raw_water)
+        for plant, day, count, total, lo, hi in session.execute(turbidity):
+            merge(rollup(plant, day), "turbidity_count", "turbidity_sum", EXTREME_FIELDS[1], count, total, lo, hi)
+
+    return rollups
+
+def rebuild_rollups(session, plant_id=None):
+    """
+    Replace the stored daily rollups with freshly computed ones, in bulk.
+
+    :param session: session to execute the statements in; the caller commits
+    :param plant_id: only rebuild the rollups of this plant, None for every plant
+    :return: number of rollup rows written
+    """
+    table = PlantDailyRollup.__table__
+    rollups = compute_rollups(session, plant_id)
+    clear = delete(table)
+    if plant_id is not None:
+        clear = clear.where(table.c.plant_id == plant_id)
+    session.execute(clear)
+    if rollups:
+        session.execute(insert(table), [
+            {"plant_id": plant, "day": day, **values} for (plant, day), values in rollups.items()])
+    return len(rollups)
+
+def _differs(stored, expected):
+    if stored is None or expected is None:
+        return stored != expected
+    return abs(stored - expected) > 1e-6 * max(1.0, abs(expected))
+
+def check_rollups(session, plant_id=None):
+    """
+    Compare the stored daily rollups against freshly computed ones.
+
+    :param session: session to execute the queries in
+    :param plant_id: only check the rollups of this plant, None for every plant
+    :return: list of mismatches, each with the plant, day, field, stored and expected value
+    """
+    expected = compute_rollups(session, plant_id)
+    query = select(PlantDailyRollup)
+    if plant_id is not None:
+        query = query.where(PlantDailyRollup.plant_id == plant_id)
+    stored = {
+        (r.plant_id, r.day): {field: getattr(r, field) for field in ROLLUP_FIELDS}
+        for r in session.scalars(query)}
+
+    mismatches = []
+    for key in sorted(set(expected) | set(stored)):
+        want = expected.get(key, empty_rollup())
+        have = stored.get(key, empty_rollup())
+        for field in ROLLUP_FIELDS:
+            if _differs(have[field], want[field]):
+                mismatches.append({
+                    "plant_id": key[0], "day": key[1].isoformat(),
+                    "field": field, "stored": have[field], "expected": want[field]})
+    return mismatches
+
+
+# -- COMMANDS ------------------------------------------------------
+rollups_cli = AppGroup("rollups", help="Maintain the plant daily rollups.")
+
+@rollups_cli.command("rebuild")
+@click.option("--plant-id", type=int, default=None, help="Only rebuild this plant.")
+def rebuild_command(plant_id):
+    """Recompute the daily rollups from the entry tables."""
+    written = sum(on_shards(plant_id, lambda: rebuild_rollups(db.session, plant_id)))
+    db.session.commit()
+    click.echo(f"Rebuilt {written} daily rollups.")
+
+@rollups_cli.command("check")
+@click.option("--plant-id", type=int, default=None, help="Only check this plant.")
+def check_command(plant_id):
+    """Report daily rollups that disagree with the entry tables."""
+    mismatches = [m for found in on_shards(plant_id, lambda: check_rollups(db.session, plant_id)) for m in found]
+    for m in mismatches:
+        click.echo(f"plant {m['plant_id']} {m['day']} {m['field']}: stored {m['stored']}, expected {m['expected']}")
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} rollup mismatches found.")
+    click.echo("Rollups are consistent.")
@@ -1,155 +1,676 @@
-from flask import request
+import math
+from flask import request, Response
 from flask import current_app as app
-from .models import db, ChemicalTypes, TankLabels, Plant, Configuration, User
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import or_
-from .utils import extract_fields, serialize_model, success_response, failure_response
+from .models import db, Plant, Configuration, User
+from .models import DosageEntry, PlantDailyRollup
+from .entries import validate_entries, insert_entries, soft_delete_dosage_entries, \
+    delete_plant_entries
+from .trends import Metrics, BucketSizes, metric_trend
+from .serializers import row_select, row_serializer_for, serialize_rows
+from .versions import bump_versions, conditional
+from .idempotency import idempotent
+from .cache import plant_cache, plant_by_id, plant_by_name, invalidate_plant
+from .calibration import recompute_plant_calibrations
+from .dose_model import dose_models, dose_model, record_calibrations, invalidate_dose_model
+from .turbidity import turbidity_monitor, record_turbidity
+from .write_behind import QueueFull
+from .export import ExportFormats, ExportKinds, export_statement, stream_export
+from .rollups import rebuild_rollups, retract_user
+from .changes import record_changes, record_changes_from, changes_since, parse_sync_token, sync_token
+from .embedding import embedding_args
+from .sharding import shard_router, use_shard
+from .engine import begin_explicit
+from .validation import PLANT_SCHEMA, CONFIGURATION_SCHEMA, USER_SCHEMA
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy import delete, select, literal
+from .utils import serialize_model, success_response, failure_response, \
+    page_args, keyset_page, stream_json_array, wants_stream, time_range_args, insert_row, insert_returning_ids, \
+    unique_violation, batch_status
 
 # -- PLANT ROUTES ------------------------------------------------------
 @app.route("/api/plants/", methods=["POST"])
+@idempotent
 def create_plant():
     """
     Endpoint for creating a plant
     """
-    body = request.json
-    required_fields = [
-    "name",
-    "phone_number",
-    "chemical_type",
-    "chemical_concentration",
-    "num_filters",
-    "num_clarifiers"
-    ]
+    values, errors = PLANT_SCHEMA.validate(request.json)
+    if errors:
+        return failure_response(f"Plant invalid: {'; '.join(errors)}", 400)
+    name, phone_number = values["name"], values["phone_number"]
 
-    extracted_fields, missing_fields = extract_fields(body, *required_fields)
-    if missing_fields:
-        return failure_response(f"Plant missing {', '.join(missing_fields)}", 404)
-    name, phone_number, chemical_type, chemical_concentration, num_filters, num_clarifiers = extracted_fields
-
-    if chemical_type not in ChemicalTypes:
-        return failure_response(f"Chemical '{chemical_type}' invalid.", 400)
-
-    # handles uniqueness constraints
-    # duplicate plants can appear as Plants that have the same name or the same number
-    existing_name = existing_number = Plant.query.filter(or_(Plant.name == name, Plant.phone_number == phone_number)).first() 
-    if existing_name is not None:
-        if existing_name.name == body["name"]:
-            return failure_response(f"Plant '{name}' already exists", 409)
-        if existing_number.phone_number == body["phone_number"]:
-            return failure_response(f"Phone number '{phone_number}' already exists.", 409)
+    # uniqueness of the name and phone number is enforced by the UNIQUE constraints
     try: 
-        new_config = Configuration(
-            chemical_type=chemical_type,
-            chemical_concentration=chemical_concentration,
-            num_filters=num_filters,
-            num_clarifiers=num_clarifiers)
-        db.session.add(new_config)
-        db.session.flush() # in event, new_plant fails, do not keep the new_config entry
-
-        new_plant = Plant(
-            name=name,
-            phone_number=phone_number, 
-            config_id=new_config.id)
-        db.session.add(new_plant)
+        serialized_plant = insert_plant(**values)
+        bump_versions(db.session, Plant, Configuration)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        message = plant_conflict(e, name, phone_number)
+        if message is None:
+            return failure_response("Internal Server Error", 500)
+        return failure_response(message, 409)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return failure_response("Internal Server Error", 500)
+
+    invalidate_plant(serialized_plant["id"], name)
+    return success_response(serialized_plant, 201)
+    # return success_response(serialized_plant, 201, headers={"Location": f"/api/plants/{serialized_plant['id']}"})
+
+def insert_plant(name, phone_number, chemical_type, chemical_concentration, num_filters, num_clarifiers):
+    """
+    Insert a plant and its configuration, one INSERT .. RETURNING each
+
+    :return: serialized plant with its serialized configuration under "config_id"
+    """
+    serialized_config = insert_row(Configuration, {
+        "chemical_type": chemical_type,
+        "chemical_concentration": chemical_concentration,
+        "num_filters": num_filters,
+        "num_clarifiers": num_clarifiers})
+    serialized_plant = insert_row(Plant, {
+        "name": name,
+        "phone_number": phone_number,
+        "config_id": serialized_config["id"]})
+    record_changes(db.session, "upsert", {
+        Configuration: [(serialized_config["id"], serialized_plant["id"])],
+        Plant: [(serialized_plant["id"], serialized_plant["id"])]})
+    serialized_plant['config_id'] = serialized_config
+    return serialized_plant
+
+def plant_conflict(error, name, phone_number):
+    """
+    Conflict message of a plant insert rejected by a UNIQUE constraint, None for other errors
+    """
+    column = unique_violation(error, Plant.__tablename__, "name", "phone_number")
+    if column == "name":
+        return f"Plant '{name}' already exists"
+    if column == "phone_number":
+        return f"Phone number '{phone_number}' already exists."
+    return None
+
+@app.route("/api/plants:batch", methods=["POST"])
+@idempotent
+def create_plants_batch():
+    """
+    Endpoint for provisioning many plants at once
+
+    All valid plants are inserted with one INSERT per table in a single transaction.
+    Plants rejected by the UNIQUE constraints are reported per item as conflicts.
+    """
+    body = request.json
+    plants = body.get("plants") if isinstance(body, dict) else None
+    if not isinstance(plants, list) or not plants:
+        return failure_response("Batch missing plants", 400)
+    if len(plants) > app.config["MAX_BATCH_ENTRIES"]:
+        return failure_response(f"Batch exceeds {app.config['MAX_BATCH_ENTRIES']} plants.", 413)
+
+    results = [None] * len(plants)
+    valid = []
+    seen = {"name": set(), "phone_number": set()}
+    for index, (values, errors) in enumerate(PLANT_SCHEMA.validate_all(plants)):
+        if errors:
+            results[index] = {"index": index, "status": "invalid", "errors": errors}
+        elif values["name"] in seen["name"]:
+            results[index] = {"index": index, "status": "conflict", "errors": [f"Plant '{values['name']}' already exists"]}
+        elif values["phone_number"] in seen["phone_number"]:
+            results[index] = {"index": index, "status": "conflict", "errors": [f"Phone number '{values['phone_number']}' already exists."]}
+        else:
+            seen["name"].add(values["name"])
+            seen["phone_number"].add(values["phone_number"])
+            valid.append((index, values))
+
+    try:
+        created = _insert_plants(valid)
+    except IntegrityError:
+        # a plant conflicts with an existing one, insert them one by one to find which
+        db.session.rollback()
+        begin_explicit(db.session, Plant)
+        created = {}
+        for index, values in valid:
+            try:
+                with db.session.begin_nested():
+                    created[index] = insert_plant(**values)
+            except IntegrityError as e:
+                message = plant_conflict(e, values["name"], values["phone_number"])
+                results[index] = {"index": index, "status": "conflict", "errors": [message or "Integrity error"]}
+    try:
+        if created:
+            bump_versions(db.session, Plant, Configuration)
         db.session.commit()
-        
-        serialized_plant = serialize_model(new_plant)
-        serialized_plant['config_id'] = serialize_model(new_config)
-        return success_response(serialized_plant, 201)
-        # return success_response(serialized_plant, 201, headers={"Location": f"/api/plants/{new_plant.id}"})
-    
     except SQLAlchemyError as e:
         db.session.rollback()
         return failure_response("Internal Server Error", 500)
-    
+
+    for index, serialized_plant in created.items():
+        invalidate_plant(serialized_plant["id"], serialized_plant["name"])
+        results[index] = {"index": index, "status": "created", **serialized_plant}
+    return success_response({"results": results}, batch_status(results))
+
+def _insert_plants(valid):
+    """
+    Insert plants and their configurations with one INSERT per table
+
+    :param valid: list of (index, validated values) of the plants to insert
+    :return: dictionary of index to serialized plant
+    """
+    config_rows = [
+        {"chemical_type": v["chemical_type"], "chemical_concentration": v["chemical_concentration"],
+         "num_filters": v["num_filters"], "num_clarifiers": v["num_clarifiers"]}
+        for _, v in valid]
+    config_ids = insert_returning_ids(db.session, Configuration.__table__, config_rows)
+    plant_rows = [
+        {"name": v["name"], "phone_number": v["phone_number"], "config_id": config_id}
+        for (_, v), config_id in zip(valid, config_ids)]
+    plant_ids = insert_returning_ids(db.session, Plant.__table__, plant_rows)
+    record_changes(db.session, "upsert", {Configuration: zip(config_ids, plant_ids), Plant: zip(plant_ids, plant_ids)})
+
+    created = {}
+    for (index, _), plant_id, plant_row, config_id, config_row in zip(valid, plant_ids, plant_rows, config_ids, config_rows):
+        serialized_plant = serialize_model(Plant(id=plant_id, **plant_row))
+        serialized_plant["config_id"] = serialize_model(Configuration(id=config_id, **config_row))
+        created[index] = serialized_plant
+    return created
+
 @app.route("/api/plants/<int:plant_id>/", methods=["GET"])
+@conditional(Plant, embeds=Plant)
 def get_plant(plant_id):
     """
     Endpoint for getting a specific plant
+
+    `?include=configuration,users` embeds the related objects and `?fields=` trims them, see embedding.py
     """
-    plant = Plant.query.filter_by(id=plant_id).first()
+    try:
+        embedding = embedding_args(Plant)
+    except ValueError as e:
+        return failure_response(str(e), 400)
+
+    plant = db.session.scalars(select(Plant).where(Plant.id == plant_id).options(*embedding.options())).first()
     if plant is None:
         return failure_response("Plant not found.", 404)
-    serialized_plant = serialize_model(plant)
+    serialized_plant = embedding.serialize(plant) if embedding else serialize_model(plant)
     return success_response(serialized_plant)
 
 @app.route("/api/plants/", methods=["GET"])
+@conditional(Plant, embeds=Plant)
 def get_all_plants():
     """
     Endpoint for getting all plants
+
+    Paginated with `?after_id=&limit=`, or streamed in full with `?stream=true`.
+    `?include=` and `?fields=` embed related objects and trim the plants, see embedding.py
+    """
+    try:
+        after_id, limit = page_args()
+        embedding = embedding_args(Plant)
+    except ValueError as e:
+        return failure_response(str(e), 400)
+
+    if embedding:
+        return embedded_list("plants", Plant, embedding, after_id, limit)
+    if wants_stream():
+        statement = row_select(Plant).order_by(Plant.id)
+        if after_id is not None:
+            statement = statement.where(Plant.id > after_id)
+        return stream_json_array("plants", statement, row_serializer_for(Plant))
+
+    rows, next_after_id = keyset_page(row_select(Plant), Plant.id, after_id, limit)
+    return success_response({"plants": serialize_rows(Plant, rows), "next_after_id": next_after_id})
+
+def embedded_list(key, model_class, embedding, after_id, limit):
+    """
+    Page or stream of ORM objects with their included relationships eager loaded
+
+    :param key: name of the array in the response
+    :param model_class: model of the listed objects
+    :param embedding: Embedding of the request
+    :return: response like the Core list routes, the objects serialized by the embedding
+    """
+    statement = select(model_class).options(*embedding.options())
+    if wants_stream():
+        statement = statement.order_by(model_class.id)
+        if after_id is not None:
+            statement = statement.where(model_class.id > after_id)
+        return stream_json_array(key, statement, lambda row: embedding.serialize(row[0]))
+
+    # the id column names the cursor of the page rows
+    rows, next_after_id = keyset_page(statement.add_columns(model_class.id), model_class.id, after_id, limit)
+    return success_response({key: embedding.serialize_all(row[0] for row in rows), "next_after_id": next_after_id})
+
+# -- ENTRY ROUTES ------------------------------------------------------
+@app.route("/api/plants/<int:plant_id>/entries:batch", methods=["POST"])
+@idempotent
+def create_entries_batch(plant_id):
+    """
+    Endpoint for syncing a batch of dosage and raw water entries for a plant
+
+    Valid entries are inserted in a single transaction, invalid ones are reported
+    per item and skipped. In write-behind mode valid entries are queued instead and
+    acknowledged with a provisional id (202), or rejected with 503 while the queue is full.
+    """
+    body = request.json
+    entries = body.get("entries") if isinstance(body, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return failure_response("Batch missing entries", 400)
+    if len(entries) > app.config["MAX_BATCH_ENTRIES"]:
+        return failure_response(f"Batch exceeds {app.config['MAX_BATCH_ENTRIES']} entries.", 413)
+
+    if db.session.get(Plant, plant_id) is None:
+        return failure_response("Plant not found.", 404)
+
+    results = [None] * len(entries)
+    valid = []
+    for index, (entry, errors) in enumerate(validate_entries(plant_id, entries)):
+        if errors:
+            results[index] = {"index": index, "status": "invalid", "errors": errors}
+        else:
+            valid.append((index, entry))
+
+    write_behind = app.extensions.get("write_behind")
+    if valid and write_behind is not None:
+        try:
+            provisional_ids = write_behind.submit(plant_id, [entry for _, entry in valid])
+        except QueueFull:
+            return (*failure_response("Entry queue is full, retry later.", 503), {"Retry-After": "1"})
+        for (index, _), provisional_id in zip(valid, provisional_ids):
+            results[index] = {"index": index, "status": "queued", "provisional_id": provisional_id}
+        return success_response({"results": results}, batch_status(results, "queued", 202))
+
+    if valid:
+        try:
+            created = insert_entries(db.session, plant_id, [entry for _, entry in valid])
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return failure_response("Internal Server Error", 500)
+        for (index, _), ids in zip(valid, created):
+            results[index] = {"index": index, "status": "created", **ids}
+        record_calibrations(plant_id, [
+            (ids["calibration_id"], entry["calibration"]["calculated_chemical_dose"], entry["calibration"]["slider_position"])
+            for (_, entry), ids in zip(valid, created) if ids.get("calibration_id") is not None])
+        record_turbidity(plant_id, [entry for _, entry in valid], created)
+
+    return success_response({"results": results}, batch_status(results))
+
+@app.route("/api/entries/pending/<provisional_id>/", methods=["GET"])
+def get_pending_entry(provisional_id):
+    """
+    Endpoint for resolving the provisional id of an entry queued in write-behind mode
+
+    Entries not written yet, or unknown to this process, are reported as pending.
+    """
+    write_behind = app.extensions.get("write_behind")
+    if write_behind is None:
+        return failure_response("Write-behind mode is disabled.", 404)
+    result = write_behind.results.get(provisional_id)
+    if result is None:
+        return success_response({"provisional_id": provisional_id, "status": "pending"})
+    return success_response({"provisional_id": provisional_id, **result})
+
+@app.route("/api/plants/<int:plant_id>/trends/", methods=["GET"])
+def get_plant_trends(plant_id):
+    """
+    Endpoint for getting a metric of a plant downsampled into time buckets
+
+    Query arguments: metric (chemical_dose, flow_rate or utn), bucket (hour, day or week)
+    and the optional ISO 8601 start and end of the time range
+    """
+    metric = request.args.get("metric")
+    bucket = request.args.get("bucket", "day")
+    if metric not in Metrics:
+        return failure_response(f"Metric '{metric}' invalid.", 400)
+    if bucket not in BucketSizes:
+        return failure_response(f"Bucket '{bucket}' invalid.", 400)
+    try:
+        start, end = time_range_args()
+    except ValueError as e:
+        return failure_response(str(e), 400)
+
+    if db.session.get(Plant, plant_id) is None:
+        return failure_response("Plant not found.", 404)
+    points = metric_trend(metric, plant_id, bucket, start, end)
+    return success_response({"metric": metric, "bucket": bucket, "points": points})
+
+@app.route("/api/plants/<int:plant_id>/alerts/", methods=["GET"])
+def get_plant_alerts(plant_id):
+    """
+    Endpoint for polling the raw turbidity spike alerts of a plant
+
+    Alerts are raised in memory as raw water entries are synced, against rolling statistics
+    warm-started at boot, so polling never queries the entries.
+    Query arguments: the optional after, seq of the last alert already seen (the id of its raw water entry)
+    """
+    try:
+        after = int(request.args.get("after", 0))
+    except ValueError:
+        return failure_response("after must be an integer", 400)
+    if plant_by_id(plant_id) is None:
+        return failure_response("Plant not found.", 404)
+
+    alerts = turbidity_monitor.alerts(plant_id, after)
+    return success_response({
+        "alerts": alerts,
+        "next_after": alerts[-1]["seq"] if alerts else after,
+        "turbidity": turbidity_monitor.stats(plant_id)})
+
+@app.route("/api/plants/<int:plant_id>/dosage_entries/<int:entry_id>/", methods=["DELETE"])
+def delete_dosage_entry(plant_id, entry_id):
+    """
+    Endpoint for soft deleting a dosage entry of a plant by id
+
+    An entry recorded by a user of another plant is not found.
+    """
+    try:
+        deleted = soft_delete_dosage_entries(db.session, [entry_id], plant_id)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return failure_response("Internal Server Error", 500)
+    if not deleted:
+        return failure_response("Dosage entry not found!", 404)
+    entry = db.session.get(DosageEntry, entry_id)
+    if entry.calibration_id is not None:
+        invalidate_dose_model(plant_id)
+    serialized_entry = serialize_model(entry)
+    return success_response(serialized_entry)
+
+@app.route("/api/plants/<int:plant_id>/rollups/", methods=["GET"])
+def get_plant_rollups(plant_id):
     """
-    return success_response({"plants": [serialize_model(p) for p in Plant.query.all()]})
+    Endpoint for getting the daily aggregates of a plant
+
+    Query arguments: the optional ISO 8601 start and end of the time range
+    """
+    try:
+        start, end = time_range_args()
+    except ValueError as e:
+        return failure_response(str(e), 400)
+    if db.session.get(Plant, plant_id) is None:
+        return failure_response("Plant not found.", 404)
+
+    query = PlantDailyRollup.query.filter_by(plant_id=plant_id)
+    if start is not None:
+        query = query.filter(PlantDailyRollup.day >= start.date())
+    if end is not None:
+        query = query.filter(PlantDailyRollup.day < end.date())
+    days = []
+    for rollup in query.order_by(PlantDailyRollup.day):
+        serialized_rollup = serialize_model(rollup)
+        serialized_rollup["day"] = rollup.day.isoformat()
+        serialized_rollup["dose_mean"] = rollup.dose_sum / rollup.calibration_count if rollup.calibration_count else None
+        serialized_rollup["turbidity_mean"] = rollup.turbidity_sum / rollup.turbidity_count if rollup.turbidity_count else None
+        days.append(serialized_rollup)
+    return success_response({"days": days})
+
+@app.route("/api/plants/<int:plant_id>/export/", methods=["GET"])
+def export_plant_history(plant_id):
+    """
+    Endpoint for downloading the history of a plant, streamed
+
+    Query arguments: format (csv or ndjson), kind (dosage or raw_water)
+    and the optional ISO 8601 start and end of the time range
+    """
+    export_format = request.args.get("format", "csv")
+    kind = request.args.get("kind", "dosage")
+    if export_format not in ExportFormats:
+        return failure_response(f"Format '{export_format}' invalid.", 400)
+    if kind not in ExportKinds:
+        return failure_response(f"Kind '{kind}' invalid.", 400)
+    try:
+        start, end = time_range_args()
+    except ValueError as e:
+        return failure_response(str(e), 400)
+    if plant_by_id(plant_id) is None:
+        return failure_response("Plant not found.", 404)
+
+    statement = export_statement(kind, plant_id, start, end)
+    return stream_export(kind, export_format, statement, f"plant-{plant_id}-{kind}")
+
+@app.route("/api/plants/<int:plant_id>/configuration/", methods=["PUT"])
+def update_plant_configuration(plant_id):
+    """
+    Endpoint for updating the configuration of a plant
+
+    Any of chemical_type, chemical_concentration, num_filters and num_clarifiers can be given.
+    A new chemical concentration recomputes the calculated values of every calibration
+    of the plant, in chunks, and rebuilds its daily rollups in the same transaction as the
+    configuration change, so a failure leaves both as they were.
+    """
+    body = request.json
+    if not isinstance(body, dict):
+        return failure_response("Configuration must be an object", 400)
+    plant = db.session.get(Plant, plant_id)
+    if plant is None:
+        return failure_response("Plant not found!", 404)
+    config = db.session.get(Configuration, plant.config_id)
+
+    values, errors = CONFIGURATION_SCHEMA.validate(body)
+    if errors:
+        return failure_response("; ".join(errors), 400)
+
+    concentration_changed = values.get("chemical_concentration", config.chemical_concentration) != config.chemical_concentration
+    try:
+        for field, value in values.items():
+            setattr(config, field, value)
+        bump_versions(db.session, Configuration)
+
+        recalculated = 0
+        if concentration_changed:
+            with use_shard(plant_id):
+                recalculated = recompute_plant_calibrations(
+                    db.session, plant_id, config.chemical_concentration, app.config["CALIBRATION_CHUNK_SIZE"], commit=False)
+                rebuild_rollups(db.session, plant_id)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return failure_response("Internal Server Error", 500)
+    invalidate_plant(plant_id, plant.name)
+    if concentration_changed:
+        invalidate_dose_model(plant_id)
+
+    serialized_config = serialize_model(config)
+    serialized_config["recalculated"] = recalculated
+    return success_response(serialized_config)
+
+@app.route("/api/plants/<int:plant_id>/recommendation/", methods=["GET"])
+def get_slider_recommendation(plant_id):
+    """
+    Endpoint for recommending the slider position of a target coagulant dose
+
+    The position comes from a line fitted over the plant's calibrations, kept up to date
+    in memory as calibrations are synced.
+    Query arguments: target_dose
+    """
+    try:
+        target_dose = float(request.args["target_dose"])
+    except KeyError:
+        return failure_response("Recommendation missing target_dose", 400)
+    except ValueError:
+        return failure_response("target_dose must be a number", 400)
+    if not math.isfinite(target_dose):
+        return failure_response("target_dose must be a number", 400)
+    if plant_by_id(plant_id) is None:
+        return failure_response("Plant not found.", 404)
+
+    model = dose_model(plant_id)
+    slider_position = model.recommend(target_dose)
+    if slider_position is None:
+        return failure_response("Not enough calibrations to recommend a slider position.", 422)
+    slope, intercept = model.fit()
+    return success_response({
+        "target_dose": target_dose,
+        "slider_position": slider_position,
+        "slope": slope,
+        "intercept": intercept,
+        "calibration_count": model.count})
 
 # -- USER ROUTES ------------------------------------------------------
 @app.route("/api/users/", methods=["POST"])
+@idempotent
 def create_user():
     """
     Endpoint for creating a user
 
     Eventually we will have Google Authentication
     """
-    body = request.json
-    required_fields = [
-    "name",
-    "email",
-    "phone_number",
-    "plant_name"
-    ]
+    values, errors = USER_SCHEMA.validate(request.json)
+    if errors:
+        return failure_response(f"User invalid: {'; '.join(errors)}", 400)
+    name, email, phone_number, plant_name = values["name"], values["email"], values["phone_number"], values["plant_name"]
 
-     # extracted_fields returns extracted_fields and any missing_fields if there are any
-    extracted_fields, missing_fields = extract_fields(body, *required_fields)
-    if missing_fields:
-        return failure_response(f"User missing {', '.join(missing_fields)}", 404)
-    # unpacks extracted_fields into individual variables 
-    name, email, phone_number, plant_name = extracted_fields
-
-    # handles uniqueness constraints
-    # duplicate users can appear as Users that have the same email or number
-    existing_email = existing_number = User.query.filter(or_(User.email == email, User.phone_number == phone_number)).first() 
-    if existing_email is not None:
-        if existing_email.email == body["email"]:
-            return failure_response(f"User '{email}' already in use.", 409)
-        if existing_number.phone_number == body["phone_number"]:
-            return failure_response(f"User Phone number '{phone_number}' already in use.", 409)
-        
-    # to get associated Plant ID
-    plant = Plant.query.filter_by(name=plant_name).first()
+    # to get associated Plant ID, served from the plant cache
+    plant = plant_by_name(plant_name)
     if plant is None:
         return failure_response(f"Plant named {plant_name} not found.", 404)
+
+    # uniqueness of the email and phone number is enforced by the UNIQUE constraints
     try: 
-        new_user = User(
-            name=name, 
-            email=email, 
-            phone_number=phone_number, 
-            plant_id=plant.id)
-        db.session.add(new_user)
+        serialized_user = insert_row(User, {
+            "name": name,
+            "email": email,
+            "phone_number": phone_number,
+            "plant_id": plant["plant"]["id"]})
+        record_changes(db.session, "upsert", {User: [(serialized_user["id"], plant["plant"]["id"])]})
+        bump_versions(db.session, User)
         db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        message = user_conflict(e, email, phone_number)
+        if message is None:
+            return failure_response("Internal Server Error", 500)
+        return failure_response(message, 409)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return failure_response("Internal Server Error", 500)
+
+    serialized_user['plant_id'] = plant["plant"]
+    return success_response(serialized_user, 201)
 
-        serialized_user = serialize_model(new_user)
-        serialized_user['plant_id'] = serialize_model(plant)
-        return success_response(serialized_user, 201)
-    
+def user_conflict(error, email, phone_number):
+    """
+    Conflict message of a user insert rejected by a UNIQUE constraint, None for other errors
+    """
+    column = unique_violation(error, User.__tablename__, "email", "phone_number")
+    if column == "email":
+        return f"User '{email}' already in use."
+    if column == "phone_number":
+        return f"User Phone number '{phone_number}' already in use."
+    return None
+
+@app.route("/api/users:batch", methods=["POST"])
+@idempotent
+def create_users_batch():
+    """
+    Endpoint for provisioning many users at once
+
+    Plants are resolved by name with one query and all valid users are inserted with one
+    INSERT in a single transaction. Users rejected by the UNIQUE constraints are reported
+    per item as conflicts.
+    """
+    body = request.json
+    users = body.get("users") if isinstance(body, dict) else None
+    if not isinstance(users, list) or not users:
+        return failure_response("Batch missing users", 400)
+    if len(users) > app.config["MAX_BATCH_ENTRIES"]:
+        return failure_response(f"Batch exceeds {app.config['MAX_BATCH_ENTRIES']} users.", 413)
+
+    validated = USER_SCHEMA.validate_all(users)
+    plant_names = {values["plant_name"] for values, errors in validated if not errors}
+    plants = {name: plant_id for plant_id, name in db.session.execute(
+        db.select(Plant.id, Plant.name).where(Plant.name.in_(plant_names)))}
+
+    results = [None] * len(users)
+    valid = []
+    seen = {"email": set(), "phone_number": set()}
+    for index, (values, errors) in enumerate(validated):
+        if errors:
+            results[index] = {"index": index, "status": "invalid", "errors": errors}
+        elif values["plant_name"] not in plants:
+            results[index] = {"index": index, "status": "invalid", "errors": [f"Plant named {values['plant_name']} not found."]}
+        elif values["email"] in seen["email"]:
+            results[index] = {"index": index, "status": "conflict", "errors": [f"User '{values['email']}' already in use."]}
+        elif values["phone_number"] in seen["phone_number"]:
+            results[index] = {"index": index, "status": "conflict", "errors": [f"User Phone number '{values['phone_number']}' already in use."]}
+        else:
+            seen["email"].add(values["email"])
+            seen["phone_number"].add(values["phone_number"])
+            valid.append((index, {"name": values["name"], "email": values["email"], "phone_number": values["phone_number"],
+                                  "plant_id": plants[values["plant_name"]]}))
+
+    created = {}
+    try:
+        user_ids = insert_returning_ids(db.session, User.__table__, [row for _, row in valid])
+        record_changes(db.session, "upsert", {User: [(user_id, row["plant_id"]) for (_, row), user_id in zip(valid, user_ids)]})
+        created = {index: serialize_model(User(id=user_id, **row)) for (index, row), user_id in zip(valid, user_ids)}
+    except IntegrityError:
+        # a user conflicts with an existing one, insert them one by one to find which
+        db.session.rollback()
+        begin_explicit(db.session, User)
+        for index, row in valid:
+            try:
+                with db.session.begin_nested():
+                    created[index] = insert_row(User, row)
+                    record_changes(db.session, "upsert", {User: [(created[index]["id"], row["plant_id"])]})
+            except IntegrityError as e:
+                message = user_conflict(e, row["email"], row["phone_number"])
+                results[index] = {"index": index, "status": "conflict", "errors": [message or "Integrity error"]}
+    try:
+        if created:
+            bump_versions(db.session, User)
+        db.session.commit()
     except SQLAlchemyError as e:
         db.session.rollback()
         return failure_response("Internal Server Error", 500)
 
+    for index, serialized_user in created.items():
+        results[index] = {"index": index, "status": "created", **serialized_user}
+    return success_response({"results": results}, batch_status(results))
+
 @app.route("/api/users/<int:user_id>/")
+@conditional(User, embeds=User)
 def get_specific_user(user_id):
     """
     Endpoint for getting user by id 
+
+    `?include=plant,plant.configuration` embeds the related objects and `?fields=` trims them, see embedding.py
     """
-    user = User.query.filter_by(id=user_id).first()
+    try:
+        embedding = embedding_args(User)
+    except ValueError as e:
+        return failure_response(str(e), 400)
+
+    user = db.session.scalars(select(User).where(User.id == user_id).options(*embedding.options())).first()
     if user is None:
         return failure_response("User not found!", 404)
-    serialized_user = serialize_model(user)
+    serialized_user = embedding.serialize(user) if embedding else serialize_model(user)
     return success_response(serialized_user)
 
 @app.route("/api/users/")
+@conditional(User, embeds=User)
 def get_all_users():
     """
     Endpoint for getting all users
+
+    Paginated with `?after_id=&limit=`, or streamed in full with `?stream=true`.
+    `?include=` and `?fields=` embed related objects and trim the users, see embedding.py
     """
-    return success_response({"users": [serialize_model(u) for u in User.query.all()]})
+    try:
+        after_id, limit = page_args()
+        embedding = embedding_args(User)
+    except ValueError as e:
+        return failure_response(str(e), 400)
+
+    if embedding:
+        return embedded_list("users", User, embedding, after_id, limit)
+    if wants_stream():
+        statement = row_select(User).order_by(User.id)
+        if after_id is not None:
+            statement = statement.where(User.id > after_id)
+        return stream_json_array("users", statement, row_serializer_for(User))
+
+    rows, next_after_id = keyset_page(row_select(User), User.id, after_id, limit)
+    return success_response({"users": serialize_rows(User, rows), "next_after_id": next_after_id})
 
 # get all users for a plant 
 
@@ -157,12 +678,24 @@ def get_all_users():
 def delete_user(user_id):
     """
     Endpoint for deleting a user by id
+
+    The user's entries are kept but no longer belong to a plant, so they are retracted
+    from the plant's daily rollups in the same transaction as the delete.
     """
     user = User.query.filter_by(id=user_id).first()
     if user is None:
         return failure_response("User not found!", 404)
-    db.session.delete(user)
-    db.session.commit()
+    plant_id = user.plant_id
+    try:
+        with use_shard(plant_id):
+            retract_user(db.session, plant_id, user_id)
+        db.session.delete(user)
+        bump_versions(db.session, User)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return failure_response("Internal Server Error", 500)
+    invalidate_dose_model(plant_id)
     serialized_user = serialize_model(user)
     return success_response(serialized_user)
 
@@ -171,24 +704,102 @@ def delete_plant(plant_id):
     """
     Endpoint for deleting a plant by id
 
-    Must also delete associated Configuration and Users/Plant Operators
+    Must also delete associated Configuration and Users/Plant Operators, and their entries.
+    Entries are hard deleted unless `?entries=soft` or PLANT_DELETE_ENTRIES say otherwise.
+    Everything is removed with set-based statements in a single transaction.
     """
+    entries_mode = request.args.get("entries", app.config["PLANT_DELETE_ENTRIES"])
+    if entries_mode not in ("soft", "hard"):
+        return failure_response(f"Entries mode '{entries_mode}' invalid.", 400)
+
     plant = Plant.query.filter_by(id=plant_id).first()
     if plant is None:
         return failure_response("Plant not found!", 404)
+    serialized_plant = serialize_model(plant)
 
-    # delete users associated with plant 
-    associated_users = User.query.filter_by(plant_name=plant.name)
-    for u in associated_users:
-        db.session.delete(u)
+    try:
+        delete_plant_entries(db.session, plant_id, hard=entries_mode == "hard")
+        db.session.execute(delete(PlantDailyRollup).where(PlantDailyRollup.plant_id == plant_id))
+        # tombstones of the users, plant and config, before their rows are gone
+        record_changes_from(db.session, "delete", {
+            User: select(User.id, User.plant_id).where(User.plant_id == plant_id),
+            Plant: select(Plant.id, Plant.id).where(Plant.id == plant_id),
+            Configuration: select(Configuration.id, literal(plant_id)).where(Configuration.id == plant.config_id)})
+        # delete users associated with plant 
+        db.session.execute(delete(User).where(User.plant_id == plant_id))
+        db.session.execute(delete(Plant).where(Plant.id == plant_id))
+        # delete config associated with plant 
+        db.session.execute(delete(Configuration).where(Configuration.id == plant.config_id))
+        bump_versions(db.session, Plant, User, Configuration)
         db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return failure_response("Internal Server Error", 500)
 
-    db.session.delete(plant)
-    db.session.commit()
+    invalidate_plant(plant_id, serialized_plant["name"])
+    invalidate_dose_model(plant_id)
+    turbidity_monitor.forget(plant_id)
+    return success_response(serialized_plant)
 
-    # delete config associated with plant 
-    associated_config = Configuration.query.filter_by(id=plant.config_id)
-    db.session.delete(associated_config)
-    db.session.commit()
-    serialized_plant = serialize_model(plant)
-    return success_response(serialized_plant)
\ No newline at end of file
+# -- SYNC ROUTES ------------------------------------------------------
+@app.route("/api/sync", methods=["GET"])
+def get_changes():
+    """
+    Endpoint for fetching the rows changed since a sync token
+
+    Query arguments: since (token of the previous sync, 0 or absent for everything logged),
+    the optional plant_id to only sync one plant, and limit on the consumed changes.
+    Changed rows are returned with their current values, removed and soft deleted
+    rows as tombstones under "deleted" and entries moved to the archive under "archived".
+    Pages are fetched until has_more is false, passing next_since as the next since.
+    """
+    try:
+        since = parse_sync_token(request.args.get("since", "0"))
+        plant_id = int(request.args["plant_id"]) if "plant_id" in request.args else None
+        limit = int(request.args.get("limit", app.config["SYNC_PAGE_LIMIT"]))
+    except ValueError:
+        return failure_response("since must be a sync token, plant_id and limit integers", 400)
+    if min(since) < 0 or limit < 1:
+        return failure_response("since must not be negative and limit must be positive", 400)
+    if plant_id is None and shard_router() is not None:
+        # entry ids are only unique within a shard
+        return failure_response("Entries are sharded by plant, sync a single plant with ?plant_id=.", 400)
+
+    changes, last_seqs, has_more = changes_since(since, plant_id, min(limit, app.config["SYNC_PAGE_LIMIT"]))
+    return success_response({"since": sync_token(since), "next_since": sync_token(last_seqs), "has_more": has_more,
+                             "changes": changes})
+
+# -- METRICS ROUTES ------------------------------------------------------
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """
+    Endpoint for scraping the request, SQL and cache metrics in the Prometheus text format
+    """
+    metrics = app.extensions.get("metrics")
+    if metrics is None:
+        return failure_response("Metrics are disabled.", 404)
+
+    caches = {"plant": plant_cache.stats(), "dose_model": dose_models.stats()}
+    idempotency = app.extensions.get("idempotency")
+    if idempotency is not None:
+        caches["idempotency"] = idempotency.cache.stats()
+    families = [
+        ("cache_entries", "gauge", "Entries held by the in-process caches.",
+         {(("cache", name),): stats["size"] for name, stats in caches.items()}),
+        ("cache_lookups_total", "counter", "Lookups of the in-process caches, by result.",
+         {(("cache", name), ("result", result)): stats[result]
+          for name, stats in caches.items() for result in ("hits", "misses")}),
+        ("cache_evictions_total", "counter", "Entries dropped by the in-process caches, by reason.",
+         {(("cache", name), ("reason", reason)): stats[reason]
+          for name, stats in caches.items() for reason in ("evictions", "expirations")}),
+    ]
+    write_behind = app.extensions.get("write_behind")
+    if write_behind is not None:
+        stats = write_behind.stats()
+        families += [
+            ("write_behind_pending", "gauge", "Entries waiting in the write-behind queue.", {(): stats["pending"]}),
+            ("write_behind_commits_total", "counter", "Commits of the write-behind writer.", {(): stats["commits"]}),
+            ("write_behind_entries_total", "counter", "Entries handled by the write-behind writer, by result.",
+             {(("result", "written"),): stats["written"], (("result", "failed"),): stats["failed"]}),
+        ]
+    return Response(metrics.render(families), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,200 @@
+import os
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Table, Column, Integer, select, insert, delete, inspect, make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateColumn
+from . import db
+from .sharding import create_shard_tables
+
+# version stamp of the schema, a single row written by every migration
+schema_version = Table("schema_version", db.metadata, Column("version", Integer, nullable=False))
+
+StartupModes = {"migrate", "check", "none"}
+
+
+class SchemaVersionError(RuntimeError):
+    """
+    Raised at startup when the database schema is not the one the application expects.
+    """
+
+
+# -- MIGRATIONS ------------------------------------------------------
+# migrations are idempotent, so databases created by create_all() before the stamp existed
+# are brought up to date by replaying them all: tables are created if missing, and the columns
+# and indexes added to existing tables are created explicitly, create_all() never alters a table
+def _create_tables(connection, *model_classes):
+    db.metadata.create_all(connection, tables=[model_class.__table__ for model_class in model_classes])
+
+def _add_columns(connection, model_class, *names):
+    table = model_class.__table__
+    existing = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for name in names:
+        if name not in existing:
+            ddl = CreateColumn(table.c[name]).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+
+def _initial_tables(connection):
+    from .models import Plant, Configuration, User, DosageEntry, CalibrationSection, ChangeDoseSection, \
+        RawWaterEntry, PlantDailyRollup, TableVersion
+    _create_tables(connection, Configuration, Plant, User, DosageEntry, CalibrationSection, ChangeDoseSection,
+                   RawWaterEntry, PlantDailyRollup, TableVersion)
+
+def _change_tracking(connection):
+    from .models import Plant, Configuration, User, DosageEntry, ChangeLog
+    for model_class in (User, Plant, Configuration, DosageEntry):
+        _add_columns(connection, model_class, "updated_at")
+    _create_tables(connection, ChangeLog)
+
+def _archive_tables(connection):
+    from .models import ArchiveModels
+    _create_tables(connection, *ArchiveModels.values())
+
+def _idempotency_keys(connection):
+    from .models import IdempotencyKey
+    _create_tables(connection, IdempotencyKey)
+
+def _create_indexes(connection, *model_classes):
+    for model_class in model_classes:
+        for index in model_class.__table__.indexes:
+            index.create(connection, checkfirst=True)
+
+def _entry_timestamps_and_indexes(connection):
+    from .models import Plant, Configuration, User, DosageEntry, CalibrationSection, ChangeDoseSection, \
+        RawWaterEntry, PlantDailyRollup, TableVersion, ChangeLog, IdempotencyKey
+    # raw water entries of the first schema have no timestamp, they stay NULL
+    _add_columns(connection, RawWaterEntry, "created_at")
+    _create_indexes(connection, Plant, Configuration, User, DosageEntry, CalibrationSection, ChangeDoseSection,
+                    RawWaterEntry, PlantDailyRollup, TableVersion, ChangeLog, IdempotencyKey)
+
+def _entry_change_log(connection):
+    from .models import EntryChangeLog
+    # entries logged in change_log before stay there, sync reads them before this log
+    _create_tables(connection, EntryChangeLog)
+
+def _raw_water_user_id_index(connection):
+    from .models import RawWaterEntry
+    _create_indexes(connection, RawWaterEntry)
+
+# (description, upgrade function of a connection), the schema version is the number of migrations applied
+MIGRATIONS = [
+    ("initial tables", _initial_tables),
+    ("updated_at columns and change log", _change_tracking),
+    ("archive tables", _archive_tables),
+    ("idempotency keys", _idempotency_keys),
+    ("raw water timestamps and indexes of the first schema", _entry_timestamps_and_indexes),
+    ("entry change log", _entry_change_log),
+    ("raw water (user_id, id) index", _raw_water_user_id_index),
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def read_version(connection):
+    """
+    Schema version stamped in the database, None if it was never stamped.
+    """
+    return connection.execute(select(schema_version.c.version)).scalar()
+
+def _stamp(connection, version):
+    connection.execute(delete(schema_version))
+    connection.execute(insert(schema_version).values(version=version))
+
+def migrate(engine):
+    """
+    Apply the migrations the database has not seen yet, one transaction each.
+
+    :param engine: engine of the database
+    :return: descriptions of the migrations applied, empty when the schema is current
+    """
+    with engine.begin() as connection:
+        schema_version.create(connection, checkfirst=True)
+        version = read_version(connection) or 0
+    if version > SCHEMA_VERSION:
+        raise SchemaVersionError(f"Database schema version {version} is newer than this application ({SCHEMA_VERSION}).")
+
+    applied = []
+    for number, (description, upgrade) in enumerate(MIGRATIONS[version:], start=version + 1):
+        with engine.begin() as connection:
+            upgrade(connection)
+            _stamp(connection, number)
+        applied.append(description)
+    return applied
+
+def create_schema(connection):
+    """
+    Create every table at once and stamp the current version, for fresh databases.
+    """
+    db.metadata.create_all(connection)
+    _stamp(connection, SCHEMA_VERSION)
+
+def check_schema(engine):
+    """
+    Fail fast unless the database is stamped with the version the application expects.
+
+    Issues a single query and loads no model metadata.
+
+    :param engine: engine of the database
+    """
+    try:
+        with engine.connect() as connection:
+            version = read_version(connection)
+    except DBAPIError:
+        version = None
+    if version != SCHEMA_VERSION:
+        raise SchemaVersionError(
+            f"Database schema version {version} does not match {SCHEMA_VERSION}, run 'flask schema upgrade'.")
+
+
+# -- STARTUP ------------------------------------------------------
+def _sqlite_directory(uri):
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        return os.path.dirname(os.path.abspath(url.database))
+    return None
+
+def prepare_schema(app):
+    """
+    Bring the schema up to date or check it, following SCHEMA_STARTUP.
+
+      migrate: create the SQLite directories, apply the pending migrations and create the missing shard tables
+      check:   a single stamp check, SchemaVersionError on mismatch
+      none:    nothing, for commands managing the schema themselves
+
+    :param app: Flask application, must run in its app context
+    """
+    mode = app.config["SCHEMA_STARTUP"]
+    if mode not in StartupModes:
+        raise ValueError(f"Schema startup mode '{mode}' invalid.")
+    if mode == "check":
+        check_schema(db.engine)
+    elif mode == "migrate":
+        binds = app.config.get("SQLALCHEMY_BINDS", {}).values()
+        for uri in (app.config["SQLALCHEMY_DATABASE_URI"], *[bind["url"] if isinstance(bind, dict) else bind for bind in binds]):
+            directory = _sqlite_directory(uri)
+            if directory is not None:
+                os.makedirs(directory, exist_ok=True)
+        migrate(db.engine)
+        create_shard_tables(db)
+
+
+# -- COMMANDS ------------------------------------------------------
+schema_cli = AppGroup("schema", help="Inspect and upgrade the database schema.")
+
+@schema_cli.command("upgrade")
+def upgrade_command():
+    """Apply the pending migrations (start with SCHEMA_STARTUP=none in production)."""
+    applied = migrate(db.engine)
+    create_shard_tables(db)
+    for description in applied:
+        click.echo(f"Applied: {description}")
+    click.echo(f"Schema is at version {SCHEMA_VERSION}.")
+
+@schema_cli.command("version")
+def version_command():
+    """Print the stamped and the expected schema versions."""
+    try:
+        with db.engine.connect() as connection:
+            version = read_version(connection)
+    except DBAPIError:
+        version = None
+    click.echo(f"Database: {version}, application: {SCHEMA_VERSION}")
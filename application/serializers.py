@@ -0,0 +1,150 @@
+import math
+import time
+from datetime import datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select, Date, DateTime, Float
+from sqlalchemy.inspection import inspect
+from werkzeug.http import http_date
+from .metrics import record_serialization
+
+try:
+    import orjson
+except ImportError:  # optional, FastJSONProvider falls back to the standard library
+    orjson = None
+
+# compiled serializers, built once per mapped class
+_instance_serializers = {}
+_row_serializers = {}
+
+
+# value conversions applied while serializing, so every JSON encoder produces the same output
+_DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def _encode_date(value):
+    """
+    Encode dates the way Flask's JSON provider does (RFC 822), None stays None.
+
+    Same output as werkzeug's http_date, formatted directly since it dominates serialization time.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        return http_date(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return (f"{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} "
+            f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+def _encode_float(value):
+    """
+    Encode NaN and infinity as None since JSON cannot represent them.
+    """
+    if value is None or math.isfinite(value):
+        return value
+    return None
+
+def _converter(column):
+    """
+    Conversion applied to the values of a column, None if they are serialized as is.
+    """
+    if isinstance(column.type, (DateTime, Date)):
+        return "_encode_date"
+    if isinstance(column.type, Float):
+        return "_encode_float"
+    return None
+
+def _fields(model_class):
+    """
+    (attribute key, column, converter name) of every column attribute of a mapped class.
+    """
+    return [
+        (attr.key, attr.columns[0], _converter(attr.columns[0]))
+        for attr in inspect(model_class).column_attrs]
+
+def _compile(name, fields, accessor):
+    """
+    Generate a function returning a dictionary literal of the given fields.
+
+    :param name: name of the generated function
+    :param fields: list of (key, converter name) pairs
+    :param accessor: function turning the position and key of a field into the source expression reading it
+    :return: compiled function taking a single object
+    """
+    items = []
+    for position, (key, converter) in enumerate(fields):
+        value = accessor(position, key)
+        items.append(f"{key!r}: {converter}({value})" if converter else f"{key!r}: {value}")
+    source = f"def {name}(obj):\n    return {{{', '.join(items)}}}\n"
+    namespace = {"_encode_date": _encode_date, "_encode_float": _encode_float}
+    exec(source, namespace)
+    return namespace[name]
+
+def serializer_for(model_class):
+    """
+    Get the compiled serializer of a mapped class, building it on first use.
+
+    :param model_class: SQLAlchemy model class
+    :return: function turning an instance of the class into a dictionary
+    """
+    serializer = _instance_serializers.get(model_class)
+    if serializer is None:
+        fields = [(key, converter) for key, _, converter in _fields(model_class)]
+        serializer = _compile(f"serialize_{model_class.__name__}", fields, lambda _, key: f"obj.{key}")
+        _instance_serializers[model_class] = serializer
+    return serializer
+
+def row_serializer_for(model_class):
+    """
+    Get the compiled serializer of Core rows selected with `row_select(model_class)`.
+
+    :param model_class: SQLAlchemy model class
+    :return: function turning a row into the same dictionary as serializer_for(model_class)
+    """
+    serializer = _row_serializers.get(model_class)
+    if serializer is None:
+        fields = [(key, converter) for key, _, converter in _fields(model_class)]
+        serializer = _compile(f"serialize_{model_class.__name__}_row", fields, lambda position, _: f"obj[{position}]")
+        _row_serializers[model_class] = serializer
+    return serializer
+
+def row_select(model_class):
+    """
+    Core SELECT of the columns of a mapped class, in the order row_serializer_for expects.
+
+    Executing it returns plain rows and skips building ORM instances.
+    """
+    return select(*[column for _, column, _ in _fields(model_class)])
+
+def serialize_rows(model_class, rows):
+    """
+    Serialize a whole result set of `row_select(model_class)` rows.
+
+    :param model_class: SQLAlchemy model class
+    :param rows: iterable of rows
+    :return: list of dictionaries
+    """
+    started = time.perf_counter()
+    serializer = row_serializer_for(model_class)
+    serialized = [serializer(row) for row in rows]
+    record_serialization(started)
+    return serialized
+
+
+# optional faster JSON encoding
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider encoding with orjson when it is installed.
+
+    Produces the same documents as the default provider: keys are sorted and dates
+    use the RFC 822 format. Pretty-printed output (debug mode) and environments
+    without orjson use the standard library encoder.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or "indent" in kwargs:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
@@ -0,0 +1,224 @@
+from contextlib import contextmanager
+from flask import current_app, g, request, jsonify
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect, make_url
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.util import find_tables
+
+# name under which every shard attaches the catalog database, whose tables (plants, users,
+# configurations) the shard statements read through it
+CATALOG_SCHEMA = "catalog"
+
+
+class ShardNotSelected(RuntimeError):
+    """
+    Raised when a statement touches the shard tables while no plant's shard is selected.
+    """
+
+
+class ShardRouter:
+    """
+    Maps plants to the shard databases holding their operational data.
+
+    The entries of plant p, their sections, change log, rollups and archives live in shard
+    p % count, a Flask-SQLAlchemy bind named "shard_<n>". Local tables hold the bookkeeping
+    of requests, kept in the shard of the request's plant so writing an entry never writes
+    the catalog, and in the catalog for the requests of no plant. Every other table stays in
+    the catalog, the default database.
+
+    :param count: number of shards
+    :param tables: tables living on the shards
+    :param local_tables: tables living on the selected shard, or in the catalog when none is
+    """
+
+    def __init__(self, count, tables, local_tables=()):
+        self.count = count
+        self.tables = frozenset(tables)
+        self.local_tables = frozenset(local_tables)
+
+    def shard_of(self, plant_id):
+        return plant_id % self.count
+
+    @staticmethod
+    def bind_key(shard):
+        return f"shard_{shard}"
+
+    def touches(self, mapper, clause, tables=None):
+        """
+        Whether a statement reads or writes a shard table, or one of `tables`.
+        """
+        tables = self.tables if tables is None else tables
+        if mapper is not None and inspect(mapper).local_table in tables:
+            return True
+        if clause is None:
+            return False
+        # the entry writes are routed by their target table, without walking their parameters
+        if isinstance(clause, UpdateBase) and clause.table in tables:
+            return True
+        return any(table in tables for table in find_tables(clause, include_crud=True, include_joins=True))
+
+
+class ShardedSession(Session):
+    """
+    Session sending the statements that touch a shard table to the shard selected for
+    the current plant, see use_shard(), and the ones that touch a local table to it when
+    a shard is selected. Every other statement goes to its usual bind.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        router = current_app.extensions.get("shards") if bind is None else None
+        if router is not None:
+            shard = g.get("shard")
+            if router.touches(mapper, clause):
+                if shard is None:
+                    raise ShardNotSelected("Entries are sharded by plant, select the plant with ?plant_id=.")
+                return self._db.engines[router.bind_key(shard)]
+            if shard is not None and router.touches(mapper, clause, router.local_tables):
+                return self._db.engines[router.bind_key(shard)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def shard_binds(config):
+    """
+    SQLALCHEMY_BINDS of the shards, one SQLite database per shard.
+
+    Shards read the catalog through an attached connection, which needs SQLite and the
+    WAL journaling of the sqlite engine profile so their readers never block its writers.
+
+    :param config: application config
+    :return: dictionary of bind key to engine options, empty when SHARD_COUNT is 0
+    """
+    count = config["SHARD_COUNT"]
+    if not count:
+        return {}
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    if not uri.startswith("sqlite") or config["ENGINE_PROFILE"] != "sqlite":
+        raise ValueError("Sharding requires a SQLite database with the 'sqlite' engine profile.")
+    if config["ARCHIVE_DATABASE"] is not None:
+        raise ValueError("ARCHIVE_DATABASE cannot be used with sharding, the archives live in the shards.")
+    if "{shard}" not in config["SHARD_DATABASE_URI"]:
+        raise ValueError("SHARD_DATABASE_URI must contain '{shard}'.")
+    # binds do not inherit SQLALCHEMY_ENGINE_OPTIONS
+    options = config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    return {ShardRouter.bind_key(shard): {**options, "url": config["SHARD_DATABASE_URI"].format(shard=shard)}
+            for shard in range(count)}
+
+def _attach_catalog(engine, path):
+    @event.listens_for(engine, "connect")
+    def _attach(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"ATTACH DATABASE ? AS {CATALOG_SCHEMA}", (path,))
+        cursor.close()
+
+def init_shards(app, db):
+    """
+    Route the shard tables of an app to its shard binds, when SHARD_COUNT is set.
+
+    Attaches the catalog to every shard connection and selects the shard of the
+    `plant_id` of each request, from its URL or its arguments.
+
+    :param app: Flask application, db must already be initialized on it
+    :param db: Flask-SQLAlchemy extension
+    """
+    if not app.config["SHARD_COUNT"]:
+        return
+    from .models import DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry, PlantDailyRollup, \
+        EntryChangeLog, ArchiveModels, IdempotencyKey
+    models = (DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry, PlantDailyRollup, EntryChangeLog,
+              *ArchiveModels.values())
+    router = ShardRouter(app.config["SHARD_COUNT"], [model_class.__table__ for model_class in models],
+                         [IdempotencyKey.__table__])
+
+    catalog = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).database
+    with app.app_context():
+        for shard in range(router.count):
+            _attach_catalog(db.engines[router.bind_key(shard)], catalog)
+
+    @app.before_request
+    def _select_shard():
+        plant_id = (request.view_args or {}).get("plant_id", request.args.get("plant_id"))
+        try:
+            g.shard = router.shard_of(int(plant_id)) if plant_id is not None else None
+        except ValueError:
+            g.shard = None
+
+    @app.errorhandler(ShardNotSelected)
+    def _shard_not_selected(error):
+        return jsonify({"error": str(error)}), 400
+
+    app.extensions["shards"] = router
+
+def shard_router():
+    """
+    ShardRouter of the current app, None when sharding is off.
+    """
+    return current_app.extensions.get("shards")
+
+def create_shard_tables(db):
+    """
+    Create the missing shard and local tables in every shard of the current app,
+    and the indexes added to the existing ones since they were created.
+    """
+    router = shard_router()
+    if router is None:
+        return
+    tables = list(router.tables | router.local_tables)
+    for shard in range(router.count):
+        engine = db.engines[router.bind_key(shard)]
+        db.metadata.create_all(engine, tables=tables)
+        for table in tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+
+
+# -- SELECTION ------------------------------------------------------
+@contextmanager
+def _selected(shard):
+    previous = g.get("shard")
+    g.shard = shard
+    try:
+        yield
+    finally:
+        g.shard = previous
+
+@contextmanager
+def use_shard(plant_id):
+    """
+    Send the shard statements of the block to the shard of a plant, a no-op when sharding is off.
+    """
+    router = shard_router()
+    if router is None:
+        yield
+        return
+    with _selected(router.shard_of(plant_id)):
+        yield
+
+def fan_out(function):
+    """
+    Call a function once per shard with that shard selected, for admin listings and maintenance.
+
+    Results of different shards can share ids, so the function should read with Core
+    statements rather than load ORM objects into the shared session.
+
+    :param function: function without arguments
+    :return: list of its results in shard order, a single result when sharding is off
+    """
+    router = shard_router()
+    if router is None:
+        return [function()]
+    results = []
+    for shard in range(router.count):
+        with _selected(shard):
+            results.append(function())
+    return results
+
+def on_shards(plant_id, function):
+    """
+    Call a function on the shard of a plant, or on every shard when plant_id is None.
+
+    :return: list of its results, see fan_out()
+    """
+    if plant_id is None:
+        return fan_out(function)
+    with use_shard(plant_id):
+        return [function()]
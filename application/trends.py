@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, union_all
+from .models import db, User, DosageEntry, CalibrationSection, RawWaterEntry, ArchiveModels
+from .archive import reaches_archive
+
+BucketSizes = {"hour", "day", "week"}
+
+# metric name -> column holding its value
+Metrics = {
+    "chemical_dose": CalibrationSection.calculated_chemical_dose,
+    "flow_rate": CalibrationSection.calculated_flow_rate,
+    "utn": RawWaterEntry.utn,
+}
+
+# strftime formats and modifiers that truncate a SQLite timestamp to the start of its bucket
+_SQLITE_BUCKETS = {
+    "hour": ("%Y-%m-%d %H:00:00",),
+    "day": ("%Y-%m-%d 00:00:00",),
+    # 'weekday 0' moves forward to Sunday, so weeks start on the Monday before it
+    "week": ("%Y-%m-%d 00:00:00", "weekday 0", "-6 days"),
+}
+
+
+def bucket_expression(dialect_name, bucket, column):
+    """
+    SQL expression truncating a timestamp column to the start of its bucket.
+
+    :param dialect_name: name of the database dialect
+    :param bucket: one of BucketSizes
+    :param column: timestamp column to truncate
+    :return: SQL expression, or None if the dialect has no supported date functions
+    """
+    if dialect_name == "sqlite":
+        fmt, *modifiers = _SQLITE_BUCKETS[bucket]
+        return func.strftime(fmt, column, *modifiers)
+    if dialect_name == "postgresql":
+        return func.date_trunc(bucket, column)
+    return None
+
+def truncate(timestamp, bucket):
+    """
+    Truncate a datetime to the start of its bucket, in python.
+    """
+    if bucket == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    return day
+
+def _table_source(metric, plant_id, start, end, archived=False):
+    """
+    Value and timestamp columns of a metric plus the filtered FROM clause they come from,
+    in the hot tables or in the archive tables.
+    """
+    if metric == "utn":
+        entry = ArchiveModels[RawWaterEntry] if archived else RawWaterEntry
+        value = entry.utn
+        source = (select().select_from(entry)
+                  .join(User, User.id == entry.user_id))
+    else:
+        entry = ArchiveModels[DosageEntry] if archived else DosageEntry
+        calibration = ArchiveModels[CalibrationSection] if archived else CalibrationSection
+        value = getattr(calibration, Metrics[metric].key)
+        source = (select().select_from(calibration)
+                  .join(entry, entry.id == calibration.dosage_entry_id)
+                  .join(User, User.id == entry.user_id))
+        if not archived:
+            source = source.where(entry.is_deleted.is_(False))
+    timestamp = entry.created_at
+    source = source.where(User.plant_id == plant_id)
+    if start is not None:
+        source = source.where(timestamp >= start)
+    if end is not None:
+        source = source.where(timestamp < end)
+    return value, timestamp, source
+
+def _metric_source(metric, plant_id, start, end):
+    """
+    Value and timestamp columns of a metric plus the filtered FROM clause they come from.
+
+    The archive tables are only unioned in when the time range reaches back into them.
+    """
+    value, timestamp, source = _table_source(metric, plant_id, start, end)
+    if not reaches_archive(RawWaterEntry if metric == "utn" else DosageEntry, start):
+        return value, timestamp, source
+    archived_value, archived_timestamp, archived_source = _table_source(metric, plant_id, start, end, archived=True)
+    rows = union_all(
+        source.add_columns(timestamp.label("created_at"), value.label("value")),
+        archived_source.add_columns(archived_timestamp.label("created_at"), archived_value.label("value"))).subquery()
+    return rows.c.value, rows.c.created_at, select().select_from(rows)
+
+def _as_datetime(bucket_start):
+    """
+    Normalize a bucket start returned by the database to a datetime.
+    """
+    if isinstance(bucket_start, str):
+        return datetime.fromisoformat(bucket_start)
+    return bucket_start
+
+def metric_trend(metric, plant_id, bucket="day", start=None, end=None):
+    """
+    Downsample a metric of a plant into time buckets.
+
+    The grouping runs in SQL on SQLite and Postgres. Other backends stream the
+    raw (timestamp, value) pairs once and aggregate them in python.
+
+    :param metric: one of Metrics
+    :param plant_id: id of the plant
+    :param bucket: one of BucketSizes
+    :param start: inclusive lower bound of the time range, None for unbounded
+    :param end: exclusive upper bound of the time range, None for unbounded
+    :return: list of dictionaries with the bucket start and the min, max, mean and count of each bucket
+    """
+    value, timestamp, source = _metric_source(metric, plant_id, start, end)
+    bucket_start = bucket_expression(db.session.get_bind().dialect.name, bucket, timestamp)
+
+    if bucket_start is not None:
+        query = (source.add_columns(
+                    bucket_start.label("bucket"),
+                    func.min(value), func.max(value), func.avg(value), func.count(value))
+                 .group_by(bucket_start)
+                 .order_by(bucket_start))
+        return [
+            {"bucket": _as_datetime(b).isoformat(), "min": lo, "max": hi, "mean": mean, "count": count}
+            for b, lo, hi, mean, count in db.session.execute(query)]
+
+    buckets = {}
+    for ts, v in db.session.execute(source.add_columns(timestamp, value).execution_options(yield_per=5000)):
+        key = truncate(ts, bucket)
+        stats = buckets.get(key)
+        if stats is None:
+            buckets[key] = [v, v, v, 1]
+        else:
+            stats[0] = min(stats[0], v)
+            stats[1] = max(stats[1], v)
+            stats[2] += v
+            stats[3] += 1
+    return [
+        {"bucket": b.isoformat(), "min": lo, "max": hi, "mean": total / count, "count": count}
+        for b, (lo, hi, total, count) in sorted(buckets.items())]
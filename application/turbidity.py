@@ -0,0 +1,237 @@
+import math
+import threading
+from collections import deque
+from sqlalchemy import select
+from .models import db, User, RawWaterEntry
+from .sharding import fan_out
+
+# readings are whole NTU, a narrower spread is counted as 1 NTU so a flat history
+# does not turn every small change into an alert
+MIN_STD = 1.0
+
+
+class TurbidityStats:
+    """
+    Rolling statistics of the latest raw water turbidity readings of a plant.
+
+    Keeps the readings of a count window with their running sum and sum of squares,
+    and an exponentially weighted moving average, so adding a reading is O(1) whatever
+    the size of the history. Readings are integers, so the running sums stay exact.
+    """
+
+    def __init__(self, window, alpha):
+        # (entry id, utn) of the readings in the window
+        self.readings = deque(maxlen=window)
+        self.entry_ids = set()
+        self.alpha = alpha
+        self.total = 0
+        self.total_sq = 0
+        self.ewma = None
+        self.last_entry_id = 0
+
+    def add(self, entry_id, utn):
+        """
+        Add a reading, ignoring the ones already in the window.
+
+        :return: whether the reading was added
+        """
+        if entry_id in self.entry_ids:
+            return False
+        if len(self.readings) == self.readings.maxlen:
+            oldest_id, oldest = self.readings[0]
+            self.entry_ids.discard(oldest_id)
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+        self.readings.append((entry_id, utn))
+        self.entry_ids.add(entry_id)
+        self.total += utn
+        self.total_sq += utn * utn
+        self.ewma = utn if self.ewma is None else self.ewma + self.alpha * (utn - self.ewma)
+        self.last_entry_id = max(self.last_entry_id, entry_id)
+        return True
+
+    @property
+    def count(self):
+        return len(self.readings)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def std(self):
+        """
+        Population standard deviation of the window, None when it is empty.
+        """
+        if not self.count:
+            return None
+        return math.sqrt((self.count * self.total_sq - self.total * self.total) / (self.count * self.count))
+
+    def z_score(self, utn):
+        """
+        Standard deviations a reading lies above the window mean, None when the window is empty.
+        """
+        if not self.count:
+            return None
+        return (utn - self.mean()) / max(self.std(), MIN_STD)
+
+    def snapshot(self):
+        return {"count": self.count, "mean": self.mean(), "std": self.std(), "ewma": self.ewma,
+                "last_entry_id": self.last_entry_id}
+
+
+class TurbidityMonitor:
+    """
+    In-memory turbidity statistics and spike alerts of every plant.
+
+    Each synced reading is scored against the rolling window of its plant before it is added:
+    a reading `threshold` standard deviations above the window mean, once the window holds
+    `min_readings`, raises an alert. Only the latest `alerts_kept` alerts of a plant are kept.
+    An alert is numbered by the id of its raw water entry, which survives restarts and is
+    shared by every worker, so clients poll for the alerts after the last seq they saw. Thread-safe.
+
+    :param window: readings in the rolling window of a plant
+    :param alpha: smoothing factor of the moving average
+    :param min_readings: readings needed before alerting
+    :param threshold: z-score of an alert
+    :param alerts_kept: alerts kept per plant
+    """
+
+    def __init__(self, window=96, alpha=0.1, min_readings=12, threshold=3.0, alerts_kept=100):
+        self._lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+        self.configure(window, alpha, min_readings, threshold, alerts_kept)
+
+    def configure(self, window, alpha, min_readings, threshold, alerts_kept):
+        """
+        Change the settings of the monitor, dropping every statistic and alert.
+        """
+        with self._lock:
+            self.window = window
+            self.alpha = alpha
+            self.min_readings = min_readings
+            self.threshold = threshold
+            self.alerts_kept = alerts_kept
+            self._warm = False
+            self._clear()
+
+    def _clear(self):
+        self._stats = {}
+        self._alerts = {}
+
+    def clear(self):
+        """
+        Drop every statistic and alert.
+        """
+        with self._lock:
+            self._clear()
+
+    def warm_start(self):
+        """
+        Rebuild the statistics of every plant from the latest readings in the database.
+
+        Reads the last `window` readings of every user with one query per database, each an
+        ORDER BY id DESC LIMIT window on the (user_id, id) index, then replays the last `window`
+        of each plant in memory without alerting. The moving average only sees the window,
+        the weight of the older readings being below (1 - alpha) ** window.
+        """
+        latest = (
+            select(RawWaterEntry.id)
+            .where(RawWaterEntry.user_id == User.id)
+            .order_by(RawWaterEntry.id.desc())
+            .limit(self.window)
+            .correlate(User))
+        statement = (
+            select(User.plant_id, RawWaterEntry.id, RawWaterEntry.utn)
+            .join(RawWaterEntry, RawWaterEntry.id.in_(latest))
+            .order_by(User.plant_id, RawWaterEntry.id))
+        rows = [row for shard_rows in fan_out(lambda: db.session.execute(statement).all()) for row in shard_rows]
+
+        stats = {}
+        for plant_id, entry_id, utn in rows:
+            if plant_id not in stats:
+                stats[plant_id] = TurbidityStats(self.window, self.alpha)
+            stats[plant_id].add(entry_id, utn)
+        with self._lock:
+            self._clear()
+            self._stats = stats
+            self._warm = True
+
+    def warm_start_once(self):
+        """
+        Warm start unless it already happened, run before each request so the
+        CLI commands, which serve no request, never read the readings.
+        """
+        if self._warm:
+            return
+        with self._warm_lock:
+            if not self._warm:
+                self.warm_start()
+
+    def record(self, plant_id, readings):
+        """
+        Score committed readings of a plant and add them to its statistics.
+
+        :param plant_id: id of the plant
+        :param readings: list of (raw water entry id, created_at, utn)
+        :return: list of the alerts raised
+        """
+        raised = []
+        with self._lock:
+            stats = self._stats.get(plant_id)
+            if stats is None:
+                stats = self._stats[plant_id] = TurbidityStats(self.window, self.alpha)
+            alerts = self._alerts.get(plant_id)
+            for entry_id, created_at, utn in sorted(readings, key=lambda reading: reading[0]):
+                z_score = stats.z_score(utn) if stats.count >= self.min_readings else None
+                mean, std, ewma = stats.mean(), stats.std(), stats.ewma
+                if not stats.add(entry_id, utn) or z_score is None or z_score < self.threshold:
+                    continue
+                if alerts is None:
+                    alerts = self._alerts[plant_id] = deque(maxlen=self.alerts_kept)
+                alert = {"seq": entry_id, "entry_id": entry_id, "created_at": created_at.isoformat(),
+                         "utn": utn, "z_score": z_score, "mean": mean, "std": std, "ewma": ewma}
+                alerts.append(alert)
+                raised.append(alert)
+        return raised
+
+    def forget(self, *plant_ids):
+        """
+        Drop the statistics and alerts of deleted plants.
+        """
+        with self._lock:
+            for plant_id in plant_ids:
+                self._stats.pop(plant_id, None)
+                self._alerts.pop(plant_id, None)
+
+    def alerts(self, plant_id, after=0):
+        """
+        Alerts of a plant numbered after a seq, the id of a raw water entry.
+        """
+        with self._lock:
+            return [alert for alert in self._alerts.get(plant_id, ()) if alert["seq"] > after]
+
+    def stats(self, plant_id):
+        """
+        Current statistics of a plant, None if none of its readings were seen.
+        """
+        with self._lock:
+            stats = self._stats.get(plant_id)
+            return stats.snapshot() if stats is not None else None
+
+
+# -- PLANT MONITOR ------------------------------------------------------
+turbidity_monitor = TurbidityMonitor()
+
+def record_turbidity(plant_id, entries, created):
+    """
+    Feed the raw water entries of a committed batch to the monitor.
+
+    :param plant_id: id of the plant
+    :param entries: validated entry payloads
+    :param created: results of insert_entries() for the entries, in the same order
+    :return: list of the alerts raised
+    """
+    readings = [(ids["id"], entry["created_at"], entry["utn"])
+                for entry, ids in zip(entries, created) if ids["type"] == "raw_water"]
+    if not readings:
+        return []
+    return turbidity_monitor.record(plant_id, readings)
@@ -1,18 +1,26 @@
-from flask import jsonify
-from sqlalchemy.inspection import inspect
+import time
+from flask import jsonify, request, Response, stream_with_context
+from flask import current_app as app
+from sqlalchemy import insert
+from . import db
+from .serializers import serializer_for, row_select, row_serializer_for
+from .metrics import record_serialization
+from .validation import parse_timestamp
 
 # generalized serialization function
 def serialize_model(model_instance):
     """
     Serialize a SQLAlchemy model instance into a dictionary.
 
+    Uses the serializer compiled once for the instance's class, see serializers.py.
+
     :param model_instance: The SQLAlchemy model instance to serialize.
     :return: A dictionary containing the model instance's attributes.
     """
-    return {
-        c.key: getattr(model_instance, c.key)
-        for c in inspect(model_instance).mapper.column_attrs
-    }
+    started = time.perf_counter()
+    serialized = serializer_for(type(model_instance))(model_instance)
+    record_serialization(started)
+    return serialized
 
 # generalized response formats 
 def success_response(data, status=200):
@@ -23,7 +31,10 @@ def success_response(data, status=200):
     :param status: status code of the response with default 200
     :return: JSON response with data and status code
     """
-    return jsonify(data), status
+    started = time.perf_counter()
+    response = jsonify(data)
+    record_serialization(started)
+    return response, status
 
 def failure_response(message, status=400):
     """
@@ -35,16 +46,174 @@ def failure_response(message, status=400):
     """
     return jsonify({"error": message}), status
 
-# generalized body request unpacking 
-def extract_fields(body, *fields):
+# generalized keyset pagination
+def page_args():
+    """
+    Parse the keyset pagination arguments of the current request.
+
+    :return: tuple of (after_id, limit), otherwise raises ValueError if either is invalid
+    """
+    try:
+        after_id = int(request.args["after_id"]) if "after_id" in request.args else None
+        limit = int(request.args.get("limit", app.config["DEFAULT_PAGE_LIMIT"]))
+    except ValueError:
+        raise ValueError("after_id and limit must be integers")
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return after_id, min(limit, app.config["MAX_PAGE_LIMIT"])
+
+def keyset_page(statement, id_column, after_id=None, limit=100):
+    """
+    Fetch a single page of a Core SELECT ordered by its primary key.
+
+    Rows are selected with `id > after_id` instead of an OFFSET, so every page
+    costs an index range scan no matter how deep into the table it is.
+
+    :param statement: SELECT to paginate, including an `id` column
+    :param id_column: primary key column used as the cursor
+    :param after_id: last id of the previous page, None for the first page
+    :param limit: maximum number of rows in the page
+    :return: tuple of (rows, next_after_id) where next_after_id is None on the last page
+    """
+    if after_id is not None:
+        statement = statement.where(id_column > after_id)
+    # fetch one extra row to know whether another page exists
+    rows = db.session.execute(statement.order_by(id_column).limit(limit + 1)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+def stream_json_array(key, statement, serializer):
+    """
+    Stream a Core SELECT as a JSON object holding a single array, without loading it.
+
+    Rows are fetched from a server-side cursor in chunks of STREAM_CHUNK_SIZE and
+    each chunk is encoded and sent before the next one is read.
+
+    :param key: name of the array in the response object
+    :param statement: SELECT producing the rows to stream
+    :param serializer: function turning a row into a dictionary
+    :return: streamed JSON response
+    """
+    chunk_size = app.config["STREAM_CHUNK_SIZE"]
+    dumps = app.json.dumps
+
+    def generate():
+        yield '{"%s": [' % key
+        separator = ""
+        chunk = []
+        for row in db.session.execute(statement.execution_options(yield_per=chunk_size)):
+            chunk.append(dumps(serializer(row)))
+            if len(chunk) == chunk_size:
+                yield separator + ",".join(chunk)
+                separator = ","
+                chunk = []
+        if chunk:
+            yield separator + ",".join(chunk)
+        yield "]}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+def wants_stream():
+    """
+    Whether the current request opted into a streamed response with `?stream=true`.
+    """
+    return request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+# generalized time range parsing
+def time_range_args():
     """
-    Extract value of key-value pairs from a request body.
-    
-    :param body: request body
-    :param fields: list of keys to extract from the body
-    :return: list of values extracted from the body, otherwise list of missing fields
+    Parse the optional ISO 8601 `start` and `end` arguments of the current request.
+
+    Bounds with an offset are converted to naive local time, see validation.parse_timestamp().
+
+    :return: tuple of (start, end) datetimes, each None if absent, otherwise raises ValueError if either is invalid
+    """
+    bounds = []
+    for arg in ("start", "end"):
+        value = request.args.get(arg)
+        try:
+            bounds.append(parse_timestamp(value) if value else None)
+        except ValueError:
+            raise ValueError(f"{arg} must be an ISO 8601 timestamp")
+    start, end = bounds
+    if start is not None and end is not None and start >= end:
+        raise ValueError("start must be before end")
+    return start, end
+
+# generalized single round trip inserts
+def insert_row(model_class, values):
+    """
+    Insert a row and serialize it, with INSERT .. RETURNING where the backend supports it.
+
+    :param model_class: SQLAlchemy model class of the row
+    :param values: column values of the row
+    :return: dictionary of the inserted row, including server generated values
+    """
+    table = model_class.__table__
+    if db.session.get_bind().dialect.insert_returning:
+        row = db.session.execute(
+            insert(table).values(values).returning(*row_select(model_class).selected_columns)).one()
+        return row_serializer_for(model_class)(row)
+    pk = db.session.execute(insert(table).values(values)).inserted_primary_key[0]
+    return serialize_model(db.session.get(model_class, pk))
+
+def insert_returning_ids(session, table, rows):
+    """
+    Insert many rows with one statement and return their ids in the same order.
+
+    Uses batched INSERT .. RETURNING when the backend supports it for executemany,
+    otherwise falls back to one insert per row.
+
+    :param session: session to execute the statement in
+    :param table: table to insert into
+    :param rows: list of column values, all with the same keys
+    :return: list of the ids of the inserted rows
+    """
+    if not rows:
+        return []
+    dialect = session.get_bind().dialect
+    if dialect.name == "sqlite":
+        # SQLite cannot guarantee the order of RETURNING rows, so SQLAlchemy would insert
+        # row by row to keep it. Rowids are allocated in increasing order while the
+        # transaction holds the write lock, so sorting the ids restores the input order.
+        return sorted(session.execute(insert(table).returning(table.c.id), rows).scalars())
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = session.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True), rows)
+        return list(result.scalars())
+    return [session.execute(insert(table), row).inserted_primary_key[0] for row in rows]
+
+def unique_violation(error, table_name, *columns):
+    """
+    Find which UNIQUE column an IntegrityError was raised for.
+
+    Understands the messages of SQLite ("UNIQUE constraint failed: plants.name") and
+    Postgres ("Key (name)=(...) already exists" / "plants_name_key").
+
+    :param error: IntegrityError raised by the insert
+    :param table_name: name of the table the row was inserted into
+    :param columns: UNIQUE columns of the table
+    :return: name of the violated column, None if the error is not a UNIQUE violation on them
+    """
+    message = str(error.orig)
+    for column in columns:
+        if f"{table_name}.{column}" in message or f"({column})=" in message or f"{table_name}_{column}_key" in message:
+            return column
+    return None
+
+# generalized batch status code
+def batch_status(results, done="created", done_status=201):
+    """
+    Status code of a batch request from its per-item results.
+
+    :param results: list of per-item result dictionaries with a "status"
+    :param done: status of the items that went through
+    :param done_status: status code when every item went through
+    :return: done_status if every item went through, 207 if some did, otherwise 400
     """
-    missing_fields = [field for field in fields if field not in body or body[field] is None]
-    if missing_fields:
-        return None, missing_fields
-    return [body[field] for field in fields], None
\ No newline at end of file
+    done_count = sum(1 for r in results if r["status"] == done)
+    if done_count == len(results):
+        return done_status
+    return 207 if done_count else 400
@@ -0,0 +1,235 @@
+import math
+from datetime import datetime
+from .models import ChemicalTypes
+
+# -- FIELD CONVERSIONS ------------------------------------------------------
+# every conversion returns the coerced value, or None when the value has the wrong type
+# (bools are never accepted as numbers, numeric strings are)
+def _as_string(value):
+    return value if isinstance(value, str) else None
+
+def _as_integer(value):
+    if type(value) is int:
+        return value
+    if type(value) is str:
+        try:
+            return int(value)
+        except ValueError:
+            return None
+    return None
+
+def _as_number(value):
+    if type(value) is int or type(value) is float:
+        return value if math.isfinite(value) else None
+    if type(value) is str:
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        return number if math.isfinite(number) else None
+    return None
+
+def parse_timestamp(value):
+    """
+    Parse an ISO 8601 timestamp into a naive datetime.
+
+    Timestamps are stored naive, on the clock of the datetime.now() defaults, so a timestamp
+    with an offset is converted to the server's local time before its offset is dropped.
+
+    :raises ValueError: if the value is not an ISO 8601 timestamp
+    """
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+def _as_timestamp(value):
+    if type(value) is str:
+        try:
+            return parse_timestamp(value)
+        except ValueError:
+            return None
+    return None
+
+# kind -> (conversion, error message suffix)
+_KINDS = {
+    "string": ("_as_string", "must be a string"),
+    "integer": ("_as_integer", "must be an integer"),
+    "number": ("_as_number", "must be a number"),
+    "timestamp": ("_as_timestamp", "must be an ISO 8601 timestamp"),
+    "object": (None, "must be an object"),
+}
+
+
+class Field:
+    """
+    Declarative spec of a payload field.
+
+    :param kind: "string", "integer", "number", "timestamp" or "object"
+    :param required: whether a missing or null value is an error
+    :param default: function called for the value of a missing field, instead of an error
+    :param choices: set of the accepted values
+    :param label: name of the field in the error of a value outside the choices
+    :param positive: whether numbers must be greater than zero
+    :param schema: PayloadSchema of an "object" field
+    """
+
+    def __init__(self, kind, required=True, default=None, choices=None, label=None, positive=False, schema=None):
+        if kind not in _KINDS:
+            raise ValueError(f"Field kind '{kind}' invalid.")
+        self.kind = kind
+        self.required = required
+        self.default = default
+        self.choices = choices
+        self.label = label
+        self.positive = positive
+        self.schema = schema
+
+    def optional(self):
+        """
+        Same field, neither required nor defaulted.
+        """
+        return Field(self.kind, False, None, self.choices, self.label, self.positive, self.schema)
+
+
+def _compile(name, fields):
+    """
+    Generate the validator of a set of fields, one straight-line block per field.
+
+    :param name: name of the generated function
+    :param fields: mapping of key to Field
+    :return: function taking a payload dictionary and an error prefix, returning (values, errors)
+    """
+    namespace = {"_as_string": _as_string, "_as_integer": _as_integer, "_as_number": _as_number,
+                 "_as_timestamp": _as_timestamp}
+    lines = [f"def {name}(payload, prefix):", "    values = {}", "    errors = []"]
+    for position, (key, field) in enumerate(fields.items()):
+        conversion, type_error = _KINDS[field.kind]
+        lines += [f"    value = payload.get({key!r})", "    if value is None:"]
+        if field.default is not None:
+            namespace[f"_default_{position}"] = field.default
+            lines.append(f"        values[{key!r}] = _default_{position}()")
+        elif field.required:
+            lines.append(f"        errors.append('missing ' + prefix + {key!r})")
+        else:
+            lines.append("        pass")
+
+        if field.kind == "object":
+            namespace[f"_schema_{position}"] = field.schema._validate
+            lines += [
+                "    elif type(value) is not dict:",
+                f"        errors.append(prefix + {key + ' ' + type_error!r})",
+                "    else:",
+                f"        nested, nested_errors = _schema_{position}(value, prefix + {key + '.'!r})",
+                "        errors.extend(nested_errors)",
+                f"        values[{key!r}] = nested"]
+            continue
+        lines += [
+            "    else:",
+            f"        converted = {conversion}(value)",
+            "        if converted is None:",
+            f"            errors.append(prefix + {key + ' ' + type_error!r})"]
+        if field.choices is not None:
+            namespace[f"_choices_{position}"] = frozenset(field.choices)
+            lines += [
+                f"        elif converted not in _choices_{position}:",
+                f"            errors.append({(field.label or key) + ' '!r} + repr(str(converted)) + ' invalid.')"]
+        if field.positive:
+            lines += [
+                "        elif converted <= 0:",
+                f"            errors.append(prefix + {key + ' must be positive'!r})"]
+        lines += ["        else:", f"            values[{key!r}] = converted"]
+    lines.append("    return values, errors")
+    exec("\n".join(lines) + "\n", namespace)
+    return namespace[name]
+
+
+class PayloadSchema:
+    """
+    Declarative schema of a request payload, compiled into a validator when it is defined.
+
+    Validation checks every field in a single pass, coerces numeric strings and ISO 8601
+    timestamps, and reports all the errors of the payload at once. Unknown keys are dropped.
+
+    :param name: name of the payload in error messages, like "plant"
+    :param fields: mapping of key to Field
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self._validate = _compile(f"validate_{name}", fields)
+
+    def validate(self, payload):
+        """
+        Validate a single payload.
+
+        :return: tuple of (coerced values, list of error messages), values are None if not an object
+        """
+        if type(payload) is not dict:
+            return None, [f"{self.name} must be an object"]
+        return self._validate(payload, "")
+
+    def validate_all(self, payloads):
+        """
+        Validate the items of a bulk payload in one pass.
+
+        :return: list of (coerced values, list of error messages), in input order
+        """
+        validate = self._validate
+        not_object = [f"{self.name} must be an object"]
+        return [validate(payload, "") if type(payload) is dict else (None, not_object) for payload in payloads]
+
+    def partial(self, name):
+        """
+        Schema of the same fields all optional, for updates.
+        """
+        return PayloadSchema(name, {key: field.optional() for key, field in self.fields.items()})
+
+
+# -- SCHEMAS ------------------------------------------------------
+PLANT_SCHEMA = PayloadSchema("plant", {
+    "name": Field("string"),
+    "phone_number": Field("string"),
+    "chemical_type": Field("string", choices=ChemicalTypes, label="Chemical"),
+    "chemical_concentration": Field("number", positive=True),
+    "num_filters": Field("integer"),
+    "num_clarifiers": Field("integer"),
+})
+CONFIGURATION_SCHEMA = PayloadSchema("configuration", {
+    key: PLANT_SCHEMA.fields[key] for key in ("chemical_type", "chemical_concentration", "num_filters", "num_clarifiers")
+}).partial("configuration")
+USER_SCHEMA = PayloadSchema("user", {
+    "name": Field("string"),
+    "email": Field("string"),
+    "phone_number": Field("string"),
+    "plant_name": Field("string"),
+})
+
+# entry sections (the calculated calibration values are derived on the server, see calibration.py)
+CALIBRATION_SCHEMA = PayloadSchema("calibration", {
+    "slider_position": Field("number"),
+    "inflow_rate": Field("integer", positive=True),
+    "starting_volume": Field("integer"),
+    "ending_volume": Field("integer"),
+    "elapsed_seconds": Field("integer", positive=True),
+})
+CHANGE_DOSE_SCHEMA = PayloadSchema("change_dose", {
+    "target_coagulant_dose": Field("number"),
+    "new_slider_position": Field("number"),
+})
+# entries by their "type", created_at defaults to the time they are received
+ENTRY_SCHEMAS = {
+    "dosage": PayloadSchema("dosage", {
+        "user_id": Field("integer"),
+        "created_at": Field("timestamp", default=datetime.now),
+        "calibration": Field("object", required=False, schema=CALIBRATION_SCHEMA),
+        "change_dose": Field("object", required=False, schema=CHANGE_DOSE_SCHEMA),
+    }),
+    "raw_water": PayloadSchema("raw_water", {
+        "user_id": Field("integer"),
+        "created_at": Field("timestamp", default=datetime.now),
+        "utn": Field("integer"),
+        "turbidity_method": Field("string", required=False),
+    }),
+}
@@ -0,0 +1,73 @@
+import hashlib
+from functools import wraps
+from flask import request, make_response
+from sqlalchemy import select
+from .models import db, TableVersion
+from .engine import upsert_insert
+from .embedding import included_models
+
+
+def table_versions(*models):
+    """
+    Current version counters of the tables of the given models, in a single query.
+
+    :param models: SQLAlchemy model classes
+    :return: dictionary of table name to version, 0 for tables never written
+    """
+    names = [m.__tablename__ for m in models]
+    versions = dict.fromkeys(names, 0)
+    versions.update(db.session.execute(
+        select(TableVersion.table_name, TableVersion.version)
+        .where(TableVersion.table_name.in_(names))).tuples().all())
+    return versions
+
+def bump_versions(session, *models):
+    """
+    Increment the version counters of the tables of the given models.
+
+    Runs in the caller's transaction so the new versions commit together with the write.
+    A single INSERT .. ON CONFLICT DO UPDATE creates or increments each counter, so two
+    transactions writing a table for the first time cannot collide on its row.
+
+    :param session: session to execute the statements in
+    :param models: SQLAlchemy model classes whose tables were written
+    """
+    table = TableVersion.__table__
+    statement = upsert_insert(session, TableVersion)
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[table.c.table_name],
+            set_={"version": table.c.version + 1}),
+        [{"table_name": name, "version": 1} for name in sorted({m.__tablename__ for m in models})])
+
+def conditional(*models, embeds=None):
+    """
+    Decorator adding a strong ETag to a GET route and answering If-None-Match with 304.
+
+    The ETag is derived from the request path and query string plus the versions of the
+    tables the route reads, so the 304 is sent before any row is loaded or serialized.
+
+    :param models: SQLAlchemy model classes whose tables the route reads
+    :param embeds: model class of the resource whose `?include=` relationships the route embeds,
+        their tables are read too
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            read = set(models)
+            if embeds is not None:
+                read |= included_models(embeds)
+            versions = table_versions(*read)
+            key = request.full_path + "|" + ",".join(f"{name}={v}" for name, v in sorted(versions.items()))
+            etag = hashlib.sha1(key.encode()).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
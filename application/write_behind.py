@@ -0,0 +1,170 @@
+import atexit
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+from sqlalchemy.exc import SQLAlchemyError
+from .models import db
+from .cache import LRUCache
+from .entries import insert_entries
+from .dose_model import record_calibrations
+from .turbidity import record_turbidity
+from .sharding import use_shard
+
+
+class QueueFull(Exception):
+    """
+    Raised when a batch does not fit in the write-behind queue, or the queue is stopped.
+    """
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-process queue of validated entries written by a background thread.
+
+    The writer coalesces whatever was queued into one set-based insert per plant and a
+    single commit, every `flush_interval` seconds or as soon as `flush_items` entries
+    are waiting. Each entry is acknowledged with a provisional id that resolves to its
+    final ids once written. Stopping the queue writes every entry still waiting.
+    """
+
+    def __init__(self, app, maxsize=10000, flush_interval=0.05, flush_items=500, results_size=100000):
+        self.app = app
+        self.maxsize = maxsize
+        self.flush_interval = flush_interval
+        self.flush_items = flush_items
+        self._items = deque()
+        self._ready = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._prefix = uuid.uuid4().hex[:12]
+        self._sequence = itertools.count(1)
+        # provisional id -> result of the written entry, kept for clients polling their entries
+        self.results = LRUCache(maxsize=results_size, ttl=3600)
+        self.commits = self.written = self.failed = 0
+
+    def start(self):
+        """
+        Start the writer thread and flush the queue when the interpreter exits.
+        """
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        return self
+
+    def submit(self, plant_id, entries):
+        """
+        Queue validated entries of a plant, all of them or none.
+
+        :param plant_id: id of the plant the entries belong to
+        :param entries: validated entry payloads
+        :return: provisional ids of the entries, in input order
+        :raises QueueFull: if the entries do not fit in the queue or it is stopped
+        """
+        with self._ready:
+            if self._closed or len(self._items) + len(entries) > self.maxsize:
+                raise QueueFull()
+            provisional_ids = [f"{self._prefix}-{next(self._sequence)}" for _ in entries]
+            self._items.extend(zip(provisional_ids, itertools.repeat(plant_id), entries))
+            if len(self._items) >= self.flush_items:
+                self._ready.notify()
+        return provisional_ids
+
+    def stop(self, timeout=None):
+        """
+        Stop accepting entries and wait until the writer has written the queued ones.
+        """
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def pending(self):
+        """
+        Number of entries waiting to be written.
+        """
+        with self._ready:
+            return len(self._items)
+
+    def stats(self):
+        """
+        Queue depth and writer counters.
+        """
+        return {"pending": self.pending(), "maxsize": self.maxsize, "commits": self.commits,
+                "written": self.written, "failed": self.failed}
+
+    def _next_batch(self):
+        """
+        Wait for the next batch: a full one, the entries of an elapsed interval, or the rest once stopped.
+
+        :return: list of queued items, empty once the queue is stopped and drained
+        """
+        with self._ready:
+            while not self._items and not self._closed:
+                self._ready.wait()
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._items) < self.flush_items and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._ready.wait(remaining)
+            return [self._items.popleft() for _ in range(min(self.flush_items, len(self._items)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            with self.app.app_context():
+                try:
+                    self._write(batch)
+                except Exception:  # keep writing later batches
+                    self.app.logger.exception("Write-behind flush of %d entries failed", len(batch))
+                finally:
+                    db.session.remove()
+
+    def _write(self, batch):
+        """
+        Write a batch with one insert per plant and table and a single commit.
+
+        If the commit fails, every plant is retried in its own transaction so one
+        bad plant does not lose the entries of the others.
+        """
+        by_plant = {}
+        for provisional_id, plant_id, entry in batch:
+            by_plant.setdefault(plant_id, []).append((provisional_id, entry))
+        try:
+            created = {}
+            for plant_id, items in by_plant.items():
+                with use_shard(plant_id):
+                    created[plant_id] = insert_entries(db.session, plant_id, [e for _, e in items])
+            db.session.commit()
+            self.commits += 1
+        except SQLAlchemyError:
+            db.session.rollback()
+            created = {}
+            for plant_id, items in by_plant.items():
+                try:
+                    with use_shard(plant_id):
+                        created[plant_id] = insert_entries(db.session, plant_id, [e for _, e in items])
+                    db.session.commit()
+                    self.commits += 1
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    self.app.logger.exception("Write-behind entries of plant %s could not be written", plant_id)
+
+        for plant_id, items in by_plant.items():
+            if plant_id not in created:
+                self.failed += len(items)
+                for provisional_id, _ in items:
+                    self.results.set(provisional_id, {"status": "failed"})
+                continue
+            self.written += len(items)
+            for (provisional_id, _), ids in zip(items, created[plant_id]):
+                self.results.set(provisional_id, {"status": "created", **ids})
+            record_calibrations(plant_id, [
+                (ids["calibration_id"], entry["calibration"]["calculated_chemical_dose"], entry["calibration"]["slider_position"])
+                for (_, entry), ids in zip(items, created[plant_id]) if ids.get("calibration_id") is not None])
+            record_turbidity(plant_id, [entry for _, entry in items], created[plant_id])
@@ -0,0 +1,7 @@
+"""
+Benchmarks of the API, run from the repository root.
+
+  python3 -m benchmarks run|compare ...      route suite over a seeded database, see suite.py
+  python3 -m benchmarks.bench_serializers    serializer microbenchmark
+  python3 -m benchmarks.bench_engine_profiles  database engine profiles
+"""
@@ -0,0 +1,125 @@
+"""
+Write and read throughput of the database engine profiles.
+
+Every profile runs the same workloads on a fresh database:
+  writes: transactions each inserting a batch of raw water entries
+  reads:  indexed range reads of a user's latest entries
+  mixed:  one writer and several readers sharing the database for a fixed time
+
+Utilize "python3 -m benchmarks.bench_engine_profiles [--transactions N] [--batch B] [--readers R]
+[--seconds S] [--postgres-url URL]" from the repository root. The postgres profile only runs
+when a database URL is given, its tables are dropped at the end.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, insert, select
+from config import Config
+from application import db
+from application.models import Plant, Configuration, User, RawWaterEntry
+from application.engine import sqlite_pragmas, postgres_engine_options, use_sqlite_pragmas, archive_execution_options
+
+CONFIG = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+
+
+def make_engine(profile, url):
+    if profile == "postgres":
+        return create_engine(url, **postgres_engine_options(CONFIG), execution_options=archive_execution_options(CONFIG))
+    engine = create_engine(url, execution_options=archive_execution_options(CONFIG))
+    if profile == "sqlite":
+        use_sqlite_pragmas(engine, sqlite_pragmas(CONFIG))
+    return engine
+
+def seed(engine):
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Configuration), [
+            {"id": 1, "chemical_type": "PAC", "chemical_concentration": 0.1, "num_filters": 1, "num_clarifiers": 1}])
+        connection.execute(insert(Plant), [{"id": 1, "name": "bench", "phone_number": "1", "config_id": 1}])
+        connection.execute(insert(User), [{"id": 1, "name": "bench", "email": "bench@email.com",
+                                           "phone_number": "1", "password": "bench", "plant_id": 1}])
+
+def write_batch(engine, size):
+    rows = [{"user_id": 1, "created_at": datetime.now(), "utn": i, "turbidity_method": "bench"} for i in range(size)]
+    with engine.begin() as connection:
+        connection.execute(insert(RawWaterEntry), rows)
+
+def read_latest(engine):
+    with engine.connect() as connection:
+        connection.execute(
+            select(RawWaterEntry.id, RawWaterEntry.utn)
+            .where(RawWaterEntry.user_id == 1)
+            .order_by(RawWaterEntry.created_at.desc())
+            .limit(50)).all()
+
+def mixed(engine, batch, readers, seconds):
+    """
+    Count the writes and reads completed while one writer and `readers` readers run concurrently.
+    """
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def loop(key, operation):
+        while time.perf_counter() < deadline:
+            try:
+                operation()
+                done = key
+            except Exception:  # lock timeouts count against the profile
+                done = "errors"
+            with lock:
+                counts[done] += 1
+
+    threads = [threading.Thread(target=loop, args=("writes", lambda: write_batch(engine, batch)))]
+    threads += [threading.Thread(target=loop, args=("reads", lambda: read_latest(engine))) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+def run(profile, url, args):
+    engine = make_engine(profile, url)
+    seed(engine)
+    start = time.perf_counter()
+    for _ in range(args.transactions):
+        write_batch(engine, args.batch)
+    write_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(args.transactions):
+        read_latest(engine)
+    read_seconds = time.perf_counter() - start
+    counts = mixed(engine, args.batch, args.readers, args.seconds)
+    if profile == "postgres":
+        db.metadata.drop_all(engine)
+    engine.dispose()
+
+    print(f"{profile:<10} writes {args.transactions / write_seconds:9.1f} tx/s  "
+          f"reads {args.transactions / read_seconds:9.1f} q/s  "
+          f"mixed {counts['writes'] / args.seconds:8.1f} tx/s + {counts['reads'] / args.seconds:9.1f} q/s"
+          f"  ({counts['errors']} errors)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=500, help="write transactions and reads per run")
+    parser.add_argument("--batch", type=int, default=20, help="rows inserted per write transaction")
+    parser.add_argument("--readers", type=int, default=4, help="reader threads of the mixed workload")
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration of the mixed workload")
+    parser.add_argument("--postgres-url", help="database URL of the postgres profile")
+    args = parser.parse_args()
+
+    print(f"{args.transactions} transactions of {args.batch} rows, mixed: 1 writer + {args.readers} readers")
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ("default", "sqlite"):
+            run(profile, f"sqlite:///{os.path.join(directory, profile + '.db')}", args)
+    if args.postgres_url:
+        run("postgres", args.postgres_url, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Microbenchmark of the compiled serializers against the reflective serialize_model they replaced.
+
+Utilize "python3 -m benchmarks.bench_serializers [--rows N] [--repeat R]" from the repository root.
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime
+from sqlalchemy.inspection import inspect
+from werkzeug.http import http_date
+from application.models import DosageEntry
+from application.serializers import serializer_for, row_serializer_for, orjson
+
+
+def reflective_serialize(model_instance):
+    """serialize_model as it was before the compiled serializers: one inspect() per call."""
+    return {
+        c.key: getattr(model_instance, c.key)
+        for c in inspect(model_instance).mapper.column_attrs
+    }
+
+
+def best_of(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="rows serialized per run")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the best is kept")
+    args = parser.parse_args()
+
+    created_at = datetime(2024, 4, 1, 8, 0)
+    instances = [
+        DosageEntry(id=i, created_at=created_at, is_deleted=False, user_id=1, calibration_id=i, change_dose_id=None)
+        for i in range(args.rows)]
+    rows = [(i, created_at, False, 1, i, None) for i in range(args.rows)]
+    compiled = serializer_for(DosageEntry)
+    compiled_row = row_serializer_for(DosageEntry)
+
+    def encode(payload):
+        # what jsonify does with the serialized rows, dates included
+        return json.dumps(payload, default=http_date, sort_keys=True, separators=(",", ":"))
+
+    results = {
+        "reflective + json": lambda: encode([reflective_serialize(e) for e in instances]),
+        "compiled instances + json": lambda: encode([compiled(e) for e in instances]),
+        "compiled rows + json": lambda: encode([compiled_row(r) for r in rows]),
+    }
+    if orjson is not None:
+        results["compiled rows + orjson"] = lambda: orjson.dumps(
+            [compiled_row(r) for r in rows], option=orjson.OPT_SORT_KEYS)
+
+    print(f"{args.rows} DosageEntry rows serialized and encoded, best of {args.repeat}")
+    baseline = None
+    for name, func in results.items():
+        seconds = best_of(func, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:<28} {seconds * 1000:9.2f} ms  {seconds / args.rows * 1e6:7.2f} us/row  {baseline / seconds:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
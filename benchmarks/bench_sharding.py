@@ -0,0 +1,106 @@
+"""
+Entry write throughput of concurrent plants, with and without per-plant shards.
+
+One writer thread per plant syncs batches of raw water entries through the entries:batch
+route, each batch sent with its own Idempotency-Key so the request writes its entries, their
+change log, rollups and stored response like a client would. Every configuration runs in a
+fresh interpreter with the production settings on temporary SQLite databases:
+  single:   every plant writes into the one database
+  sharded:  SHARD_COUNT equal to the number of plants, one shard per plant
+
+The configurations alternate for --repeat rounds and the best run of each is kept.
+
+Utilize "python3 -m benchmarks.bench_sharding [--plants P] [--transactions N] [--batch B] [--repeat R]"
+from the repository root.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_plants(args):
+    """
+    Seed the plants and time their concurrent writers, in the child interpreter.
+    """
+    from application import create_app, db
+    from application.models import Configuration, Plant, User
+
+    app = create_app()
+    with app.app_context():
+        db.session.add_all([Configuration(id=p, chemical_type="PAC", chemical_concentration=0.1, num_filters=1,
+                                          num_clarifiers=1) for p in range(1, args.plants + 1)])
+        db.session.add_all([Plant(id=p, name=f"bench{p}", phone_number=str(p), config_id=p) for p in range(1, args.plants + 1)])
+        db.session.add_all([User(id=p, name=f"bench{p}", email=f"bench{p}@email.com", phone_number=str(p), plant_id=p)
+                            for p in range(1, args.plants + 1)])
+        db.session.commit()
+
+    failures = []
+
+    def writer(plant_id):
+        client = app.test_client()
+        for n in range(args.transactions):
+            response = client.post(
+                f"/api/plants/{plant_id}/entries:batch",
+                json={"entries": [{"type": "raw_water", "user_id": plant_id, "utn": i} for i in range(args.batch)]},
+                headers={"Idempotency-Key": f"bench-{plant_id}-{n}"})
+            if response.status_code != 201:
+                failures.append(f"Batch of plant {plant_id} failed with {response.status_code}.")
+                return
+
+    threads = [threading.Thread(target=writer, args=(p,)) for p in range(1, args.plants + 1)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    if failures:
+        sys.exit("\n".join(failures))
+    print(seconds)
+
+def run(mode, args, directory):
+    """
+    Seconds the writers of a configuration took, on databases of their own.
+    """
+    directory = tempfile.mkdtemp(dir=directory)
+    env = {**os.environ, "CONFIG_TYPE": "config.ProductionConfig", "SCHEMA_STARTUP": "migrate",
+           "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, mode + '.db')}",
+           "SHARD_COUNT": str(args.plants if mode == "sharded" else 0),
+           "SHARD_DATABASE_URI": f"sqlite:///{os.path.join(directory, mode + '_shard_{shard}.db')}"}
+    command = [sys.executable, "-m", "benchmarks.bench_sharding", "--child", "--plants", str(args.plants),
+               "--transactions", str(args.transactions), "--batch", str(args.batch)]
+    output = subprocess.run(command, env=env, cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plants", type=int, default=4, help="plants writing concurrently")
+    parser.add_argument("--transactions", type=int, default=200, help="transactions per plant")
+    parser.add_argument("--batch", type=int, default=20, help="entries per transaction")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per configuration, the best is kept")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        write_plants(args)
+        return
+
+    print(f"{args.plants} plants x {args.transactions} transactions of {args.batch} entries, best of {args.repeat}")
+    timings = {"single": [], "sharded": []}
+    with tempfile.TemporaryDirectory() as directory:
+        for _ in range(args.repeat):
+            for mode, seconds in timings.items():
+                seconds.append(run(mode, args, directory))
+    for mode, seconds in timings.items():
+        best = min(seconds)
+        print(f"{mode:<8} {args.plants * args.transactions / best:9.1f} tx/s  ({best:6.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Cold-start time of the application under the schema startup modes.
+
+Every run is a fresh interpreter timing the import of the application and create_app()
+with the production settings, on a database already at the current schema:
+  create_all: the former boot, create_all() checking every table (SCHEMA_STARTUP=none)
+  migrate:    reading the version stamp, then nothing to apply
+  check:      the production default, a single stamp check
+
+Utilize "python3 -m benchmarks.bench_startup [--runs N]" from the repository root.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from sqlalchemy import create_engine
+from config import Config
+from application.engine import archive_execution_options
+from application.schema import create_schema
+
+CONFIG = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run in the child interpreter, prints the seconds spent starting the application
+STARTUP = """
+import time
+start = time.perf_counter()
+from application import create_app, db
+app = create_app()
+if {create_all}:
+    with app.app_context():
+        db.create_all()
+print(time.perf_counter() - start)
+"""
+
+MODES = {"create_all": ("none", True), "migrate": ("migrate", False), "check": ("check", False)}
+
+
+def start_once(url, mode):
+    schema_startup, create_all = MODES[mode]
+    env = {**os.environ, "CONFIG_TYPE": "config.ProductionConfig", "SQLALCHEMY_DATABASE_URI": url,
+           "SCHEMA_STARTUP": schema_startup}
+    output = subprocess.run([sys.executable, "-c", STARTUP.format(create_all=create_all)], env=env, cwd=ROOT,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+def run(url, mode, runs):
+    timings = sorted(start_once(url, mode) for _ in range(runs))
+    p90 = timings[min(len(timings) - 1, int(len(timings) * 0.9))]
+    print(f"{mode:<11} median {statistics.median(timings) * 1000:8.1f} ms  p90 {p90 * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, help="interpreters started per mode")
+    args = parser.parse_args()
+
+    print(f"{args.runs} cold starts per mode")
+    with tempfile.TemporaryDirectory() as directory:
+        url = f"sqlite:///{os.path.join(directory, 'startup.db')}"
+        engine = create_engine(url, execution_options=archive_execution_options(CONFIG))
+        with engine.begin() as connection:
+            create_schema(connection)
+        engine.dispose()
+        for mode in MODES:
+            run(url, mode, args.runs)
+
+
+if __name__ == "__main__":
+    main()
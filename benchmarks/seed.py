@@ -0,0 +1,137 @@
+"""
+Synthetic data seeding of the benchmark database with bulk Core inserts.
+
+Rows are generated in chunks with explicit ids, so seeding millions of entries keeps a
+flat memory profile and issues one executemany INSERT per chunk and table.
+"""
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert, update, select
+from application.models import db, Plant, Configuration, User, DosageEntry, CalibrationSection, \
+    ChangeDoseSection, RawWaterEntry
+from application.calibration import compute_calibrations
+from application.rollups import rebuild_rollups
+from application.schema import create_schema
+
+# named volumes, any of them can be overridden from the command line
+Scales = {
+    "small": {"plants": 100, "users_per_plant": 5, "dosage_entries": 50000, "raw_water_entries": 50000},
+    "medium": {"plants": 1000, "users_per_plant": 5, "dosage_entries": 500000, "raw_water_entries": 500000},
+    "large": {"plants": 5000, "users_per_plant": 4, "dosage_entries": 2000000, "raw_water_entries": 2000000},
+}
+# share of the dosage entries with a calibration, and of those with a dose change
+CALIBRATED = 0.6
+CHANGED = 0.2
+# entries are spread over this many days before the seeding time
+HISTORY_DAYS = 365
+CHUNK_SIZE = 10000
+CONCENTRATION = 0.1
+
+
+def _chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _insert(connection, model_class, rows):
+    count = 0
+    for chunk in _chunks(rows):
+        connection.execute(insert(model_class), chunk)
+        count += len(chunk)
+    return count
+
+def _timestamps(rng, now):
+    while True:
+        yield now - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+
+def seed(volumes, seed=0):
+    """
+    Drop and recreate every table with a current schema stamp, then fill them with synthetic plants, users and entries.
+
+    Must run in an app context. Calibrations are derived like ingestion does and the
+    daily rollups are rebuilt at the end.
+
+    :param volumes: dictionary of plants, users_per_plant, dosage_entries and raw_water_entries
+    :param seed: seed of the random generator, the same seed produces the same data
+    :return: dictionary of table name to number of rows inserted
+    """
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    plants = volumes["plants"]
+    users = plants * volumes["users_per_plant"]
+    counts = {}
+
+    db.drop_all()
+    with db.engine.begin() as connection:
+        create_schema(connection)
+        counts["configurations"] = _insert(connection, Configuration, (
+            {"id": i, "chemical_type": "PAC" if i % 2 else "AL2SO43", "chemical_concentration": CONCENTRATION,
+             "num_filters": 1 + i % 6, "num_clarifiers": 1 + i % 4}
+            for i in range(1, plants + 1)))
+        counts["plants"] = _insert(connection, Plant, (
+            {"id": i, "name": f"plant-{i}", "phone_number": f"1{i:09d}", "config_id": i}
+            for i in range(1, plants + 1)))
+        counts["users"] = _insert(connection, User, (
+            {"id": i, "name": f"operator {i}", "email": f"operator{i}@bench.aguadatos.org",
+             "phone_number": f"2{i:09d}", "plant_id": 1 + (i - 1) % plants}
+            for i in range(1, users + 1)))
+
+        def dosage_rows():
+            timestamps = _timestamps(rng, now)
+            for i in range(1, volumes["dosage_entries"] + 1):
+                yield {"id": i, "created_at": next(timestamps), "is_deleted": False,
+                       "user_id": rng.randrange(1, users + 1), "calibration_id": None, "change_dose_id": None}
+        counts["dosage_entries"] = _insert(connection, DosageEntry, dosage_rows())
+
+        calibrated = [i for i in range(1, volumes["dosage_entries"] + 1) if rng.random() < CALIBRATED]
+        counts["calibrations"] = 0
+        for chunk in _chunks(calibrated):
+            inputs = {
+                "slider_position": [rng.uniform(0.05, 1.0) for _ in chunk],
+                "inflow_rate": [rng.randrange(1, 20) for _ in chunk],
+                "starting_volume": [rng.randrange(5000, 10000) for _ in chunk],
+                "ending_volume": [rng.randrange(1000, 5000) for _ in chunk],
+                "elapsed_seconds": [rng.randrange(30, 600) for _ in chunk]}
+            flow_rates, doses, ratios = compute_calibrations(**inputs, chemical_concentration=CONCENTRATION)
+            connection.execute(insert(CalibrationSection), [
+                {"id": entry_id, "dosage_entry_id": entry_id,
+                 **{field: values[i] for field, values in inputs.items()},
+                 "calculated_flow_rate": flow_rates[i], "calculated_chemical_dose": doses[i],
+                 "slider_pos_chem_dose_ratio": ratios[i]}
+                for i, entry_id in enumerate(chunk)])
+            counts["calibrations"] += len(chunk)
+
+        counts["change_doses"] = _insert(connection, ChangeDoseSection, (
+            {"id": entry_id, "dosage_entry_id": entry_id, "related_calibration_id": entry_id,
+             "target_coagulant_dose": rng.uniform(1, 30), "new_slider_position": rng.uniform(0.05, 1.0)}
+            for entry_id in calibrated if rng.random() < CHANGED))
+
+        # link the dosage entries to their sections with two set-based updates
+        dosage = DosageEntry.__table__
+        connection.execute(update(dosage).values(calibration_id=(
+            select(CalibrationSection.id).where(CalibrationSection.dosage_entry_id == dosage.c.id).scalar_subquery())))
+        connection.execute(update(dosage).values(change_dose_id=(
+            select(ChangeDoseSection.id).where(ChangeDoseSection.dosage_entry_id == dosage.c.id).scalar_subquery())))
+
+        def raw_water_rows():
+            timestamps = _timestamps(rng, now)
+            for i in range(1, volumes["raw_water_entries"] + 1):
+                yield {"id": i, "created_at": next(timestamps), "user_id": rng.randrange(1, users + 1),
+                       "utn": rng.randrange(1, 300), "turbidity_method": "turbidimeter"}
+        counts["raw_water_entries"] = _insert(connection, RawWaterEntry, raw_water_rows())
+
+        if connection.dialect.name == "postgresql":
+            # explicit ids do not advance the id sequences
+            for model_class in (Configuration, Plant, User, DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry):
+                table = model_class.__tablename__
+                connection.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))")
+
+    counts["plant_daily_rollups"] = rebuild_rollups(db.session)
+    db.session.commit()
+    return counts
@@ -0,0 +1,300 @@
+"""
+Route benchmark suite of the API over a seeded database.
+
+  python3 -m benchmarks run [--scale small|medium|large] [--plants N] [--users-per-plant N]
+                            [--dosage-entries N] [--raw-water-entries N] [--requests N]
+                            [--only NAME ...] [--skip-seed] [--output results.json]
+  python3 -m benchmarks compare BASELINE.json CURRENT.json [--threshold 0.10]
+
+`run` seeds the database of config.BenchmarkConfig (BENCHMARK_DATABASE_URI), then times
+every route through the Flask test client and reports throughput with p50/p99 latencies.
+`compare` prints the change of every route between two runs and exits with status 1 when
+a p50 or p99 latency regressed by more than the threshold.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import select
+from application.models import db, DosageEntry, User
+from .seed import Scales, seed
+
+WARMUP_REQUESTS = 5
+
+
+# -- SCENARIOS ------------------------------------------------------
+class Scenario:
+    """
+    A route exercised by the suite.
+
+    :param name: name of the scenario in the results
+    :param method: HTTP method
+    :param make_request: function of the request number returning (url, json body or None)
+    :param max_requests: cap on the timed requests, for expensive or destructive routes
+    """
+
+    def __init__(self, name, method, make_request, max_requests=None):
+        self.name = name
+        self.method = method
+        self.make_request = make_request
+        self.max_requests = max_requests
+
+
+def scenarios(volumes, rng, entry_plants):
+    """
+    Every scenario of the suite, reads first, then writes, then deletes so they do not skew the reads.
+    The seeding logs no change, so the sync scenario follows the writes it reads back.
+
+    :param volumes: seeded data volumes
+    :param rng: random generator of the requests
+    :param entry_plants: dictionary of the ids of the first dosage entries to their plant ids
+    """
+    plants = volumes["plants"]
+    users_per_plant = volumes["users_per_plant"]
+    users = plants * users_per_plant
+
+    def plant():
+        return rng.randrange(1, plants + 1)
+
+    def plant_users(plant_id):
+        # users are assigned to plants round robin by the seeding
+        return [plant_id + k * plants for k in range(users_per_plant)]
+
+    def calibration():
+        return {"slider_position": rng.uniform(0.05, 1.0), "inflow_rate": rng.randrange(1, 20),
+                "starting_volume": rng.randrange(5000, 10000), "ending_volume": rng.randrange(1000, 5000),
+                "elapsed_seconds": rng.randrange(30, 600)}
+
+    def entries_batch(i):
+        plant_id = plant()
+        user_ids = plant_users(plant_id)
+        entries = []
+        for n in range(50):
+            if n % 2:
+                entries.append({"type": "raw_water", "user_id": rng.choice(user_ids), "utn": rng.randrange(1, 300)})
+            else:
+                entries.append({"type": "dosage", "user_id": rng.choice(user_ids), "calibration": calibration()})
+        return f"/api/plants/{plant_id}/entries:batch", {"entries": entries}
+
+    # names and phone numbers of created rows stay unique across runs reusing the same data
+    run_token = int(time.time()) % 10 ** 6
+    phone_numbers = itertools.count(1)
+
+    def new_plant(tag):
+        return {"name": f"bench-{run_token}-{tag}", "phone_number": f"3{run_token:06d}{next(phone_numbers):08d}",
+                "chemical_type": "PAC", "chemical_concentration": 0.1, "num_filters": 2, "num_clarifiers": 2}
+
+    def new_user(tag):
+        return {"name": f"bench {tag}", "email": f"bench-{run_token}-{tag}@bench.aguadatos.org",
+                "phone_number": f"4{run_token:06d}{next(phone_numbers):08d}", "plant_name": f"plant-{plant()}"}
+
+    return [
+        Scenario("get_plant", "GET", lambda i: (f"/api/plants/{plant()}/", None)),
+        Scenario("list_plants", "GET", lambda i: (f"/api/plants/?limit=100&after_id={rng.randrange(plants)}", None)),
+        Scenario("stream_plants", "GET", lambda i: ("/api/plants/?stream=1", None), max_requests=20),
+        Scenario("get_user", "GET", lambda i: (f"/api/users/{rng.randrange(1, users + 1)}/", None)),
+        Scenario("list_users", "GET", lambda i: (f"/api/users/?limit=100&after_id={rng.randrange(users)}", None)),
+        Scenario("trends_dose_day", "GET",
+                 lambda i: (f"/api/plants/{plant()}/trends/?metric=chemical_dose&bucket=day", None)),
+        Scenario("trends_utn_week", "GET", lambda i: (f"/api/plants/{plant()}/trends/?metric=utn&bucket=week", None)),
+        Scenario("rollups", "GET", lambda i: (f"/api/plants/{plant()}/rollups/", None)),
+        Scenario("recommendation", "GET", lambda i: (f"/api/plants/{plant()}/recommendation/?target_dose=5", None)),
+        Scenario("alerts", "GET", lambda i: (f"/api/plants/{plant()}/alerts/", None)),
+        Scenario("export_dosage_csv", "GET", lambda i: (f"/api/plants/{plant()}/export/?format=csv", None),
+                 max_requests=50),
+        Scenario("metrics", "GET", lambda i: ("/api/metrics", None)),
+        Scenario("create_plant", "POST", lambda i: ("/api/plants/", new_plant(f"p{i}"))),
+        Scenario("create_plants_batch", "POST",
+                 lambda i: ("/api/plants:batch", {"plants": [new_plant(f"b{i}-{n}") for n in range(50)]})),
+        Scenario("create_user", "POST", lambda i: ("/api/users/", new_user(f"u{i}"))),
+        Scenario("create_users_batch", "POST",
+                 lambda i: ("/api/users:batch", {"users": [new_user(f"b{i}-{n}") for n in range(50)]})),
+        Scenario("sync_entries_batch", "POST", entries_batch),
+        Scenario("update_configuration", "PUT",
+                 lambda i: (f"/api/plants/{plant()}/configuration/", {"chemical_concentration": rng.uniform(0.05, 0.5)}),
+                 max_requests=50),
+        Scenario("sync_plant", "GET", lambda i: (f"/api/sync?plant_id={plant()}&since=0", None)),
+        Scenario("delete_dosage_entry", "DELETE",
+                 lambda i: (f"/api/plants/{entry_plants.get(i + 1, 1)}/dosage_entries/{i + 1}/", None)),
+        Scenario("delete_user", "DELETE", lambda i: (f"/api/users/{users - i}/", None)),
+        Scenario("delete_plant", "DELETE", lambda i: (f"/api/plants/{plants - i}/", None), max_requests=20),
+    ]
+
+
+# -- RUN ------------------------------------------------------
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def measure(client, scenario, requests):
+    """
+    Time the requests of a scenario after a few untimed warmup requests.
+
+    :return: dictionary of the scenario's results
+    """
+    count = min(requests, scenario.max_requests or requests)
+    send = getattr(client, scenario.method.lower())
+    # warmup requests use their own numbers so destructive scenarios do not hit the same rows twice
+    for i in range(count, count + WARMUP_REQUESTS):
+        url, body = scenario.make_request(i)
+        send(url, json=body)
+
+    latencies = []
+    errors = 0
+    for i in range(count):
+        url, body = scenario.make_request(i)
+        started = time.perf_counter()
+        response = send(url, json=body)
+        response.get_data()
+        latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors += 1
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput_rps": count / total if total else None,
+        "mean_ms": total / count * 1000,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+def dosage_entry_plants(count):
+    """
+    Plants of the first dosage entries, which the seeding assigns to random users.
+
+    Must run in an app context.
+
+    :param count: number of entries, from id 1
+    :return: dictionary of dosage entry id to plant id
+    """
+    return dict(db.session.execute(
+        select(DosageEntry.id, User.plant_id).join(User, User.id == DosageEntry.user_id).where(DosageEntry.id <= count)).all())
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    os.environ.setdefault("CONFIG_TYPE", "config.BenchmarkConfig")
+    from application import create_app
+    app = create_app()
+
+    volumes = dict(Scales[args.scale])
+    for key in volumes:
+        if getattr(args, key) is not None:
+            volumes[key] = getattr(args, key)
+
+    if not args.skip_seed:
+        started = time.perf_counter()
+        with app.app_context():
+            counts = seed(volumes, args.seed)
+        print(f"Seeded {', '.join(f'{n} {table}' for table, n in counts.items())} "
+              f"in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+    with app.app_context():
+        entry_plants = dosage_entry_plants(args.requests + WARMUP_REQUESTS)
+    rng = random.Random(args.seed)
+    client = app.test_client()
+    results = {}
+    for scenario in scenarios(volumes, rng, entry_plants):
+        if args.only and scenario.name not in args.only:
+            continue
+        results[scenario.name] = result = measure(client, scenario, args.requests)
+        print(f"{scenario.name:<22} {result['throughput_rps']:9.1f} req/s  p50 {result['p50_ms']:8.2f} ms  "
+              f"p99 {result['p99_ms']:8.2f} ms  ({result['errors']} errors)", file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "database": app.config["SQLALCHEMY_DATABASE_URI"].split(":", 1)[0],
+            "engine_profile": app.config["ENGINE_PROFILE"],
+            "volumes": volumes,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+
+# -- COMPARE ------------------------------------------------------
+def compare(args):
+    """
+    Print the latency change of every route between two reports.
+
+    :return: exit status, 1 if a route regressed beyond the threshold
+    """
+    with open(args.baseline) as baseline_file, open(args.current) as current_file:
+        baseline = json.load(baseline_file)
+        current = json.load(current_file)
+    if baseline["meta"]["volumes"] != current["meta"]["volumes"]:
+        print("warning: the runs were seeded with different volumes", file=sys.stderr)
+
+    regressions = []
+    print(f"{'route':<22} {'p50 ms':>19} {'change':>8} {'p99 ms':>19} {'change':>8}")
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<22} (new)")
+            continue
+        columns = []
+        for metric in ("p50_ms", "p99_ms"):
+            change = result[metric] / before[metric] - 1 if before[metric] else 0.0
+            columns.append(f"{before[metric]:8.2f} -> {result[metric]:8.2f} {change:+8.1%}")
+            if change > args.threshold:
+                regressions.append(f"{name} {metric}")
+        print(f"{name:<22} {'  '.join(columns)}")
+
+    if regressions:
+        print(f"Regressed beyond {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed the database and time every route")
+    run_parser.add_argument("--scale", choices=sorted(Scales), default="small", help="named data volumes")
+    run_parser.add_argument("--plants", type=int)
+    run_parser.add_argument("--users-per-plant", type=int)
+    run_parser.add_argument("--dosage-entries", type=int)
+    run_parser.add_argument("--raw-water-entries", type=int)
+    run_parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    run_parser.add_argument("--only", nargs="+", help="only run these scenarios")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed of the data and request generators")
+    run_parser.add_argument("--skip-seed", action="store_true", help="reuse the data left by a previous run, rows it deleted stay deleted")
+    run_parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="tolerated latency increase")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args)
+        return 0
+    return compare(args)
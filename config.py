@@ -1,13 +1,12 @@
 """Flask configuration variables."""
 import os  
-from dotenv import load_dotenv
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-load_dotenv(os.path.join(basedir, '.env'))
-
-#create 'instance' folder in the root directory if not existent
-if not os.path.exists(os.path.join(basedir, 'instance')):
-    os.makedirs(os.path.join(basedir, 'instance'))
+# python-dotenv is only imported when there is a .env file to load
+if os.path.exists(os.path.join(basedir, '.env')):
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(basedir, '.env'))
+# the 'instance' folder holding the SQLite databases is created by the "migrate" schema startup
 
 class Config:
     """Set Flask configuration from .env file."""
@@ -24,8 +23,98 @@ class Config:
     SQLALCHEMY_ECHO = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Schema at startup: "migrate" applies pending migrations, "check" only verifies the
+    # version stamp and fails fast, "none" skips both (see application/schema.py)
+    SCHEMA_STARTUP = os.environ.get("SCHEMA_STARTUP", "migrate")
+
+    # Per-plant sharding: 0 keeps every table in SQLALCHEMY_DATABASE_URI, otherwise the entries of
+    # plant p live in shard p % SHARD_COUNT, a SQLite database named by SHARD_DATABASE_URI (see application/sharding.py)
+    SHARD_COUNT = int(os.environ.get("SHARD_COUNT", 0))
+    SHARD_DATABASE_URI = os.environ.get("SHARD_DATABASE_URI",
+                                        default=f"sqlite:///{os.path.join(basedir, 'instance', 'shard_{shard}.db')}")
+
+    # Database engine profile: "default", "sqlite" or "postgres" (see application/engine.py)
+    ENGINE_PROFILE = "default"
+    # sqlite profile pragmas (cache_size is negative KiB, mmap_size bytes, busy_timeout milliseconds)
+    SQLITE_SYNCHRONOUS = "NORMAL"
+    SQLITE_BUSY_TIMEOUT = 5000
+    SQLITE_CACHE_SIZE = -64000
+    SQLITE_MMAP_SIZE = 268435456
+    # postgres profile pool (timeouts in seconds, statement timeout in milliseconds)
+    POSTGRES_POOL_SIZE = 10
+    POSTGRES_MAX_OVERFLOW = 20
+    POSTGRES_POOL_TIMEOUT = 30
+    POSTGRES_POOL_RECYCLE = 1800
+    POSTGRES_STATEMENT_TIMEOUT = 30000
+
+    # List endpoints
+    DEFAULT_PAGE_LIMIT = 100
+    MAX_PAGE_LIMIT = 1000
+    STREAM_CHUNK_SIZE = 500
+    # change log entries consumed by one /api/sync page
+    SYNC_PAGE_LIMIT = 1000
+    # encode responses with orjson when installed
+    FAST_JSON = False
+
+    # Plant and Configuration read-through cache (entries, seconds)
+    PLANT_CACHE_SIZE = 1024
+    PLANT_CACHE_TTL = 300
+    # per-plant dose models are updated in place, the TTL bounds how long a drifted model lives (seconds)
+    DOSE_MODEL_TTL = 3600
+    # raw turbidity spike alerts: a reading TURBIDITY_ALERT_Z standard deviations above the mean of the plant's
+    # last TURBIDITY_WINDOW readings, once TURBIDITY_MIN_READINGS were seen (see application/turbidity.py)
+    TURBIDITY_WINDOW = 96
+    TURBIDITY_MIN_READINGS = 12
+    TURBIDITY_ALERT_Z = 3.0
+    TURBIDITY_EWMA_ALPHA = 0.1
+    TURBIDITY_ALERTS_KEPT = 100
+
+    # request latency, SQL and serialization metrics served at /api/metrics
+    METRICS = True
+    # log requests slower than this many milliseconds with their SQL, None to disable
+    SLOW_REQUEST_MS = None
+
+    # Entry ingestion
+    MAX_BATCH_ENTRIES = 1000
+    # what happens to the entries of a deleted plant's users: "hard" or "soft" delete
+    PLANT_DELETE_ENTRIES = "hard"
+    # calibrations rewritten per transaction when a plant's chemical concentration changes
+    CALIBRATION_CHUNK_SIZE = 1000
+    # entries older than this many days are moved to the archive tables, None keeps every entry hot
+    ARCHIVE_AFTER_DAYS = None
+    # soft-deleted dosage entries are purged this many days after their deletion
+    PURGE_DELETED_AFTER_DAYS = 30
+    ARCHIVE_CHUNK_SIZE = 1000
+    # SQLite file holding the archive tables, None keeps them in the main database
+    ARCHIVE_DATABASE = os.environ.get("ARCHIVE_DATABASE")
+    # responses of POSTs sent with an Idempotency-Key header, replayed to retries until they expire (seconds)
+    IDEMPOTENCY = True
+    IDEMPOTENCY_TTL = 86400
+    IDEMPOTENCY_CACHE_SIZE = 10000
+    # seconds between two deletions of the expired keys
+    IDEMPOTENCY_EVICT_INTERVAL = 300
+    # queue synced entries and write them from a background thread, coalescing commits
+    WRITE_BEHIND = False
+    WRITE_BEHIND_MAX_QUEUE = 10000
+    WRITE_BEHIND_FLUSH_MS = 50
+    WRITE_BEHIND_FLUSH_ITEMS = 500
+
 class ProductionConfig(Config):
     SQLALCHEMY_ECHO = False
+    FAST_JSON = True
+    ENGINE_PROFILE = "sqlite"
+    # migrations are run explicitly with "SCHEMA_STARTUP=none flask schema upgrade"
+    SCHEMA_STARTUP = os.environ.get("SCHEMA_STARTUP", "check")
+
+class PostgresProductionConfig(ProductionConfig):
+    ENGINE_PROFILE = "postgres"
+
+class BenchmarkConfig(ProductionConfig):
+    """Production settings over a dedicated database seeded by the benchmark suite."""
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCHMARK_DATABASE_URI',
+                                             default=f"sqlite:///{os.path.join(basedir, 'instance', 'benchmark.db')}")
+    # the suite creates and stamps the schema when seeding
+    SCHEMA_STARTUP = os.environ.get("SCHEMA_STARTUP", "migrate")
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -4,9 +4,15 @@ This module contains fixtures that are used by the test modules in the test dire
 Utilize "python3 -m pytest -vclear -s --setup-show" to initialize the test environment and run the tests.
 """
 import os
+import re
+from contextlib import contextmanager
 import pytest
+from sqlalchemy import event
 from application import create_app, db
 from application.models import User, Plant, Configuration
+from application.cache import plant_cache
+from application.dose_model import dose_models
+from application.turbidity import turbidity_monitor
 
 
 # generalized status code and content type assert
@@ -25,6 +31,78 @@ def validate_response():
     return _validate
 
 
+# generalized SQL query budget assert
+class QueryRecorder:
+    """
+    Records the SQL statements a block of code sends to the database.
+
+    Hooks the engine's `before_cursor_execute` event while active and, on SQLite,
+    explains every recorded SELECT, UPDATE and DELETE afterwards.
+    """
+    # full table scans are reported by SQLite as "SCAN <table>" without an index
+    FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.plans = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append((statement, parameters, executemany))
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+        if self.engine.dialect.name == "sqlite":
+            self._explain()
+
+    def _explain(self):
+        with self.engine.connect() as conn:
+            for statement, parameters, executemany in self.statements:
+                if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "WITH")):
+                    continue
+                if executemany:
+                    parameters = parameters[0]
+                details = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+                self.plans.append((statement, details))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def table_scans(self):
+        """
+        Tables read with a full scan, with the statement that scanned them.
+        """
+        return [
+            (match.group(1), statement)
+            for statement, details in self.plans
+            for match in map(self.FULL_SCAN.match, details) if match]
+
+
+@pytest.fixture(scope='module')
+def query_budget(test_client):
+    @contextmanager
+    def _budget(max_queries, allow_scans=()):
+        """
+        Asserts the SQL sent by the enclosed block stays within a query budget and
+        never scans a whole table, except the tables in `allow_scans`.
+
+        :param max_queries: The maximum number of statements, catches N+1 patterns.
+        :param allow_scans: Tables a full scan is expected on (e.g. the first page of a list).
+        """
+        with QueryRecorder(db.engine) as recorder:
+            yield recorder
+        assert recorder.count <= max_queries, \
+            f"Expected at most {max_queries} queries, but got {recorder.count}:\n" + "\n".join(s for s, _, _ in recorder.statements)
+        scans = [(table, statement) for table, statement in recorder.table_scans() if table not in allow_scans]
+        assert not scans, "Unexpected full table scans:\n" + "\n".join(f"{t}: {s}" for t, s in scans)
+    return _budget
+
+
 @pytest.fixture(scope='session')
 def test_client():
     # Set the Testing configuration prior to creating the Flask application
@@ -70,6 +148,12 @@ def init_database(test_client):
 
     db.session.remove()
     db.drop_all()
+    plant_cache.clear()
+    dose_models.clear()
+    turbidity_monitor.clear()
+    idempotency = test_client.application.extensions.get("idempotency")
+    if idempotency is not None:
+        idempotency.cache.clear()
 
 
 
@@ -0,0 +1,144 @@
+from datetime import datetime
+import pytest
+from flask import current_app
+from sqlalchemy import create_engine, select
+from application import db
+from application.archive import archive_cutoff, archive_entries, purge_deleted_entries
+from application.engine import engine_options, attach_archive
+from application.models import DosageEntry, CalibrationSection, RawWaterEntry, ArchiveModels
+from application.rollups import check_rollups
+from utils_test import mismatch_error, calibration_for
+
+NOW = datetime(2024, 6, 1, 12, 0)
+
+@pytest.fixture(scope='module')
+def history(test_client, init_database):
+    """
+    Sync old and recent entries for plant 1, soft delete an old one and archive everything before May.
+    """
+    entries = [
+        {"type": "dosage", "user_id": 1, "created_at": "2024-03-01T08:00:00", "calibration": calibration_for(2.0),
+         "change_dose": {"target_coagulant_dose": 5.0, "new_slider_position": 0.6}},
+        {"type": "dosage", "user_id": 1, "created_at": "2024-03-02T08:00:00", "calibration": calibration_for(4.0)},
+        {"type": "dosage", "user_id": 1, "created_at": "2024-03-03T08:00:00"},
+        {"type": "dosage", "user_id": 1, "created_at": "2024-05-20T08:00:00", "calibration": calibration_for(6.0)},
+        {"type": "raw_water", "user_id": 1, "created_at": "2024-03-01T09:00:00", "utn": 10},
+        {"type": "raw_water", "user_id": 1, "created_at": "2024-05-20T09:00:00", "utn": 20},
+    ]
+    results = test_client.post('/api/plants/1/entries:batch', json={"entries": entries}).get_json()['results']
+    assert test_client.delete(f"/api/plants/1/dosage_entries/{results[2]['id']}/").status_code == 200
+    trends = test_client.get('/api/plants/1/trends/?metric=chemical_dose&bucket=week').get_json()['points']
+    counts = archive_entries(db.session, archive_cutoff(30, NOW), chunk_size=1)
+    return results, trends, counts
+
+
+def test_archive_cutoff():
+    """
+    GIVEN an archive horizon
+    WHEN its cutoff is computed
+    THEN it falls on the midnight that many days before now
+    """
+    assert archive_cutoff(30, NOW) == datetime(2024, 5, 2)
+
+# ------------------------------------------------------------------------------------------
+
+def test_archive_moves_old_entries(test_client, history):
+    """
+    GIVEN old and recent entries, one of the old ones soft deleted
+    WHEN the entries older than the horizon are archived in chunks
+    THEN the old ones move to the archive with their sections and the deleted one stays to be purged
+    """
+    results, _, counts = history
+    assert counts == {"dosage_entries": 2, "raw_water_entries": 1}, mismatch_error("Archived counts", 2, counts)
+
+    hot_ids = set(db.session.scalars(select(DosageEntry.id)))
+    assert hot_ids == {results[2]['id'], results[3]['id']}
+    archived = db.session.get(ArchiveModels[DosageEntry], results[0]['id'])
+    assert archived.calibration_id == results[0]['calibration_id'] and archived.archived_at is not None
+    assert db.session.get(ArchiveModels[CalibrationSection], results[0]['calibration_id']).calculated_chemical_dose \
+        == pytest.approx(2.0)
+    assert db.session.get(RawWaterEntry, results[4]['id']) is None
+    assert check_rollups(db.session) == []
+
+# ------------------------------------------------------------------------------------------
+
+def test_sync_across_archive(test_client, history):
+    """
+    GIVEN entries logged by the sync before they were archived
+    WHEN a client syncs the plant from scratch after the archive run
+    THEN the archived entries and their sections are listed as archived, not as deleted
+    """
+    results, _, _ = history
+    changes = test_client.get('/api/sync', query_string={"since": 0, "plant_id": 1}).get_json()['changes']
+    dosage = changes['dosage_entries']
+    assert dosage['archived'] == [results[0]['id'], results[1]['id']], \
+        mismatch_error("Archived dosage entries", [results[0]['id'], results[1]['id']], dosage['archived'])
+    assert dosage['deleted'] == [results[2]['id']]
+    assert [entry['id'] for entry in dosage['upserted']] == [results[3]['id']]
+    assert changes['calibrations']['archived'] == [results[0]['calibration_id'], results[1]['calibration_id']]
+    assert changes['calibrations']['deleted'] == []
+    assert changes['raw_water_entries']['archived'] == [results[4]['id']]
+    assert changes['raw_water_entries']['deleted'] == []
+
+# ------------------------------------------------------------------------------------------
+
+def test_reads_union_archive(test_client, history):
+    """
+    GIVEN archived entries
+    WHEN trends and exports are requested over ranges before and after the archive
+    THEN the archived entries are returned only for ranges reaching back into the archive
+    """
+    _, trends, _ = history
+    response = test_client.get('/api/plants/1/trends/?metric=chemical_dose&bucket=week')
+    assert response.get_json()['points'] == trends
+
+    rows = test_client.get('/api/plants/1/export/?format=ndjson&start=2024-03-01').get_data(as_text=True).splitlines()
+    assert len(rows) == 3
+    rows = test_client.get('/api/plants/1/export/?format=ndjson&kind=raw_water&start=2024-05-01').get_data(as_text=True)
+    assert rows.count("\n") == 1
+
+# ------------------------------------------------------------------------------------------
+
+def test_purge_deleted_entries(test_client, history):
+    """
+    GIVEN a soft-deleted dosage entry
+    WHEN soft-deleted entries are purged
+    THEN it is removed from the hot table
+    """
+    results, _, _ = history
+    assert purge_deleted_entries(db.session, datetime(2024, 1, 1)) == 0
+    assert purge_deleted_entries(db.session, datetime(2100, 1, 1)) == 1
+    assert db.session.get(DosageEntry, results[2]['id']) is None
+
+# ------------------------------------------------------------------------------------------
+
+def test_archive_command(test_client, history):
+    """
+    GIVEN the archive command
+    WHEN it runs with a horizon
+    THEN the recent entries are archived too
+    """
+    result = current_app.test_cli_runner().invoke(args=["archive", "run", "--days", "0"])
+    assert result.exit_code == 0, result.output
+    assert "Archived 1 dosage and 1 raw water entries." in result.output
+    assert db.session.scalar(select(DosageEntry.id)) is None
+
+# ------------------------------------------------------------------------------------------
+
+def test_archive_database_file(test_client, tmp_path):
+    """
+    GIVEN an ARCHIVE_DATABASE file
+    WHEN an engine is created with its options
+    THEN the archive tables live in the attached file
+    """
+    config = {**current_app.config, "ARCHIVE_DATABASE": str(tmp_path / "archive.db"),
+              "SQLALCHEMY_ENGINE_OPTIONS": {}}
+    engine = create_engine(f"sqlite:///{tmp_path / 'main.db'}", **engine_options(config))
+    attach_archive(engine, config["ARCHIVE_DATABASE"])
+    db.metadata.create_all(engine)
+    with engine.connect() as connection:
+        tables = {row[0] for row in connection.exec_driver_sql("SELECT name FROM archive.sqlite_master WHERE type = 'table'")}
+        main_tables = {row[0] for row in connection.exec_driver_sql("SELECT name FROM main.sqlite_master WHERE type = 'table'")}
+    engine.dispose()
+    assert "archived_dosage_entries" in tables
+    assert "archived_dosage_entries" not in main_tables and "dosage_entries" in main_tables
@@ -0,0 +1,127 @@
+import pytest
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from application.models import db, Plant, Configuration, CalibrationSection, PlantDailyRollup
+from application.cache import plant_by_id
+from application.calibration import compute_calibrations, recompute_plant_calibrations
+from application.rollups import check_rollups
+from utils_test import mismatch_error, calibration_for, dosage_entry
+
+
+def test_compute_calibrations():
+    """
+    GIVEN the measured columns of a batch of calibrations
+    WHEN the calculated values are computed
+    THEN flow rate, chemical dose and slider ratio are derived for every row, without dividing by a zero dose
+    """
+    flow_rates, doses, ratios = compute_calibrations(
+        [0.5, 0.8], [10, 2], [1000, 500], [900, 500], [60, 30], 0.1)
+    assert flow_rates == pytest.approx([100 / 60, 0.0])
+    assert doses == pytest.approx([100 / 60 * 0.1 / 10, 0.0])
+    assert ratios == pytest.approx([0.5 / (100 / 60 * 0.1 / 10), 0.0])
+
+# ------------------------------------------------------------------------------------------
+
+def test_calibration_rejects_non_positive_rates(test_client, init_database):
+    """
+    GIVEN a calibration with a zero elapsed time
+    WHEN it is synced
+    THEN the entry is reported as invalid
+    """
+    entry = {"type": "dosage", "user_id": 1, "calibration": {**calibration_for(1.0), "elapsed_seconds": 0}}
+    response = test_client.post('/api/plants/1/entries:batch', json={"entries": [entry]})
+    assert response.status_code == 400
+    assert response.get_json()['results'][0]['errors'] == ["calibration.elapsed_seconds must be positive"]
+
+# ------------------------------------------------------------------------------------------
+
+def test_update_configuration_recomputes(test_client, init_database, validate_response):
+    """
+    GIVEN calibrations synced for a plant with a 0.1 chemical concentration
+    WHEN the concentration is doubled
+    THEN every calibration and the daily rollups are recomputed with the new concentration
+    """
+    batch = {"entries": [dosage_entry("2024-04-01T08:00:00", 2.0), dosage_entry("2024-04-01T09:00:00", 3.0)]}
+    assert test_client.post('/api/plants/1/entries:batch', json=batch).status_code == 201
+
+    response = test_client.put('/api/plants/1/configuration/', json={"chemical_concentration": 0.2, "num_filters": 4})
+    validate_response(response, 200, "application/json")
+    data = response.get_json()
+    assert data['chemical_concentration'] == 0.2
+    assert data['num_filters'] == 4
+    assert data['recalculated'] == 2, mismatch_error("Recalculated", 2, data['recalculated'])
+
+    doses = sorted(c.calculated_chemical_dose for c in CalibrationSection.query)
+    assert doses == pytest.approx([4.0, 6.0])
+    day = PlantDailyRollup.query.filter_by(plant_id=1).one()
+    assert day.dose_sum == pytest.approx(10.0)
+    assert check_rollups(db.session, 1) == []
+
+    # new entries use the new concentration as well
+    assert test_client.post('/api/plants/1/entries:batch', json={"entries": [dosage_entry("2024-04-01T10:00:00", 1.0)]}).status_code == 201
+    latest = CalibrationSection.query.order_by(CalibrationSection.id.desc()).first()
+    assert latest.calculated_chemical_dose == pytest.approx(2.0)
+
+# ------------------------------------------------------------------------------------------
+
+def test_update_configuration_recompute_fails(test_client, init_database, monkeypatch):
+    """
+    GIVEN calibrations synced for a plant
+    WHEN the rollup rebuild fails while a new concentration is applied
+    THEN the configuration, the calibrations and the rollups are all left as they were
+    """
+    before = sorted(c.calculated_chemical_dose for c in CalibrationSection.query)
+    concentration = plant_by_id(1)["configuration"]["chemical_concentration"]
+    def fail(*args):
+        raise OperationalError("INSERT INTO plant_daily_rollups", {}, Exception("database is locked"))
+    monkeypatch.setattr("application.routes.rebuild_rollups", fail)
+
+    response = test_client.put('/api/plants/1/configuration/', json={"chemical_concentration": concentration * 2})
+    assert response.status_code == 500, mismatch_error("Expected code status", 500, response.status_code)
+    db.session.expire_all()
+    assert db.session.get(Configuration, db.session.get(Plant, 1).config_id).chemical_concentration == concentration
+    assert plant_by_id(1)["configuration"]["chemical_concentration"] == concentration
+    assert before and sorted(c.calculated_chemical_dose for c in CalibrationSection.query) == before
+    assert check_rollups(db.session, 1) == []
+
+# ------------------------------------------------------------------------------------------
+
+def test_update_configuration_invalid(test_client, init_database):
+    """
+    GIVEN invalid configuration values or an unknown plant
+    WHEN the configuration is updated
+    THEN the update is rejected
+    """
+    assert test_client.put('/api/plants/1/configuration/', json={"chemical_concentration": 0}).status_code == 400
+    assert test_client.put('/api/plants/1/configuration/', json={"chemical_type": "Salt"}).status_code == 400
+    assert test_client.put('/api/plants/99/configuration/', json={"num_filters": 2}).status_code == 404
+
+# ------------------------------------------------------------------------------------------
+
+def test_recompute_in_chunks(test_client, init_database):
+    """
+    GIVEN the calibrations of a plant
+    WHEN they are recomputed with a chunk smaller than their count
+    THEN every calibration is rewritten
+    """
+    count = CalibrationSection.query.count()
+    assert recompute_plant_calibrations(db.session, 1, 0.1, chunk_size=2) == count
+    doses = sorted(c.calculated_chemical_dose for c in CalibrationSection.query)
+    assert doses == pytest.approx([1.0, 2.0, 3.0])
+
+# ------------------------------------------------------------------------------------------
+
+def test_calibration_ignores_stale_cache(test_client, init_database):
+    """
+    GIVEN a cached plant whose concentration was changed by another process
+    WHEN a calibration is synced
+    THEN it is derived from the concentration in the database
+    """
+    cached = plant_by_id(1)["configuration"]["chemical_concentration"]
+    db.session.execute(update(Configuration).where(Configuration.id == 1).values(chemical_concentration=0.3))
+    db.session.commit()
+    assert plant_by_id(1)["configuration"]["chemical_concentration"] == cached != 0.3
+
+    assert test_client.post('/api/plants/1/entries:batch', json={"entries": [dosage_entry("2024-04-02T08:00:00", 1.0)]}).status_code == 201
+    latest = CalibrationSection.query.order_by(CalibrationSection.id.desc()).first()
+    assert latest.calculated_chemical_dose == pytest.approx(3.0), mismatch_error("Dose", 3.0, latest.calculated_chemical_dose)
@@ -0,0 +1,78 @@
+from application.models import db, Plant, IdempotencyKey
+from application.versions import bump_versions, table_versions
+from utils_test import mismatch_error
+
+
+def test_get_plant_not_modified(test_client, init_database, validate_response):
+    """
+    GIVEN a plant fetched once with its ETag
+    WHEN the plant is requested again with If-None-Match
+    THEN return a 304 without a body
+    """
+    response = test_client.get('/api/plants/1/')
+    validate_response(response, 200, "application/json")
+    etag = response.headers['ETag']
+
+    response = test_client.get('/api/plants/1/', headers={'If-None-Match': etag})
+    assert response.status_code == 304, mismatch_error("Expected code status", 304, response.status_code)
+    assert response.data == b''
+
+    # another representation of the same table gets its own ETag
+    other = test_client.get('/api/plants/2/')
+    assert other.headers['ETag'] != etag
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_plant_invalidates_etag(test_client, init_database, validate_response):
+    """
+    GIVEN the plant list fetched with its ETag
+    WHEN a plant is created
+    THEN the stale ETag no longer matches and the new list is returned
+    """
+    etag = test_client.get('/api/plants/').headers['ETag']
+    new_plant = {"name": "AguaClara5", "phone_number": "555-555-5555", "chemical_type": "PAC",
+                 "chemical_concentration": 0.5, "num_filters": 5, "num_clarifiers": 5}
+    assert test_client.post('/api/plants/', json=new_plant).status_code == 201
+
+    response = test_client.get('/api/plants/', headers={'If-None-Match': etag})
+    validate_response(response, 200, "application/json")
+    assert response.headers['ETag'] != etag
+    assert len(response.get_json()['plants']) == 4
+
+# ------------------------------------------------------------------------------------------
+
+def test_user_writes_invalidate_etag(test_client, init_database, validate_response):
+    """
+    GIVEN a user fetched with its ETag
+    WHEN users are created and deleted
+    THEN each write changes the user's ETag
+    """
+    first = test_client.get('/api/users/1/').headers['ETag']
+    new_user = {"name": "Ana", "email": "ana@email.com", "phone_number": "222-333-444", "plant_name": "AguaClara"}
+    created = test_client.post('/api/users/', json=new_user).get_json()
+
+    second = test_client.get('/api/users/1/', headers={'If-None-Match': first})
+    validate_response(second, 200, "application/json")
+    assert second.headers['ETag'] != first
+
+    assert test_client.delete(f"/api/users/{created['id']}/").status_code == 200
+    third = test_client.get('/api/users/1/', headers={'If-None-Match': second.headers['ETag']})
+    assert third.status_code == 200, mismatch_error("Expected code status", 200, third.status_code)
+
+# ------------------------------------------------------------------------------------------
+
+def test_bump_versions_single_upsert(test_client, init_database, query_budget):
+    """
+    GIVEN a table with a version counter and a table never written
+    WHEN both are bumped together
+    THEN one statement increments the existing counter and creates the missing one
+    """
+    before = table_versions(Plant, IdempotencyKey)
+    with query_budget(max_queries=1):
+        bump_versions(db.session, Plant, IdempotencyKey)
+    db.session.commit()
+    after = table_versions(Plant, IdempotencyKey)
+    expected = {name: version + 1 for name, version in before.items()}
+    assert after == expected, mismatch_error("Table versions", expected, after)
+
+# ------------------------------------------------------------------------------------------
@@ -0,0 +1,89 @@
+import pytest
+from application.models import DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry
+from utils_test import mismatch_error
+
+calibration = {
+    "slider_position": 0.5,
+    "inflow_rate": 10,
+    "starting_volume": 1000,
+    "ending_volume": 900,
+    "elapsed_seconds": 60
+}
+change_dose = {"target_coagulant_dose": 5.0, "new_slider_position": 0.6}
+
+# unit test for syncing a batch of entries
+def test_create_entries_batch(test_client, init_database, validate_response):
+    """
+    GIVEN a batch of mixed dosage and raw water entries
+    WHEN the batch is synced for a plant
+    THEN every entry and its sections are written and linked in the database
+    """
+    batch = {"entries": [
+        {"type": "dosage", "user_id": 1, "created_at": "2024-04-01T08:00:00",
+         "calibration": calibration, "change_dose": change_dose},
+        {"type": "dosage", "user_id": 1},
+        {"type": "raw_water", "user_id": 1, "utn": 12, "turbidity_method": "turbidimeter"}
+    ]}
+    response = test_client.post('/api/plants/1/entries:batch', json=batch)
+    validate_response(response, 201, "application/json")
+
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['created'] * 3
+
+    entry = DosageEntry.query.get(results[0]['id'])
+    assert entry.calibration_id == results[0]['calibration_id']
+    assert entry.change_dose_id == results[0]['change_dose_id']
+    assert entry.created_at.isoformat() == "2024-04-01T08:00:00"
+
+    created_calibration = CalibrationSection.query.get(entry.calibration_id)
+    assert created_calibration.dosage_entry_id == entry.id
+    for key in calibration:
+        assert getattr(created_calibration, key) == calibration[key], mismatch_error("Written Output", calibration[key], getattr(created_calibration, key))
+    # derived on the server from the plant's 0.1 chemical concentration
+    assert created_calibration.calculated_flow_rate == pytest.approx(100 / 60)
+    assert created_calibration.calculated_chemical_dose == pytest.approx(100 / 60 * 0.1 / 10)
+    assert created_calibration.slider_pos_chem_dose_ratio == pytest.approx(0.5 / (100 / 60 * 0.1 / 10))
+
+    created_change_dose = ChangeDoseSection.query.get(entry.change_dose_id)
+    assert created_change_dose.related_calibration_id == created_calibration.id
+
+    assert DosageEntry.query.get(results[1]['id']).calibration_id is None
+    assert RawWaterEntry.query.get(results[2]['id']).utn == 12
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_entries_batch_partial(test_client, init_database, validate_response):
+    """
+    GIVEN a batch with invalid entries and an entry of another plant's user
+    WHEN the batch is synced for a plant
+    THEN only the valid entries are written and the others are reported per item
+    """
+    batch = {"entries": [
+        {"type": "raw_water", "user_id": 1, "utn": 7},
+        {"type": "raw_water", "user_id": 2, "utn": 7},
+        {"type": "dosage", "user_id": 1, "change_dose": change_dose},
+        {"type": "raw_water", "user_id": 1, "utn": "high"}
+    ]}
+    count = RawWaterEntry.query.count()
+    response = test_client.post('/api/plants/1/entries:batch', json=batch)
+    validate_response(response, 207, "application/json")
+
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['created', 'invalid', 'invalid', 'invalid']
+    assert results[1]['errors'] == ["user 2 does not belong to plant"]
+    assert results[2]['errors'] == ["change_dose requires a calibration"]
+    assert results[3]['errors'] == ["utn must be an integer"]
+    assert RawWaterEntry.query.count() == count + 1
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_entries_batch_unknown_plant(test_client, init_database):
+    """
+    GIVEN a plant ID that does not exist
+    WHEN a batch is synced for it
+    THEN return a 404 error
+    """
+    response = test_client.post('/api/plants/99/entries:batch', json={"entries": [{"type": "raw_water", "user_id": 1, "utn": 1}]})
+    assert response.status_code == 404, mismatch_error("Expected code status", 404, response.status_code)
+
+# ------------------------------------------------------------------------------------------
@@ -1,4 +1,6 @@
+from sqlalchemy.exc import OperationalError
 from application.models import Plant, Configuration
+from application.versions import table_versions
 from utils_test import mismatch_error
 
 direct_attributes = ['name', 'phone_number']
@@ -47,3 +49,78 @@ def test_create_plant(test_client, init_database, validate_response):
         assert getattr(created_config, attribute) == new_plant[attribute], mismatch_error("Written Output", new_plant[attribute], getattr(created_config, attribute))
 
 # ------------------------------------------------------------------------------------------
+
+def test_create_plant_conflict(test_client, init_database, query_budget):
+    """
+    GIVEN a plant name or phone number that already exists
+    WHEN a new plant is created with it
+    THEN return a 409 error naming the duplicate field, without a pre-check query
+    """
+    duplicate_name = {"name": "AguaClara", "phone_number": "999-999-9999", "chemical_type": "PAC",
+                      "chemical_concentration": 0.4, "num_filters": 4, "num_clarifiers": 4}
+    with query_budget(max_queries=2):
+        response = test_client.post('/api/plants/', json=duplicate_name)
+    assert response.status_code == 409, mismatch_error("Expected code status", 409, response.status_code)
+    assert response.get_json()['error'] == "Plant 'AguaClara' already exists"
+
+    duplicate_number = {**duplicate_name, "name": "AguaClara9", "phone_number": "111-111-1111"}
+    response = test_client.post('/api/plants/', json=duplicate_number)
+    assert response.status_code == 409, mismatch_error("Expected code status", 409, response.status_code)
+    assert response.get_json()['error'] == "Phone number '111-111-1111' already exists."
+    assert Plant.query.filter_by(name="AguaClara9").first() is None
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_plants_batch(test_client, init_database, validate_response):
+    """
+    GIVEN a batch of new, duplicated and invalid plants
+    WHEN the batch is provisioned
+    THEN new plants are created and the others are reported per item
+    """
+    plant = {"chemical_type": "PAC", "chemical_concentration": 0.5, "num_filters": 2, "num_clarifiers": 2}
+    batch = {"plants": [
+        {**plant, "name": "Batch1", "phone_number": "100-000-0001"},
+        {**plant, "name": "Batch2", "phone_number": "100-000-0002"},
+        {**plant, "name": "Batch1", "phone_number": "100-000-0003"},
+        {**plant, "name": "Batch4", "phone_number": "100-000-0004", "chemical_type": "Cl"}
+    ]}
+    response = test_client.post('/api/plants:batch', json=batch)
+    validate_response(response, 207, "application/json")
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['created', 'created', 'conflict', 'invalid']
+    assert results[1]['config_id']['chemical_concentration'] == 0.5
+    assert Plant.query.get(results[1]['id']).config_id == results[1]['config_id']['id']
+
+    # conflicts with existing plants are found by the UNIQUE constraints
+    batch = {"plants": [
+        {**plant, "name": "Batch5", "phone_number": "100-000-0005"},
+        {**plant, "name": "Batch2", "phone_number": "100-000-0006"}
+    ]}
+    results = test_client.post('/api/plants:batch', json=batch).get_json()['results']
+    assert [r['status'] for r in results] == ['created', 'conflict']
+    assert results[1]['errors'] == ["Plant 'Batch2' already exists"]
+    assert Plant.query.filter_by(name="Batch5").count() == 1
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_plants_batch_fallback_atomic(test_client, init_database, monkeypatch):
+    """
+    GIVEN a batch provisioned one plant at a time because of a conflict
+    WHEN bumping the table versions fails after the plants were inserted
+    THEN the plants inserted before the failure are rolled back with it
+    """
+    def fail(*args):
+        raise OperationalError("UPDATE table_versions", {}, Exception("database is locked"))
+    monkeypatch.setattr("application.routes.bump_versions", fail)
+    before = table_versions(Plant)
+    plant = {"chemical_type": "PAC", "chemical_concentration": 0.5, "num_filters": 2, "num_clarifiers": 2}
+    batch = {"plants": [
+        {**plant, "name": "Atomic1", "phone_number": "100-000-0101"},
+        {**plant, "name": "AguaClara", "phone_number": "100-000-0102"}
+    ]}
+    response = test_client.post('/api/plants:batch', json=batch)
+    assert response.status_code == 500, mismatch_error("Expected code status", 500, response.status_code)
+    assert Plant.query.filter_by(name="Atomic1").count() == 0
+    assert table_versions(Plant) == before
+
+# ------------------------------------------------------------------------------------------
@@ -0,0 +1,95 @@
+from sqlalchemy.exc import OperationalError
+from application.models import User
+from application.versions import table_versions
+from utils_test import mismatch_error
+
+
+def test_create_user(test_client, init_database, validate_response):
+    """
+    GIVEN a new user information
+    WHEN a new user is created
+    THEN the user is written with the id of its plant and the plant is returned
+    """
+    new_user = {"name": "Ana", "email": "ana@email.com", "phone_number": "222-333-444", "plant_name": "AguaClara2"}
+    response = test_client.post('/api/users/', json=new_user)
+    validate_response(response, 201, "application/json")
+
+    data = response.get_json()
+    assert data['plant_id']['name'] == "AguaClara2"
+    created_user = User.query.get(data['id'])
+    assert created_user.plant_id == 2, mismatch_error("Written Output", 2, created_user.plant_id)
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_user_conflict(test_client, init_database):
+    """
+    GIVEN an email or phone number that is already in use
+    WHEN a new user is created with it
+    THEN return a 409 error naming the duplicate field
+    """
+    duplicate_email = {"name": "Ana", "email": "jane@email.com", "phone_number": "000-000-000", "plant_name": "AguaClara"}
+    response = test_client.post('/api/users/', json=duplicate_email)
+    assert response.status_code == 409, mismatch_error("Expected code status", 409, response.status_code)
+    assert response.get_json()['error'] == "User 'jane@email.com' already in use."
+
+    duplicate_number = {**duplicate_email, "email": "new@email.com", "phone_number": "987-654-321"}
+    response = test_client.post('/api/users/', json=duplicate_number)
+    assert response.get_json()['error'] == "User Phone number '987-654-321' already in use."
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_users_batch(test_client, init_database, validate_response):
+    """
+    GIVEN a batch of users for existing and unknown plants
+    WHEN the batch is provisioned
+    THEN users of existing plants are created and the others are reported per item
+    """
+    batch = {"users": [
+        {"name": "U1", "email": "u1@email.com", "phone_number": "1", "plant_name": "AguaClara"},
+        {"name": "U2", "email": "u2@email.com", "phone_number": "2", "plant_name": "AguaClara3"},
+        {"name": "U3", "email": "u3@email.com", "phone_number": "3", "plant_name": "Nowhere"},
+        {"name": "U4", "email": "email@email.com", "phone_number": "4", "plant_name": "AguaClara"}
+    ]}
+    response = test_client.post('/api/users:batch', json=batch)
+    validate_response(response, 207, "application/json")
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == ['created', 'created', 'invalid', 'conflict']
+    assert results[1]['plant_id'] == 3
+    assert User.query.get(results[0]['id']).email == "u1@email.com"
+    assert User.query.filter_by(name="U4").count() == 0
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_user_invalid(test_client, init_database):
+    """
+    GIVEN a user missing fields
+    WHEN a new user is created
+    THEN return a 400 error listing every missing field
+    """
+    response = test_client.post('/api/users/', json={"name": "Ana", "phone_number": 5})
+    assert response.status_code == 400, mismatch_error("Expected code status", 400, response.status_code)
+    assert response.get_json()['error'] == \
+        "User invalid: missing email; phone_number must be a string; missing plant_name"
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_users_batch_fallback_atomic(test_client, init_database, monkeypatch):
+    """
+    GIVEN a batch provisioned one user at a time because of a conflict
+    WHEN bumping the table versions fails after the users were inserted
+    THEN the users inserted before the failure are rolled back with it
+    """
+    def fail(*args):
+        raise OperationalError("UPDATE table_versions", {}, Exception("database is locked"))
+    monkeypatch.setattr("application.routes.bump_versions", fail)
+    before = table_versions(User)
+    batch = {"users": [
+        {"name": "Atomic1", "email": "atomic1@email.com", "phone_number": "101", "plant_name": "AguaClara"},
+        {"name": "Atomic2", "email": "email@email.com", "phone_number": "102", "plant_name": "AguaClara"}
+    ]}
+    response = test_client.post('/api/users:batch', json=batch)
+    assert response.status_code == 500, mismatch_error("Expected code status", 500, response.status_code)
+    assert User.query.filter_by(name="Atomic1").count() == 0
+    assert table_versions(User) == before
+
+# ------------------------------------------------------------------------------------------
@@ -0,0 +1,69 @@
+from application.models import db, Plant, Configuration, User, DosageEntry, CalibrationSection, \
+    ChangeDoseSection, RawWaterEntry, PlantDailyRollup
+from utils_test import mismatch_error, calibration_for
+
+calibration = calibration_for(3.0)
+change_dose = {"target_coagulant_dose": 5.0, "new_slider_position": 0.6}
+
+def sync_entries(test_client, plant_id, user_id, size):
+    entries = []
+    for _ in range(size):
+        entries.append({"type": "dosage", "user_id": user_id, "calibration": calibration, "change_dose": change_dose})
+        entries.append({"type": "raw_water", "user_id": user_id, "utn": 10})
+    response = test_client.post(f'/api/plants/{plant_id}/entries:batch', json={"entries": entries})
+    assert response.status_code == 201
+
+
+def test_delete_plant_hard(test_client, init_database, validate_response, query_budget):
+    """
+    GIVEN a plant with users and entries
+    WHEN the plant is deleted
+    THEN its configuration, users, entries and rollups are removed in one transaction of indexed statements
+    """
+    sync_entries(test_client, 1, 1, 50)
+    sync_entries(test_client, 2, 2, 5)
+
+    # the hot entries, then the archived ones
+    with query_budget(max_queries=18):
+        response = test_client.delete('/api/plants/1/')
+    validate_response(response, 200, "application/json")
+    assert response.get_json()['name'] == 'AguaClara'
+
+    assert db.session.get(Plant, 1) is None
+    assert db.session.get(Configuration, 1) is None
+    assert User.query.filter_by(plant_id=1).count() == 0
+    assert PlantDailyRollup.query.filter_by(plant_id=1).count() == 0
+    # only the other plant's entries are left
+    for model in (DosageEntry, CalibrationSection, ChangeDoseSection, RawWaterEntry):
+        assert model.query.count() == 5, mismatch_error(f"{model.__tablename__} count", 5, model.query.count())
+
+    response = test_client.get('/api/plants/1/')
+    assert response.status_code == 404, mismatch_error("Expected code status", 404, response.status_code)
+
+# ------------------------------------------------------------------------------------------
+
+def test_delete_plant_soft(test_client, init_database, validate_response):
+    """
+    GIVEN a plant with users and entries
+    WHEN the plant is deleted with soft deleted entries
+    THEN the entries are kept and marked deleted
+    """
+    response = test_client.delete('/api/plants/2/?entries=soft')
+    validate_response(response, 200, "application/json")
+
+    assert db.session.get(Plant, 2) is None
+    assert DosageEntry.query.count() == 5
+    assert DosageEntry.query.filter_by(is_deleted=False).count() == 0
+
+# ------------------------------------------------------------------------------------------
+
+def test_delete_plant_invalid(test_client, init_database):
+    """
+    GIVEN a plant ID that does not exist and an invalid entries mode
+    WHEN the plant is deleted
+    THEN return a 404 and a 400 error
+    """
+    assert test_client.delete('/api/plants/99/').status_code == 404
+    assert test_client.delete('/api/plants/3/?entries=archive').status_code == 400
+
+# ------------------------------------------------------------------------------------------
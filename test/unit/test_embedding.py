@@ -0,0 +1,77 @@
+import json
+from utils_test import mismatch_error
+
+
+def test_get_plant_include(test_client, init_database, validate_response, query_budget):
+    """
+    GIVEN a plant with a configuration and a user
+    WHEN the plant is requested with its configuration and users included
+    THEN the related objects are embedded, loaded with one query per collection
+    """
+    # table versions, the plant joined with its configuration, the users
+    with query_budget(max_queries=3):
+        response = test_client.get('/api/plants/1/?include=configuration,users')
+    validate_response(response, 200, "application/json")
+    data = response.get_json()
+    assert data['configuration']['chemical_concentration'] == 0.1
+    assert [user['name'] for user in data['users']] == ["John Doe"], \
+        mismatch_error("Embedded users", ["John Doe"], data['users'])
+
+# ------------------------------------------------------------------------------------------
+
+def test_get_users_nested_include_with_fields(test_client, init_database, query_budget):
+    """
+    GIVEN users of different plants
+    WHEN they are listed with their plant and its configuration, keeping a few fields
+    THEN only the requested fields and ids are returned, in a single query for any page size
+    """
+    with query_budget(max_queries=2, allow_scans=("users",)):
+        response = test_client.get('/api/users/?include=plant.configuration&fields=name,plant.name,plant.configuration.num_filters')
+    assert response.status_code == 200
+    users = response.get_json()['users']
+    assert users[1] == {"id": 2, "name": "Jane Smith",
+                        "plant": {"id": 2, "name": "AguaClara2", "configuration": {"id": 2, "num_filters": 2}}}
+
+    response = test_client.get('/api/users/?fields=email&limit=1')
+    assert response.get_json() == {"users": [{"id": 1, "email": "email@email.com"}], "next_after_id": 1}
+
+# ------------------------------------------------------------------------------------------
+
+def test_stream_plants_include(test_client, init_database):
+    """
+    GIVEN plants with users
+    WHEN the plants are streamed with their users included
+    THEN every streamed plant embeds its users
+    """
+    response = test_client.get('/api/plants/?stream=true&include=users')
+    assert response.is_streamed
+    plants = json.loads(response.get_data(as_text=True))['plants']
+    assert [[user['id'] for user in plant['users']] for plant in plants] == [[1], [2], [3]]
+
+# ------------------------------------------------------------------------------------------
+
+def test_include_etag_covers_included_tables(test_client, init_database):
+    """
+    GIVEN a plant fetched with its users included and its ETag
+    WHEN a user of another plant is deleted
+    THEN the ETag of the embedding representation changes while the plain one does not
+    """
+    embedded = test_client.get('/api/plants/1/?include=users').headers['ETag']
+    plain = test_client.get('/api/plants/1/').headers['ETag']
+    assert test_client.delete('/api/users/3/').status_code == 200
+
+    assert test_client.get('/api/plants/1/?include=users', headers={'If-None-Match': embedded}).status_code == 200
+    assert test_client.get('/api/plants/1/', headers={'If-None-Match': plain}).status_code == 304
+
+# ------------------------------------------------------------------------------------------
+
+def test_invalid_include_or_fields(test_client, init_database):
+    """
+    GIVEN unknown relationships or fields
+    WHEN a resource is requested with them
+    THEN the request is rejected
+    """
+    assert test_client.get('/api/plants/1/?include=entries').status_code == 400
+    assert test_client.get('/api/users/?include=plant.users.plant.users').status_code == 400
+    assert test_client.get('/api/plants/?fields=password').status_code == 400
+    assert test_client.get('/api/users/1/?fields=plant.name').status_code == 400
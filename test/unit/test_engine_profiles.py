@@ -0,0 +1,54 @@
+import pytest
+from flask import current_app
+from sqlalchemy import create_engine, text
+from application.engine import engine_options, sqlite_pragmas, use_sqlite_pragmas
+
+
+def test_sqlite_profile_pragmas(test_client, tmp_path):
+    """
+    GIVEN an engine of a SQLite file with the sqlite profile pragmas
+    WHEN a connection is opened
+    THEN the connection uses WAL journaling and the configured pragmas
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'profile.db'}")
+    use_sqlite_pragmas(engine, sqlite_pragmas(current_app.config))
+    with engine.connect() as connection:
+        assert connection.scalar(text("PRAGMA journal_mode")) == "wal"
+        assert connection.scalar(text("PRAGMA synchronous")) == 1  # NORMAL
+        assert connection.scalar(text("PRAGMA busy_timeout")) == current_app.config["SQLITE_BUSY_TIMEOUT"]
+        assert connection.scalar(text("PRAGMA cache_size")) == current_app.config["SQLITE_CACHE_SIZE"]
+    engine.dispose()
+
+# ------------------------------------------------------------------------------------------
+
+def test_engine_options(test_client):
+    """
+    GIVEN the engine profiles
+    WHEN their engine options are built
+    THEN postgres gets a pre-pinged pool with a statement timeout, mismatched and unsupported databases are rejected
+    """
+    config = dict(current_app.config)
+    options = engine_options({**config, "ENGINE_PROFILE": "postgres", "SQLALCHEMY_DATABASE_URI": "postgresql://db/aguadatos"})
+    assert options["pool_pre_ping"] is True
+    assert options["pool_size"] == config["POSTGRES_POOL_SIZE"]
+    assert options["connect_args"] == {"options": f"-c statement_timeout={config['POSTGRES_STATEMENT_TIMEOUT']}"}
+
+    # explicit engine options win over the profile ones
+    options = engine_options({**config, "ENGINE_PROFILE": "postgres", "SQLALCHEMY_DATABASE_URI": "postgresql://db/aguadatos",
+                              "SQLALCHEMY_ENGINE_OPTIONS": {"pool_size": 2}})
+    assert options["pool_size"] == 2
+
+    # only the archive schema translation is added outside the postgres profile
+    assert engine_options({**config, "ENGINE_PROFILE": "sqlite"}) == {"execution_options": {"schema_translate_map": {"archive": None}}}
+    options = engine_options({**config, "ARCHIVE_DATABASE": "archive.db"})
+    assert options["execution_options"]["schema_translate_map"] == {"archive": "archive"}
+    with pytest.raises(ValueError):
+        engine_options({**config, "ENGINE_PROFILE": "postgres", "SQLALCHEMY_DATABASE_URI": "postgresql://db/aguadatos",
+                        "ARCHIVE_DATABASE": "archive.db"})
+    with pytest.raises(ValueError):
+        engine_options({**config, "ENGINE_PROFILE": "postgres"})
+    with pytest.raises(ValueError):
+        engine_options({**config, "ENGINE_PROFILE": "turbo"})
+    # the rollups need INSERT .. ON CONFLICT, other databases are rejected at startup
+    with pytest.raises(ValueError):
+        engine_options({**config, "ENGINE_PROFILE": "default", "SQLALCHEMY_DATABASE_URI": "mysql://db/aguadatos"})
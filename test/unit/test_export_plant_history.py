@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+import pytest
+from flask import current_app
+from application.cache import plant_by_id
+from utils_test import mismatch_error, calibration_for
+
+change_dose = {"target_coagulant_dose": 5.0, "new_slider_position": 0.6}
+
+@pytest.fixture(scope='module')
+def history(test_client, init_database):
+    """
+    Sync a small history for plant 1 and soft delete one of its dosage entries.
+    """
+    entries = [
+        {"type": "dosage", "user_id": 1, "created_at": "2024-04-01T08:00:00",
+         "calibration": calibration_for(2.0), "change_dose": change_dose},
+        {"type": "dosage", "user_id": 1, "created_at": "2024-04-02T08:00:00"},
+        {"type": "dosage", "user_id": 1, "created_at": "2024-04-03T08:00:00", "calibration": calibration_for(3.0)},
+        {"type": "raw_water", "user_id": 1, "created_at": "2024-04-01T09:00:00", "utn": 12, "turbidity_method": "turbidimeter"},
+    ]
+    results = test_client.post('/api/plants/1/entries:batch', json={"entries": entries}).get_json()['results']
+    assert test_client.delete(f"/api/plants/1/dosage_entries/{results[2]['id']}/").status_code == 200
+    # the exports find the plant in the cache
+    plant_by_id(1)
+    return results
+
+
+def test_export_dosage_csv(test_client, history, query_budget):
+    """
+    GIVEN the dosage history of a plant
+    WHEN it is exported as CSV
+    THEN every entry that is not deleted is a row with its user, calibration and change dose, in one query over the entries
+    """
+    # the newest archived entry, then the rows
+    with query_budget(max_queries=2):
+        response = test_client.get('/api/plants/1/export/?format=csv')
+        body = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert response.mimetype == "text/csv"
+    assert response.headers['Content-Disposition'] == 'attachment; filename="plant-1-dosage.csv"'
+
+    rows = list(csv.DictReader(io.StringIO(body)))
+    assert [int(r['entry_id']) for r in rows] == [history[0]['id'], history[1]['id']]
+    assert rows[0]['created_at'] == "2024-04-01T08:00:00"
+    assert rows[0]['user_name'] == "John Doe"
+    assert float(rows[0]['calculated_chemical_dose']) == pytest.approx(2.0)
+    assert float(rows[0]['target_coagulant_dose']) == 5.0
+    assert rows[1]['calculated_chemical_dose'] == "", mismatch_error("Uncalibrated dose", "", rows[1]['calculated_chemical_dose'])
+
+# ------------------------------------------------------------------------------------------
+
+def test_export_raw_water_ndjson(test_client, history):
+    """
+    GIVEN the raw water history of a plant
+    WHEN it is exported as NDJSON within a time range
+    THEN one JSON object per entry of the range is returned
+    """
+    response = test_client.get('/api/plants/1/export/?format=ndjson&kind=raw_water&start=2024-04-01&end=2024-04-02')
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [{"entry_id": history[3]['id'], "created_at": "2024-04-01T09:00:00", "user_id": 1,
+                      "user_name": "John Doe", "utn": 12, "turbidity_method": "turbidimeter"}]
+
+    response = test_client.get('/api/plants/1/export/?format=ndjson&kind=raw_water&start=2024-04-02')
+    assert response.get_data(as_text=True) == ""
+
+# ------------------------------------------------------------------------------------------
+
+def test_export_is_streamed_in_chunks(test_client, history):
+    """
+    GIVEN a stream chunk smaller than the history
+    WHEN the history is exported
+    THEN the response is streamed in several chunks
+    """
+    chunk_size = current_app.config["STREAM_CHUNK_SIZE"]
+    current_app.config["STREAM_CHUNK_SIZE"] = 1
+    try:
+        response = test_client.get('/api/plants/1/export/?format=ndjson')
+        assert response.is_streamed
+        chunks = [chunk for chunk in response.response if chunk]
+    finally:
+        current_app.config["STREAM_CHUNK_SIZE"] = chunk_size
+    assert len(chunks) == 2
+
+# ------------------------------------------------------------------------------------------
+
+def test_export_invalid_arguments(test_client, init_database):
+    """
+    GIVEN invalid export arguments or an unknown plant
+    WHEN the history is exported
+    THEN the export is rejected
+    """
+    assert test_client.get('/api/plants/1/export/?format=xml').status_code == 400
+    assert test_client.get('/api/plants/1/export/?kind=users').status_code == 400
+    assert test_client.get('/api/plants/1/export/?start=yesterday').status_code == 400
+    assert test_client.get('/api/plants/99/export/').status_code == 404
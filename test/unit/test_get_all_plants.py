@@ -23,6 +23,51 @@ def test_get_all_plants(test_client, init_database, validate_response):
     ]
 
     for expected, actual in zip(expected_plants, data['plants']):
+        assert actual.pop('updated_at') is not None
         assert expected == actual, mismatch_error("Response Output", expected, actual)
 
-# ------------------------------------------------------------------------------------------
\ No newline at end of file
+# ------------------------------------------------------------------------------------------
+def test_get_all_plants_paginated(test_client, init_database, validate_response):
+    """
+    GIVEN all plants in the database
+    WHEN plants are requested one page at a time
+    THEN each page holds at most `limit` plants and the cursor walks through all of them
+    """
+    response = test_client.get('/api/plants/?limit=2')
+    validate_response(response, 200, "application/json")
+    data = response.get_json()
+    assert [p['id'] for p in data['plants']] == [1, 2]
+    assert data['next_after_id'] == 2, mismatch_error("next_after_id", 2, data['next_after_id'])
+
+    response = test_client.get(f"/api/plants/?limit=2&after_id={data['next_after_id']}")
+    validate_response(response, 200, "application/json")
+    data = response.get_json()
+    assert [p['id'] for p in data['plants']] == [3]
+    assert data['next_after_id'] is None, mismatch_error("next_after_id", None, data['next_after_id'])
+
+# ------------------------------------------------------------------------------------------
+
+def test_get_all_plants_invalid_cursor(test_client, init_database):
+    """
+    GIVEN a non-integer cursor
+    WHEN plants are requested
+    THEN return a 400 error
+    """
+    response = test_client.get('/api/plants/?after_id=abc')
+    assert response.status_code == 400, mismatch_error("Expected code status", 400, response.status_code)
+
+# ------------------------------------------------------------------------------------------
+
+def test_get_all_plants_stream(test_client, init_database, validate_response):
+    """
+    GIVEN all plants in the database
+    WHEN all plants are requested as a stream
+    THEN the streamed body is a JSON object holding every plant
+    """
+    response = test_client.get('/api/plants/?stream=true')
+    validate_response(response, 200, "application/json")
+
+    data = response.get_json()
+    assert [p['name'] for p in data['plants']] == ['AguaClara', 'AguaClara2', 'AguaClara3']
+
+# ------------------------------------------------------------------------------------------
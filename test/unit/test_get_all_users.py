@@ -0,0 +1,31 @@
+from utils_test import mismatch_error
+
+
+def test_get_all_users(test_client, init_database, validate_response):
+    """
+    GIVEN all users in the database
+    WHEN all users are requested
+    THEN return all users
+    """
+    response = test_client.get('/api/users/')
+    validate_response(response, 200, "application/json")
+
+    data = response.get_json()
+    assert len(data['users']) == 3, mismatch_error("Number of users", 3, len(data['users']))
+    assert data['next_after_id'] is None
+
+# ------------------------------------------------------------------------------------------
+
+def test_get_all_users_stream_after_id(test_client, init_database, validate_response):
+    """
+    GIVEN all users in the database
+    WHEN users after the first one are requested as a stream
+    THEN only the remaining users are streamed
+    """
+    response = test_client.get('/api/users/?stream=true&after_id=1')
+    validate_response(response, 200, "application/json")
+
+    data = response.get_json()
+    assert [u['email'] for u in data['users']] == ['jane@email.com', 'bob@example.com']
+
+# ------------------------------------------------------------------------------------------
@@ -0,0 +1,71 @@
+from utils_test import mismatch_error, dosage_entry
+
+
+def raw_water(created_at, utn):
+    return {"type": "raw_water", "user_id": 1, "created_at": created_at, "utn": utn}
+
+
+def test_get_plant_trends_chemical_dose(test_client, init_database, validate_response):
+    """
+    GIVEN calibrations of a plant spread over two days
+    WHEN the daily chemical dose trend is requested
+    THEN one bucket per day is returned with its min, max, mean and count
+    """
+    batch = {"entries": [
+        dosage_entry("2024-04-01T08:00:00", 2.0),
+        dosage_entry("2024-04-01T17:30:00", 4.0),
+        dosage_entry("2024-04-02T09:00:00", 3.0)
+    ]}
+    assert test_client.post('/api/plants/1/entries:batch', json=batch).status_code == 201
+
+    response = test_client.get('/api/plants/1/trends/?metric=chemical_dose&bucket=day')
+    validate_response(response, 200, "application/json")
+
+    expected = [
+        {"bucket": "2024-04-01T00:00:00", "min": 2.0, "max": 4.0, "mean": 3.0, "count": 2},
+        {"bucket": "2024-04-02T00:00:00", "min": 3.0, "max": 3.0, "mean": 3.0, "count": 1}
+    ]
+    points = response.get_json()['points']
+    assert points == expected, mismatch_error("Response Output", expected, points)
+
+# ------------------------------------------------------------------------------------------
+
+def test_get_plant_trends_utn_week(test_client, init_database, validate_response):
+    """
+    GIVEN raw water readings of a plant within a time range
+    WHEN the weekly turbidity trend is requested for part of that range
+    THEN readings are grouped into weeks starting on Monday and filtered by the range
+    """
+    batch = {"entries": [
+        raw_water("2024-03-31T12:00:00", 30),
+        raw_water("2024-04-01T12:00:00", 10),
+        raw_water("2024-04-07T12:00:00", 20),
+        raw_water("2024-04-08T12:00:00", 40)
+    ]}
+    assert test_client.post('/api/plants/1/entries:batch', json=batch).status_code == 201
+
+    response = test_client.get('/api/plants/1/trends/?metric=utn&bucket=week&start=2024-04-01T00:00:00')
+    validate_response(response, 200, "application/json")
+
+    points = response.get_json()['points']
+    assert [(p['bucket'], p['count'], p['mean']) for p in points] == [
+        ("2024-04-01T00:00:00", 2, 15.0),
+        ("2024-04-08T00:00:00", 1, 40.0)
+    ]
+
+    # an aware bound next to a naive one
+    response = test_client.get('/api/plants/1/trends/?metric=utn&bucket=week&start=2024-04-01T00:00:00Z&end=2024-05-01T00:00:00')
+    validate_response(response, 200, "application/json")
+
+# ------------------------------------------------------------------------------------------
+
+def test_get_plant_trends_invalid_metric(test_client, init_database):
+    """
+    GIVEN a metric that does not exist
+    WHEN its trend is requested
+    THEN return a 400 error
+    """
+    response = test_client.get('/api/plants/1/trends/?metric=pressure')
+    assert response.status_code == 400, mismatch_error("Expected code status", 400, response.status_code)
+
+# ------------------------------------------------------------------------------------------
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, func, update
+from application.models import db, Plant, RawWaterEntry, IdempotencyKey
+from utils_test import mismatch_error
+
+NEW_PLANT = {
+    "name": "Retried",
+    "phone_number": "777-777-7777",
+    "chemical_type": "PAC",
+    "chemical_concentration": 0.1,
+    "num_filters": 1,
+    "num_clarifiers": 1
+}
+
+def post(test_client, url, payload, key):
+    return test_client.post(url, json=payload, headers={"Idempotency-Key": key})
+
+
+def test_retry_replays_response(test_client, init_database, query_budget):
+    """
+    GIVEN a plant created with an Idempotency-Key
+    WHEN the request is retried with the same key
+    THEN the original response is replayed without querying the database
+    """
+    first = post(test_client, '/api/plants/', NEW_PLANT, "plant-1")
+    assert first.status_code == 201
+    with query_budget(max_queries=0):
+        retry = post(test_client, '/api/plants/', NEW_PLANT, "plant-1")
+    assert retry.status_code == 201, mismatch_error("Status", 201, retry.status_code)
+    assert retry.get_json() == first.get_json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert db.session.scalar(select(func.count(Plant.id)).where(Plant.name == "Retried")) == 1
+
+    # without the key, the retry is a conflict
+    assert test_client.post('/api/plants/', json=NEW_PLANT).status_code == 409
+
+# ------------------------------------------------------------------------------------------
+
+def test_reused_key_rejected(test_client, init_database):
+    """
+    GIVEN a key already used
+    WHEN it is sent with another payload, or with an invalid length
+    THEN the request is rejected without running the route
+    """
+    post(test_client, '/api/plants/', {**NEW_PLANT, "name": "Keyed", "phone_number": "888"}, "plant-2")
+    response = post(test_client, '/api/plants/', {**NEW_PLANT, "name": "Other", "phone_number": "999"}, "plant-2")
+    assert response.status_code == 422
+    assert db.session.scalar(select(func.count(Plant.id)).where(Plant.name == "Other")) == 0
+    assert post(test_client, '/api/plants/', NEW_PLANT, "k" * 256).status_code == 400
+
+# ------------------------------------------------------------------------------------------
+
+def test_entries_replayed_from_database(test_client, init_database, query_budget):
+    """
+    GIVEN a synced batch whose response fell out of the in-memory cache
+    WHEN the batch is retried
+    THEN it is replayed from the database with a single query and no entry is duplicated
+    """
+    batch = {"entries": [{"type": "raw_water", "user_id": 1, "utn": 5}]}
+    first = post(test_client, '/api/plants/1/entries:batch', batch, "entries-1")
+    store = current_app.extensions["idempotency"]
+    store.cache.clear()
+    with query_budget(max_queries=1):
+        retry = post(test_client, '/api/plants/1/entries:batch', batch, "entries-1")
+    assert retry.get_json() == first.get_json()
+    assert db.session.scalar(select(func.count(RawWaterEntry.id)).where(RawWaterEntry.utn == 5)) == 1
+
+# ------------------------------------------------------------------------------------------
+
+def test_expired_keys_evicted(test_client, init_database):
+    """
+    GIVEN an expired key
+    WHEN it is reused before and after the expired keys are evicted
+    THEN it answers a new request each time, and its row is deleted by the eviction
+    """
+    post(test_client, '/api/plants/1/entries:batch', {"entries": [{"type": "raw_water", "user_id": 1, "utn": 6}]}, "entries-2")
+    db.session.execute(update(IdempotencyKey).where(IdempotencyKey.key == "entries-2")
+                       .values(expires_at=datetime.now() - timedelta(seconds=1)))
+    db.session.commit()
+    store = current_app.extensions["idempotency"]
+    store.cache.clear()
+
+    # reused before the evictor ran, the stale row is replaced and the new response replayed
+    response = post(test_client, '/api/plants/1/entries:batch', {"entries": [{"type": "raw_water", "user_id": 1, "utn": 6}]}, "entries-2")
+    assert "Idempotent-Replayed" not in response.headers
+    store.cache.clear()
+    retry = post(test_client, '/api/plants/1/entries:batch', {"entries": [{"type": "raw_water", "user_id": 1, "utn": 6}]}, "entries-2")
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json() == response.get_json()
+
+    db.session.execute(update(IdempotencyKey).where(IdempotencyKey.key == "entries-2")
+                       .values(expires_at=datetime.now() - timedelta(seconds=1)))
+    db.session.commit()
+    store.cache.clear()
+    assert store.evict() == 1
+    assert db.session.get(IdempotencyKey, "entries-2") is None
+    response = post(test_client, '/api/plants/1/entries:batch', {"entries": [{"type": "raw_water", "user_id": 1, "utn": 6}]}, "entries-2")
+    assert "Idempotent-Replayed" not in response.headers
+    assert db.session.scalar(select(func.count(RawWaterEntry.id)).where(RawWaterEntry.utn == 6)) == 3
@@ -0,0 +1,69 @@
+import logging
+from flask import current_app
+from application.metrics import Histogram
+
+
+def test_histogram_buckets():
+    """
+    GIVEN observations of a histogram
+    WHEN they are recorded
+    THEN each one is counted in the first bucket whose bound it does not exceed
+    """
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 3.65
+
+# ------------------------------------------------------------------------------------------
+
+def scrape(test_client):
+    response = test_client.get('/api/metrics')
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in response.get_data(as_text=True).splitlines() if not line.startswith("#")}
+
+def test_metrics_endpoint(test_client, init_database, validate_response):
+    """
+    GIVEN requests handled by the application
+    WHEN the metrics are scraped
+    THEN per-route request counts, latency histograms, SQL counts and cache metrics are exposed
+    """
+    route = 'route="/api/plants/<int:plant_id>/"'
+    requests_total = f'http_requests_total{{method="GET",{route},status="200"}}'
+    before = scrape(test_client)
+    assert test_client.get('/api/plants/1/').status_code == 200
+    assert test_client.get('/api/plants/2/').status_code == 200
+    response = test_client.get('/api/metrics')
+    validate_response(response, 200, "text/plain; version=0.0.4; charset=utf-8")
+    assert '# TYPE http_request_duration_seconds histogram' in response.get_data(as_text=True).splitlines()
+    after = scrape(test_client)
+
+    def delta(series):
+        return after[series] - before.get(series, 0)
+
+    assert delta(requests_total) == 2
+    assert delta(f'http_request_duration_seconds_bucket{{{route},le="+Inf"}}') == 2
+    assert delta(f'http_request_duration_seconds_count{{{route}}}') == 2
+    assert delta(f'db_statements_total{{{route}}}') >= 2
+    assert f'serialization_duration_seconds_total{{{route}}}' in after
+    assert 'cache_entries{cache="plant"}' in after
+    assert 'cache_lookups_total{cache="plant",result="hits"}' in after
+
+# ------------------------------------------------------------------------------------------
+
+def test_slow_request_log(test_client, init_database, caplog):
+    """
+    GIVEN a slow request threshold every request exceeds
+    WHEN a request is handled
+    THEN it is logged with the SQL it executed
+    """
+    current_app.config["SLOW_REQUEST_MS"] = 0
+    try:
+        with caplog.at_level(logging.WARNING, logger=current_app.logger.name):
+            assert test_client.get('/api/plants/1/').status_code == 200
+    finally:
+        current_app.config["SLOW_REQUEST_MS"] = None
+    messages = [r.getMessage() for r in caplog.records if r.getMessage().startswith("Slow request GET /api/plants/1/")]
+    assert len(messages) == 1
+    assert "SELECT" in messages[0]
@@ -0,0 +1,74 @@
+from application.cache import LRUCache, plant_cache, plant_by_id, invalidate_plant
+from utils_test import mismatch_error
+
+
+def test_lru_cache_eviction():
+    """
+    GIVEN a full cache
+    WHEN a new key is cached
+    THEN the least recently used key is evicted and counted
+    """
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 1, 1), mismatch_error("Cache stats", (3, 1, 1), stats)
+
+# ------------------------------------------------------------------------------------------
+
+def test_lru_cache_ttl():
+    """
+    GIVEN a cached key
+    WHEN it is read after its TTL
+    THEN it is expired and the loader is called again
+    """
+    now = [0.0]
+    cache = LRUCache(maxsize=10, ttl=5, clock=lambda: now[0])
+    loads = []
+    loader = lambda: loads.append(1) or "value"
+
+    assert cache.get_or_load("key", loader) == "value"
+    now[0] = 4.0
+    assert cache.get_or_load("key", loader) == "value"
+    now[0] = 10.0
+    assert cache.get_or_load("key", loader) == "value"
+    assert len(loads) == 2
+    assert cache.stats()["expirations"] == 1
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_user_uses_plant_cache(test_client, init_database, validate_response):
+    """
+    GIVEN a plant already looked up
+    WHEN users sign up for that plant
+    THEN the plant is served from the cache and returned in the response
+    """
+    assert plant_by_id(1)["configuration"]["chemical_concentration"] == 0.1
+    hits = plant_cache.stats()["hits"]
+
+    new_user = {"name": "Ana", "email": "ana@email.com", "phone_number": "222-333-444", "plant_name": "AguaClara"}
+    response = test_client.post('/api/users/', json=new_user)
+    validate_response(response, 201, "application/json")
+    assert response.get_json()['plant_id']['id'] == 1
+    assert plant_cache.stats()["hits"] == hits + 1
+
+# ------------------------------------------------------------------------------------------
+
+def test_invalidate_plant(test_client, init_database):
+    """
+    GIVEN a cached plant
+    WHEN the plant is invalidated by name and id
+    THEN the next lookup misses the cache
+    """
+    plant_by_id(2)
+    invalidate_plant(2, "AguaClara2")
+    misses = plant_cache.stats()["misses"]
+    assert plant_by_id(2)["plant"]["name"] == "AguaClara2"
+    assert plant_cache.stats()["misses"] == misses + 1
+
+# ------------------------------------------------------------------------------------------
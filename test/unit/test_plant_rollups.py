@@ -0,0 +1,124 @@
+from datetime import date, datetime
+from application.models import db, User, PlantDailyRollup
+from application.rollups import RollupDeltas, apply_deltas, check_rollups, rebuild_rollups
+from utils_test import mismatch_error, dosage_entry
+
+
+def test_rollups_follow_inserts(test_client, init_database, validate_response):
+    """
+    GIVEN entries synced for a plant in two batches
+    WHEN the plant's daily rollups are requested
+    THEN the rollups aggregate both batches and match a full recomputation
+    """
+    first = {"entries": [dosage_entry("2024-04-01T08:00:00", 2.0), dosage_entry("2024-04-01T09:00:00", 6.0)]}
+    second = {"entries": [
+        dosage_entry("2024-04-01T10:00:00", 1.0),
+        {"type": "dosage", "user_id": 1, "created_at": "2024-04-01T11:00:00"},
+        {"type": "raw_water", "user_id": 1, "created_at": "2024-04-02T11:00:00", "utn": 15}
+    ]}
+    assert test_client.post('/api/plants/1/entries:batch', json=first).status_code == 201
+    assert test_client.post('/api/plants/1/entries:batch', json=second).status_code == 201
+
+    response = test_client.get('/api/plants/1/rollups/')
+    validate_response(response, 200, "application/json")
+    days = response.get_json()['days']
+    assert [d['day'] for d in days] == ['2024-04-01', '2024-04-02']
+
+    first_day = days[0]
+    expected = {"dosage_count": 4, "calibration_count": 3, "dose_min": 1.0, "dose_max": 6.0, "dose_mean": 3.0}
+    for key in expected:
+        assert first_day[key] == expected[key], mismatch_error("Response Output", expected[key], first_day[key])
+    assert days[1]['turbidity_count'] == 1
+    assert days[1]['turbidity_mean'] == 15.0
+
+    assert check_rollups(db.session) == []
+
+# ------------------------------------------------------------------------------------------
+
+def test_rollups_follow_soft_delete(test_client, init_database, validate_response):
+    """
+    GIVEN a synced dosage entry holding the day's maximum dose
+    WHEN the entry is soft deleted, first through another plant
+    THEN the other plant does not find it, and the day's counts, sums and maximum are updated without a rebuild
+    """
+    batch = {"entries": [dosage_entry("2024-05-01T08:00:00", 3.0), dosage_entry("2024-05-01T09:00:00", 9.0)]}
+    results = test_client.post('/api/plants/1/entries:batch', json=batch).get_json()['results']
+
+    response = test_client.delete(f"/api/plants/2/dosage_entries/{results[1]['id']}/")
+    assert response.status_code == 404, mismatch_error("Expected code status", 404, response.status_code)
+
+    response = test_client.delete(f"/api/plants/1/dosage_entries/{results[1]['id']}/")
+    validate_response(response, 200, "application/json")
+    assert response.get_json()['is_deleted'] is True
+
+    response = test_client.delete(f"/api/plants/1/dosage_entries/{results[1]['id']}/")
+    assert response.status_code == 404, mismatch_error("Expected code status", 404, response.status_code)
+
+    days = test_client.get('/api/plants/1/rollups/?start=2024-05-01T00:00:00').get_json()['days']
+    assert len(days) == 1
+    assert (days[0]['calibration_count'], days[0]['dose_sum'], days[0]['dose_max']) == (1, 3.0, 3.0)
+    assert check_rollups(db.session) == []
+
+# ------------------------------------------------------------------------------------------
+
+def test_rollups_rebuild(test_client, init_database):
+    """
+    GIVEN daily rollups that drifted from the entry tables
+    WHEN the consistency check and the rebuild are run
+    THEN the drift is reported and the rebuild repairs it
+    """
+    rollup = PlantDailyRollup.query.filter_by(plant_id=1).first()
+    rollup.dosage_count += 5
+    db.session.commit()
+
+    mismatches = check_rollups(db.session, plant_id=1)
+    assert [m['field'] for m in mismatches] == ['dosage_count']
+
+    rebuild_rollups(db.session, plant_id=1)
+    db.session.commit()
+    assert check_rollups(db.session) == []
+
+# ------------------------------------------------------------------------------------------
+
+def test_rollups_upsert_same_new_day(test_client, init_database):
+    """
+    GIVEN two transactions adding entries to a day without a rollup row
+    WHEN their deltas are applied one after the other
+    THEN the second one merges into the row created by the first
+    """
+    for utn in (10, 30):
+        deltas = RollupDeltas()
+        deltas.add_turbidity(2, datetime(2024, 6, 1, 8, 0), utn)
+        apply_deltas(db.session, deltas)
+    rollup = db.session.get(PlantDailyRollup, (2, date(2024, 6, 1)))
+    assert (rollup.turbidity_count, rollup.turbidity_sum, rollup.turbidity_min, rollup.turbidity_max) == (2, 40.0, 10.0, 30.0)
+    db.session.rollback()
+
+# ------------------------------------------------------------------------------------------
+
+def test_rollups_follow_user_delete(test_client, init_database, query_budget):
+    """
+    GIVEN entries synced by a user who is then deleted, some on a day shared with another user
+    WHEN the user is deleted
+    THEN the user's entries are retracted without scanning the entry tables, the extremes the user
+    held are recomputed from the other user's entries, and the days only the user had are gone
+    """
+    user = User(name="Leaving", email="leaving@email.com", phone_number="444", plant_id=2)
+    db.session.add(user)
+    db.session.commit()
+    batch = {"entries": [
+        {**dosage_entry("2024-07-01T07:00:00", 2.0), "user_id": 2},
+        {"type": "raw_water", "user_id": 2, "created_at": "2024-07-01T07:00:00", "utn": 5},
+        {**dosage_entry("2024-07-01T08:00:00", 9.0), "user_id": user.id},
+        {"type": "raw_water", "user_id": user.id, "created_at": "2024-07-01T08:00:00", "utn": 50},
+        {"type": "raw_water", "user_id": user.id, "created_at": "2024-07-02T08:00:00", "utn": 7}]}
+    assert test_client.post('/api/plants/2/entries:batch', json=batch).status_code == 201
+    remaining_dose = test_client.get('/api/plants/2/rollups/?start=2024-07-01T00:00:00').get_json()['days'][0]['dose_min']
+
+    with query_budget(max_queries=30):
+        assert test_client.delete(f"/api/users/{user.id}/").status_code == 200
+    assert check_rollups(db.session, plant_id=2) == []
+    days = test_client.get('/api/plants/2/rollups/?start=2024-07-01T00:00:00').get_json()['days']
+    assert [day['day'] for day in days] == ['2024-07-01']
+    assert (days[0]['dosage_count'], days[0]['dose_max'], days[0]['turbidity_count'], days[0]['turbidity_max']) == \
+        (1, remaining_dose, 1, 5), mismatch_error("Day without the deleted user", (1, remaining_dose, 1, 5), days[0])
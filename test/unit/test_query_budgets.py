@@ -0,0 +1,66 @@
+from utils_test import calibration_for
+
+calibration = calibration_for(3.0)
+
+def batch(size):
+    entries = []
+    for i in range(size):
+        entries.append({"type": "dosage", "user_id": 1, "created_at": f"2024-04-{i % 28 + 1:02d}T08:00:00",
+                        "calibration": calibration})
+        entries.append({"type": "raw_water", "user_id": 1, "created_at": f"2024-04-{i % 28 + 1:02d}T09:00:00", "utn": i})
+    return {"entries": entries}
+
+
+def test_get_plant_budget(test_client, init_database, query_budget):
+    """
+    GIVEN a plant ID
+    WHEN the plant is requested
+    THEN the version lookup and the plant lookup are the only queries and both use an index
+    """
+    with query_budget(max_queries=2):
+        assert test_client.get('/api/plants/1/').status_code == 200
+
+# ------------------------------------------------------------------------------------------
+
+def test_get_all_plants_budget(test_client, init_database, query_budget):
+    """
+    GIVEN plants in the database
+    WHEN pages of plants are requested
+    THEN each page costs one query, and only the first page walks the table from its start
+    """
+    with query_budget(max_queries=2, allow_scans=("plants",)):
+        assert test_client.get('/api/plants/?limit=1').status_code == 200
+    with query_budget(max_queries=2):
+        assert test_client.get('/api/plants/?limit=1&after_id=1').status_code == 200
+
+# ------------------------------------------------------------------------------------------
+
+def test_create_entries_batch_budget(test_client, init_database, query_budget):
+    """
+    GIVEN batches of different sizes
+    WHEN they are synced
+    THEN the number of queries does not grow with the number of entries
+    """
+    # plant and users lookups, one insert per table, the section links, the change log and the rollups
+    with query_budget(max_queries=10):
+        assert test_client.post('/api/plants/1/entries:batch', json=batch(2)).status_code == 201
+    with query_budget(max_queries=10):
+        assert test_client.post('/api/plants/1/entries:batch', json=batch(100)).status_code == 201
+
+# ------------------------------------------------------------------------------------------
+
+def test_get_plant_trends_budget(test_client, init_database, query_budget):
+    """
+    GIVEN entries of a plant
+    WHEN its trends and rollups are requested
+    THEN each is answered by index lookups in a constant number of queries
+    """
+    test_client.post('/api/plants/1/entries:batch', json=batch(10))
+    # the plant, the newest archived entry and the trend
+    for metric in ("chemical_dose", "utn"):
+        with query_budget(max_queries=3):
+            assert test_client.get(f'/api/plants/1/trends/?metric={metric}&bucket=day').status_code == 200
+    with query_budget(max_queries=2):
+        assert test_client.get('/api/plants/1/rollups/').status_code == 200
+
+# ------------------------------------------------------------------------------------------
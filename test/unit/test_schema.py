@@ -0,0 +1,151 @@
+import pytest
+from flask import current_app
+from sqlalchemy import create_engine, inspect
+from application.engine import archive_execution_options
+from application.schema import migrate, check_schema, read_version, prepare_schema, create_schema, \
+    SCHEMA_VERSION, SchemaVersionError, _stamp
+from application.models import db
+from utils_test import mismatch_error
+
+# tables of the first release, created by create_all() without any version stamp
+BASELINE_SCHEMA = [
+    "CREATE TABLE configurations (id INTEGER NOT NULL, chemical_type VARCHAR NOT NULL, chemical_concentration FLOAT NOT NULL, "
+    "num_filters INTEGER NOT NULL, num_clarifiers INTEGER NOT NULL, PRIMARY KEY (id))",
+    "CREATE TABLE plants (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, phone_number VARCHAR(15) NOT NULL, "
+    "config_id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (name), UNIQUE (phone_number), "
+    "FOREIGN KEY(config_id) REFERENCES configurations (id))",
+    "CREATE TABLE users (id INTEGER NOT NULL, name VARCHAR(100) NOT NULL, email VARCHAR(255) NOT NULL, "
+    "phone_number VARCHAR(15) NOT NULL, plant_id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (email), "
+    "UNIQUE (phone_number), FOREIGN KEY(plant_id) REFERENCES plants (id))",
+    "CREATE TABLE dosage_entries (id INTEGER NOT NULL, created_at DATETIME, is_deleted BOOLEAN, user_id INTEGER NOT NULL, "
+    "calibration_id INTEGER, change_dose_id INTEGER, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id), "
+    "FOREIGN KEY(calibration_id) REFERENCES calibrations (id), FOREIGN KEY(change_dose_id) REFERENCES change_doses (id))",
+    "CREATE TABLE calibrations (id INTEGER NOT NULL, slider_position FLOAT NOT NULL, inflow_rate INTEGER NOT NULL, "
+    "starting_volume INTEGER NOT NULL, ending_volume INTEGER NOT NULL, elapsed_seconds INTEGER NOT NULL, "
+    "calculated_flow_rate FLOAT NOT NULL, calculated_chemical_dose FLOAT NOT NULL, slider_pos_chem_dose_ratio FLOAT NOT NULL, "
+    "dosage_entry_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(dosage_entry_id) REFERENCES dosage_entries (id))",
+    "CREATE TABLE change_doses (id INTEGER NOT NULL, target_coagulant_dose FLOAT NOT NULL, new_slider_position FLOAT NOT NULL, "
+    "dosage_entry_id INTEGER NOT NULL, related_calibration_id INTEGER, PRIMARY KEY (id), "
+    "FOREIGN KEY(dosage_entry_id) REFERENCES dosage_entries (id), FOREIGN KEY(related_calibration_id) REFERENCES calibrations (id))",
+    "CREATE TABLE raw_water_entries (id INTEGER NOT NULL, utn INTEGER NOT NULL, turbidity_method VARCHAR, "
+    "user_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES users (id))",
+]
+
+
+@pytest.fixture
+def engine(test_client, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}",
+                           execution_options=archive_execution_options(current_app.config))
+    yield engine
+    engine.dispose()
+
+
+def test_migrate_fresh_database(engine):
+    """
+    GIVEN an empty database
+    WHEN it is migrated twice
+    THEN every migration is applied once and the database is stamped with the current version
+    """
+    assert len(migrate(engine)) == SCHEMA_VERSION
+    assert migrate(engine) == []
+    with engine.connect() as connection:
+        assert read_version(connection) == SCHEMA_VERSION
+    assert {"change_log", "archived_dosage_entries"} <= set(inspect(engine).get_table_names())
+    check_schema(engine)
+
+# ------------------------------------------------------------------------------------------
+
+def test_migrate_unstamped_database(engine):
+    """
+    GIVEN a database created before the change log, without a version stamp
+    WHEN it is migrated
+    THEN the missing columns and tables are added
+    """
+    with engine.begin() as connection:
+        create_schema(connection)
+        connection.exec_driver_sql("ALTER TABLE users DROP COLUMN updated_at")
+        connection.exec_driver_sql("DROP TABLE change_log")
+        connection.exec_driver_sql("DROP TABLE schema_version")
+
+    applied = migrate(engine)
+    assert len(applied) == SCHEMA_VERSION, mismatch_error("Applied migrations", SCHEMA_VERSION, applied)
+    assert "updated_at" in {column["name"] for column in inspect(engine).get_columns("users")}
+    assert "change_log" in inspect(engine).get_table_names()
+
+# ------------------------------------------------------------------------------------------
+
+def test_migrate_baseline_database(engine):
+    """
+    GIVEN a database with the tables of the first release
+    WHEN it is migrated
+    THEN every column and index of the current models exists
+    """
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql("INSERT INTO configurations VALUES (1, 'PAC', 0.1, 1, 1)")
+        connection.exec_driver_sql("INSERT INTO plants VALUES (1, 'Old', '1', 1)")
+        connection.exec_driver_sql("INSERT INTO users VALUES (1, 'Old', 'old@email.com', '1', 1)")
+        connection.exec_driver_sql("INSERT INTO raw_water_entries VALUES (1, 12, NULL, 1)")
+
+    assert len(migrate(engine)) == SCHEMA_VERSION
+    inspector = inspect(engine)
+    for table in db.metadata.sorted_tables:
+        if table.schema is not None or not inspector.has_table(table.name):
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert columns == set(table.c.keys()), mismatch_error(f"{table.name} columns", set(table.c.keys()), columns)
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        expected = {index.name for index in table.indexes}
+        assert indexes == expected, mismatch_error(f"{table.name} indexes", expected, indexes)
+    assert "ix_raw_water_entries_user_id_created_at" in {index["name"] for index in inspector.get_indexes("raw_water_entries")}
+
+# ------------------------------------------------------------------------------------------
+
+def test_check_schema_mismatch(engine):
+    """
+    GIVEN databases without a stamp or stamped with another version
+    WHEN their schema is checked
+    THEN the check fails fast
+    """
+    with pytest.raises(SchemaVersionError):
+        check_schema(engine)
+
+    with engine.begin() as connection:
+        create_schema(connection)
+        _stamp(connection, SCHEMA_VERSION + 1)
+    with pytest.raises(SchemaVersionError):
+        check_schema(engine)
+    with pytest.raises(SchemaVersionError):
+        migrate(engine)
+
+# ------------------------------------------------------------------------------------------
+
+def test_prepare_schema_invalid_mode(test_client):
+    """
+    GIVEN an unknown SCHEMA_STARTUP mode
+    WHEN the schema is prepared
+    THEN it is rejected
+    """
+    app = current_app._get_current_object()
+    previous = app.config["SCHEMA_STARTUP"]
+    app.config["SCHEMA_STARTUP"] = "create_all"
+    try:
+        with pytest.raises(ValueError):
+            prepare_schema(app)
+    finally:
+        app.config["SCHEMA_STARTUP"] = previous
+
+# ------------------------------------------------------------------------------------------
+
+def test_schema_version_command(test_client, init_database):
+    """
+    GIVEN the schema commands
+    WHEN the database is upgraded and its version printed
+    THEN the stamped version matches the application
+    """
+    runner = current_app.test_cli_runner()
+    result = runner.invoke(args=["schema", "upgrade"])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(args=["schema", "version"])
+    assert f"Database: {SCHEMA_VERSION}, application: {SCHEMA_VERSION}" in result.output
@@ -0,0 +1,64 @@
+import math
+from datetime import datetime
+from flask import current_app
+from flask.json.provider import DefaultJSONProvider
+from application.models import db, Plant, DosageEntry, CalibrationSection
+from application.serializers import serializer_for, row_select, serialize_rows, FastJSONProvider
+from utils_test import mismatch_error
+
+
+def test_compiled_serializer_matches_columns():
+    """
+    GIVEN a model instance
+    WHEN it is serialized with its compiled serializer
+    THEN every column attribute is present with its value and dates are encoded like jsonify does
+    """
+    entry = DosageEntry(id=7, created_at=datetime(2024, 4, 1, 8, 0), is_deleted=False, user_id=1)
+    serialized = serializer_for(DosageEntry)(entry)
+
+    expected = {"id": 7, "created_at": "Mon, 01 Apr 2024 08:00:00 GMT", "is_deleted": False, "updated_at": None,
+                "user_id": 1, "calibration_id": None, "change_dose_id": None}
+    assert serialized == expected, mismatch_error("Serialized Output", expected, serialized)
+    assert serializer_for(DosageEntry) is serializer_for(DosageEntry), "Serializer is not cached"
+
+# ------------------------------------------------------------------------------------------
+
+def test_compiled_serializer_non_finite_floats():
+    """
+    GIVEN a model instance with non-finite float values
+    WHEN it is serialized
+    THEN those values are serialized as None
+    """
+    calibration = CalibrationSection(slider_position=0.5, calculated_flow_rate=math.inf, calculated_chemical_dose=math.nan)
+    serialized = serializer_for(CalibrationSection)(calibration)
+    assert serialized['slider_position'] == 0.5
+    assert serialized['calculated_flow_rate'] is None
+    assert serialized['calculated_chemical_dose'] is None
+
+# ------------------------------------------------------------------------------------------
+
+def test_row_serializer_matches_instance_serializer(test_client, init_database):
+    """
+    GIVEN plants in the database
+    WHEN they are serialized from Core rows and from ORM instances
+    THEN both serializations are identical
+    """
+    from_rows = serialize_rows(Plant, db.session.execute(row_select(Plant).order_by(Plant.id)))
+    from_instances = [serializer_for(Plant)(p) for p in Plant.query.order_by(Plant.id)]
+    assert from_rows == from_instances, mismatch_error("Serialized Output", from_instances, from_rows)
+
+# ------------------------------------------------------------------------------------------
+
+def test_fast_json_provider_matches_default(test_client):
+    """
+    GIVEN a payload with nested objects, unicode and dates
+    WHEN it is encoded by the fast and the default JSON providers
+    THEN both decode to the same document
+    """
+    payload = {"b": [1, 2.5, None], "a": {"name": "Agua Clara ñ", "when": datetime(2024, 4, 1)}}
+    app = current_app._get_current_object()
+    fast = FastJSONProvider(app)
+    default = DefaultJSONProvider(app)
+    assert fast.loads(fast.dumps(payload)) == default.loads(default.dumps(payload))
+
+# ------------------------------------------------------------------------------------------
@@ -0,0 +1,172 @@
+from datetime import datetime
+import pytest
+import config
+from sqlalchemy import select, func, update
+from application import create_app, db
+from application.models import Configuration, Plant, User, RawWaterEntry, DosageEntry, ChangeLog, EntryChangeLog, \
+    IdempotencyKey
+from application.entries import insert_entries, delete_plant_entries
+from application.rollups import check_rollups
+from application.changes import changes_since
+from application.sharding import use_shard, fan_out, ShardNotSelected, shard_binds
+from application.cache import plant_cache
+from utils_test import mismatch_error
+
+
+@pytest.fixture(scope='module')
+def sharded_app(tmp_path_factory):
+    """
+    Application with two shards, plant 1 on shard 1 and plant 2 on shard 0.
+    """
+    directory = tmp_path_factory.mktemp("shards")
+    patch = pytest.MonkeyPatch()
+    patch.setenv("CONFIG_TYPE", "config.TestingConfig")
+    patch.setattr(config.TestingConfig, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{directory / 'catalog.db'}")
+    patch.setattr(config.TestingConfig, "ENGINE_PROFILE", "sqlite")
+    patch.setattr(config.TestingConfig, "SHARD_COUNT", 2)
+    patch.setattr(config.TestingConfig, "SHARD_DATABASE_URI", f"sqlite:///{directory / 'shard_{shard}.db'}")
+    try:
+        app = create_app()
+    finally:
+        patch.undo()
+
+    with app.app_context():
+        db.session.add_all([Configuration(id=i, chemical_type='PAC', chemical_concentration=0.1, num_filters=1,
+                                          num_clarifiers=1) for i in (1, 2)])
+        db.session.add_all([Plant(id=i, name=f"Shard{i}", phone_number=str(i), config_id=i) for i in (1, 2)])
+        db.session.add_all([User(id=i, name=f"User{i}", email=f"user{i}@email.com", phone_number=str(i), plant_id=i)
+                            for i in (1, 2)])
+        db.session.commit()
+        for plant_id in (1, 2):
+            with use_shard(plant_id):
+                insert_entries(db.session, plant_id, [
+                    {"type": "raw_water", "user_id": plant_id, "created_at": datetime_of(plant_id), "utn": 10 * plant_id},
+                    {"type": "dosage", "user_id": plant_id, "created_at": datetime_of(plant_id)}])
+        db.session.commit()
+        db.session.remove()
+    yield app
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+    # Flask-SQLAlchemy registers a metadata per bind key on the extension, shared by every app
+    for key in ("shard_0", "shard_1"):
+        db.metadatas.pop(key, None)
+    plant_cache.clear()
+
+def datetime_of(plant_id):
+    return datetime(2024, 5, plant_id, 8, 0)
+
+
+def test_entries_written_to_plant_shards(sharded_app):
+    """
+    GIVEN entries of two plants in different shards
+    WHEN each shard database is read directly
+    THEN every shard holds only the entries of its plants
+    """
+    with sharded_app.app_context():
+        utns = {key: [row[0] for row in db.engines[key].connect().exec_driver_sql("SELECT utn FROM main.raw_water_entries")]
+                for key in ("shard_0", "shard_1")}
+        assert utns == {"shard_0": [20], "shard_1": [10]}, mismatch_error("Shard rows", {"shard_0": [20], "shard_1": [10]}, utns)
+        # the entries are logged in their shard, writing them never writes the catalog
+        logged = fan_out(lambda: db.session.scalars(select(EntryChangeLog.plant_id).where(
+            EntryChangeLog.table_name == "raw_water_entries")).all())
+        assert logged == [[2], [1]], mismatch_error("Logged plants", [[2], [1]], logged)
+        assert db.session.scalar(select(func.count(ChangeLog.seq)).where(ChangeLog.table_name == "raw_water_entries")) == 0
+
+# ------------------------------------------------------------------------------------------
+
+def test_shard_reads_join_catalog(sharded_app):
+    """
+    GIVEN a plant's shard selected
+    WHEN its rollups are checked against its entries joined with the catalog users
+    THEN they agree
+    """
+    with sharded_app.app_context():
+        with use_shard(2):
+            assert db.session.scalars(select(RawWaterEntry.utn).join(User, User.id == RawWaterEntry.user_id)).all() == [20]
+            assert check_rollups(db.session, 2) == []
+
+# ------------------------------------------------------------------------------------------
+
+def test_sync_plant_from_shard(sharded_app):
+    """
+    GIVEN a plant's entries logged in its shard
+    WHEN the plant is synced with its shard selected
+    THEN its catalog rows and its entries are returned, with the sequence numbers of both logs
+    """
+    with sharded_app.app_context(), use_shard(2):
+        changes, last_seqs, has_more = changes_since((0, 0), 2)
+        assert [plant['id'] for plant in changes['plants']['upserted']] == [2]
+        assert [entry['utn'] for entry in changes['raw_water_entries']['upserted']] == [20]
+        assert last_seqs[1] == db.session.scalar(select(func.max(EntryChangeLog.seq)))
+        assert has_more is False
+
+# ------------------------------------------------------------------------------------------
+
+def test_fan_out_and_unselected_shard(sharded_app):
+    """
+    GIVEN sharded entries
+    WHEN they are counted on every shard, and read without selecting a shard
+    THEN the fan out returns one count per shard and the unrouted read is rejected
+    """
+    with sharded_app.app_context():
+        assert fan_out(lambda: db.session.scalar(select(func.count(RawWaterEntry.id)))) == [1, 1]
+        with pytest.raises(ShardNotSelected):
+            db.session.execute(select(RawWaterEntry.id))
+
+# ------------------------------------------------------------------------------------------
+
+def test_delete_plant_entries_on_shard(sharded_app):
+    """
+    GIVEN a plant's entries on its shard
+    WHEN they are hard deleted
+    THEN the rows are removed from the shard and their tombstones are logged in it
+    """
+    with sharded_app.app_context():
+        with use_shard(1):
+            delete_plant_entries(db.session, 1)
+            db.session.commit()
+            assert db.session.scalar(select(func.count(DosageEntry.id))) == 0
+            tombstones = db.session.scalar(select(func.count(EntryChangeLog.seq)).where(EntryChangeLog.op == "delete"))
+        assert tombstones == 2, mismatch_error("Tombstones", 2, tombstones)
+        assert fan_out(lambda: db.session.scalar(select(func.count(RawWaterEntry.id)))) == [1, 0]
+
+# ------------------------------------------------------------------------------------------
+
+def test_idempotency_keys_on_plant_shard(sharded_app):
+    """
+    GIVEN the response of a request of a sharded plant stored under an Idempotency-Key
+    WHEN the key is looked up, then expires
+    THEN it is stored in the plant's shard only, found there, and evicted from it
+    """
+    with sharded_app.app_context():
+        store = sharded_app.extensions["idempotency"]
+        with use_shard(2):
+            store.save("shard-1", "fingerprint", sharded_app.response_class('{"results": []}', status=201))
+        keys = fan_out(lambda: db.session.scalars(select(IdempotencyKey.key)).all())
+        assert keys == [["shard-1"], []], mismatch_error("Keys by shard", [["shard-1"], []], keys)
+        assert db.session.scalar(select(func.count()).select_from(IdempotencyKey)) == 0
+
+        store.cache.clear()
+        with use_shard(2):
+            assert store.lookup("shard-1")[:2] == ("fingerprint", 201)
+            db.session.execute(update(IdempotencyKey).values(expires_at=datetime(2024, 1, 1)))
+        db.session.commit()
+        assert store.evict() == 1
+        db.session.remove()
+
+# ------------------------------------------------------------------------------------------
+
+def test_shard_binds_require_sqlite_profile(test_client):
+    """
+    GIVEN sharding configured without the sqlite engine profile
+    WHEN the shard binds are built
+    THEN the configuration is rejected
+    """
+    settings = {"SHARD_COUNT": 2, "SQLALCHEMY_DATABASE_URI": "sqlite:///catalog.db", "ENGINE_PROFILE": "default",
+                "ARCHIVE_DATABASE": None, "SHARD_DATABASE_URI": "sqlite:///shard_{shard}.db"}
+    with pytest.raises(ValueError):
+        shard_binds(settings)
+    assert list(shard_binds({**settings, "ENGINE_PROFILE": "sqlite"})) == ["shard_0", "shard_1"]
+    assert shard_binds({**settings, "SHARD_COUNT": 0}) == {}
@@ -0,0 +1,84 @@
+import pytest
+from application.dose_model import DoseModel, dose_models
+from utils_test import mismatch_error, calibration_for
+
+def dosage(dose, slider_position):
+    return {"type": "dosage", "user_id": 1, "calibration": calibration_for(dose, slider_position)}
+
+def sync(test_client, *entries):
+    response = test_client.post('/api/plants/1/entries:batch', json={"entries": list(entries)})
+    assert response.status_code == 201
+    return response.get_json()['results']
+
+
+def test_dose_model_fit():
+    """
+    GIVEN calibrations added to a dose model, one of them twice
+    WHEN the model is fitted
+    THEN the line goes through the calibrations, the repeated one is only counted once
+    and calibrations added out of id order are all counted
+    """
+    model = DoseModel()
+    model.add(1, 1.0, 0.2)
+    assert model.fit() is None
+    model.add(2, 3.0, 0.6)
+    model.add(2, 3.0, 0.6)
+    assert model.count == 2
+    slope, intercept = model.fit()
+    assert slope == pytest.approx(0.2)
+    assert intercept == pytest.approx(0.0, abs=1e-12)
+    assert model.recommend(2.0) == pytest.approx(0.4)
+
+    # a batch recorded after a later one is still counted
+    model = DoseModel(last_calibration_id=1)
+    model.add(5, 1.0, 0.2)
+    model.add(4, 3.0, 0.6)
+    assert model.count == 2
+
+# ------------------------------------------------------------------------------------------
+
+def test_recommendation_needs_calibrations(test_client, init_database):
+    """
+    GIVEN a plant with a single calibration
+    WHEN a slider position is requested
+    THEN no recommendation can be made yet
+    """
+    assert test_client.get('/api/plants/1/recommendation/?target_dose=5').status_code == 422
+    sync(test_client, dosage(1.0, 0.2))
+    assert test_client.get('/api/plants/1/recommendation/?target_dose=5').status_code == 422
+    assert test_client.get('/api/plants/1/recommendation/').status_code == 400
+    assert test_client.get('/api/plants/1/recommendation/?target_dose=nan').status_code == 400
+    assert test_client.get('/api/plants/99/recommendation/?target_dose=5').status_code == 404
+
+# ------------------------------------------------------------------------------------------
+
+def test_recommendation_is_updated_incrementally(test_client, init_database, validate_response, query_budget):
+    """
+    GIVEN calibrations synced after the plant's model was cached
+    WHEN a slider position is requested
+    THEN the recommendation includes them and is answered without querying the database
+    """
+    sync(test_client, dosage(2.0, 0.4), dosage(3.0, 0.6), {"type": "dosage", "user_id": 1})
+    with query_budget(max_queries=0):
+        response = test_client.get('/api/plants/1/recommendation/?target_dose=5')
+    validate_response(response, 200, "application/json")
+    data = response.get_json()
+    assert data['calibration_count'] == 3, mismatch_error("Calibration count", 3, data['calibration_count'])
+    assert data['slider_position'] == pytest.approx(1.0)
+
+# ------------------------------------------------------------------------------------------
+
+def test_recommendation_follows_deletes(test_client, init_database):
+    """
+    GIVEN a calibrated dosage entry that is soft deleted
+    WHEN a slider position is requested
+    THEN the model is refitted without the deleted calibration
+    """
+    results = sync(test_client, dosage(4.0, 2.0))
+    assert test_client.get('/api/plants/1/recommendation/?target_dose=5').get_json()['calibration_count'] == 4
+    assert test_client.delete(f"/api/plants/1/dosage_entries/{results[0]['id']}/").status_code == 200
+    assert dose_models.get(1) is None
+
+    data = test_client.get('/api/plants/1/recommendation/?target_dose=5').get_json()
+    assert data['calibration_count'] == 3
+    assert data['slider_position'] == pytest.approx(1.0)
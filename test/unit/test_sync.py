@@ -0,0 +1,124 @@
+from utils_test import mismatch_error, calibration_for
+
+
+def sync(test_client, since, **args):
+    response = test_client.get('/api/sync', query_string={"since": since, **args})
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_sync_from_scratch(test_client, init_database):
+    """
+    GIVEN a seeded database
+    WHEN a client syncs without a token
+    THEN every logged row is returned with its current values and a token to resume from
+    """
+    body = sync(test_client, 0)
+    assert body['has_more'] is False
+    assert [plant['name'] for plant in body['changes']['plants']['upserted']] == ['AguaClara', 'AguaClara2', 'AguaClara3']
+    assert [user['id'] for user in body['changes']['users']['upserted']] == [1, 2, 3]
+    assert body['changes']['users']['upserted'][0]['updated_at'] is not None
+    assert body['since'] == "0:0"
+    assert int(body['next_since'].split(':')[0]) > 0
+
+    body = sync(test_client, body['next_since'])
+    assert body['changes'] == {}, mismatch_error("Changes of an up to date client", {}, body['changes'])
+    assert body['next_since'] == body['since']
+
+# ------------------------------------------------------------------------------------------
+
+def test_sync_returns_only_changes(test_client, init_database):
+    """
+    GIVEN a client that synced once
+    WHEN users are created and deleted, then it syncs again
+    THEN only the created user is returned, and the deleted one as a tombstone on the next sync
+    """
+    since = sync(test_client, 0)['next_since']
+    response = test_client.post('/api/users/', json={
+        "name": "Sync User", "email": "sync@email.com", "phone_number": "444-444-444", "plant_name": "AguaClara2"})
+    assert response.status_code == 201
+    user_id = response.get_json()['id']
+
+    body = sync(test_client, since)
+    assert list(body['changes']) == ['users']
+    assert [user['id'] for user in body['changes']['users']['upserted']] == [user_id]
+    assert body['changes']['users']['deleted'] == []
+
+    since = body['next_since']
+    assert test_client.delete(f'/api/users/{user_id}/').status_code == 200
+    body = sync(test_client, since)
+    assert body['changes'] == {"users": {"upserted": [], "deleted": [user_id]}}
+
+# ------------------------------------------------------------------------------------------
+
+def test_sync_entries_of_a_plant(test_client, init_database):
+    """
+    GIVEN entries synced for two plants
+    WHEN a client syncs one plant after soft deleting one of its dosage entries
+    THEN only the changes of that plant are returned and the soft deleted entry is a tombstone
+    """
+    since = sync(test_client, 0)['next_since']
+    results = test_client.post('/api/plants/1/entries:batch', json={"entries": [
+        {"type": "dosage", "user_id": 1, "calibration": calibration_for(2.0)},
+        {"type": "dosage", "user_id": 1},
+        {"type": "raw_water", "user_id": 1, "utn": 12}]}).get_json()['results']
+    assert test_client.post('/api/plants/2/entries:batch', json={"entries": [
+        {"type": "raw_water", "user_id": 2, "utn": 5}]}).status_code == 201
+    assert test_client.delete(f"/api/plants/1/dosage_entries/{results[1]['id']}/").status_code == 200
+
+    changes = sync(test_client, since, plant_id=1)['changes']
+    assert [entry['id'] for entry in changes['dosage_entries']['upserted']] == [results[0]['id']]
+    assert changes['dosage_entries']['deleted'] == [results[1]['id']]
+    assert [c['id'] for c in changes['calibrations']['upserted']] == [results[0]['calibration_id']]
+    assert [entry['id'] for entry in changes['raw_water_entries']['upserted']] == [results[2]['id']]
+
+# ------------------------------------------------------------------------------------------
+
+def test_sync_token_of_a_single_log(test_client, init_database):
+    """
+    GIVEN a token from before the entries had a change log of their own, a single sequence number
+    WHEN a client syncs with it after entries were synced
+    THEN the catalog changes after it and every logged entry are returned
+    """
+    catalog_seq = sync(test_client, 0)['next_since'].split(':')[0]
+    results = test_client.post('/api/plants/1/entries:batch', json={"entries": [
+        {"type": "raw_water", "user_id": 1, "utn": 7}]}).get_json()['results']
+
+    body = sync(test_client, catalog_seq)
+    assert body['since'] == f"{catalog_seq}:0"
+    assert not {'plants', 'users', 'configurations'} & set(body['changes'])
+    assert results[0]['id'] in [entry['id'] for entry in body['changes']['raw_water_entries']['upserted']]
+    assert sync(test_client, body['next_since'])['changes'] == {}
+
+# ------------------------------------------------------------------------------------------
+
+def test_sync_pages(test_client, init_database):
+    """
+    GIVEN more changes than the page limit
+    WHEN a client syncs page by page
+    THEN every page says whether more follow and the pages add up to the full sync
+    """
+    full = sync(test_client, 0)
+    since, plants = 0, []
+    while True:
+        body = sync(test_client, since, limit=2)
+        plants += [plant['id'] for plant in body['changes'].get('plants', {}).get('upserted', [])]
+        since = body['next_since']
+        if not body['has_more']:
+            break
+    assert since == full['next_since']
+    assert plants == [1, 2, 3]
+
+# ------------------------------------------------------------------------------------------
+
+def test_sync_invalid_arguments(test_client, init_database):
+    """
+    GIVEN invalid sync arguments
+    WHEN a client syncs
+    THEN the request is rejected
+    """
+    assert test_client.get('/api/sync?since=abc').status_code == 400
+    assert test_client.get('/api/sync?since=-1').status_code == 400
+    assert test_client.get('/api/sync?since=1:x').status_code == 400
+    assert test_client.get('/api/sync?since=1:-1').status_code == 400
+    assert test_client.get('/api/sync?limit=0').status_code == 400
+    assert test_client.get('/api/sync?plant_id=one').status_code == 400
@@ -0,0 +1,78 @@
+import pytest
+from application.turbidity import TurbidityStats, turbidity_monitor
+from utils_test import mismatch_error
+
+# steady readings alternating between 10 and 12 NTU, a mean of 11 and a deviation of 1
+STEADY = [10, 12] * 6
+
+def raw_water(utn):
+    return {"type": "raw_water", "user_id": 1, "utn": utn}
+
+def sync(test_client, *utns):
+    response = test_client.post('/api/plants/1/entries:batch', json={"entries": [raw_water(utn) for utn in utns]})
+    assert response.status_code == 201
+    return response.get_json()['results']
+
+
+def test_turbidity_stats_window():
+    """
+    GIVEN readings added to a window of three, one of them twice
+    WHEN the statistics are read
+    THEN they cover the last three readings and the repeated one is only counted once
+    """
+    stats = TurbidityStats(window=3, alpha=0.5)
+    for entry_id, utn in enumerate([100, 2, 4, 6], start=1):
+        assert stats.add(entry_id, utn)
+    assert not stats.add(4, 6)
+    assert stats.count == 3
+    assert stats.mean() == pytest.approx(4.0)
+    assert stats.std() == pytest.approx((8 / 3) ** 0.5)
+    assert stats.ewma == pytest.approx(((100 + 2) / 2 + 4) / 4 + 3)
+    assert stats.z_score(4) == pytest.approx(0.0)
+
+# ------------------------------------------------------------------------------------------
+
+def test_spike_raises_alert(test_client, init_database, validate_response, query_budget):
+    """
+    GIVEN steady raw water readings followed by a spike
+    WHEN the plant's alerts are polled
+    THEN the spike is reported once, without querying the database
+    """
+    sync(test_client, *STEADY)
+    assert test_client.get('/api/plants/1/alerts/').get_json()['alerts'] == []
+    results = sync(test_client, 11, 40)
+
+    with query_budget(max_queries=0):
+        response = test_client.get('/api/plants/1/alerts/')
+    validate_response(response, 200, "application/json")
+    data = response.get_json()
+    assert [alert['entry_id'] for alert in data['alerts']] == [results[1]['id']], \
+        mismatch_error("Alerts", [results[1]['id']], data['alerts'])
+    assert data['alerts'][0]['z_score'] >= 3
+    assert data['turbidity']['count'] == 14
+    assert test_client.get(f"/api/plants/1/alerts/?after={data['next_after']}").get_json()['alerts'] == []
+    assert test_client.get('/api/plants/1/alerts/?after=x').status_code == 400
+    assert test_client.get('/api/plants/99/alerts/').status_code == 404
+
+# ------------------------------------------------------------------------------------------
+
+def test_warm_start(test_client, init_database, query_budget):
+    """
+    GIVEN raw water readings in the database and an empty monitor
+    WHEN the monitor is warm-started
+    THEN the statistics are rebuilt with a single query and spikes are detected right away,
+    numbered after the alerts raised before
+    """
+    expected = turbidity_monitor.stats(1)
+    seen = test_client.get('/api/plants/1/alerts/').get_json()['next_after']
+    turbidity_monitor.clear()
+    with query_budget(max_queries=1, allow_scans=("users",)):
+        turbidity_monitor.warm_start()
+    stats = turbidity_monitor.stats(1)
+    assert stats == pytest.approx(expected), mismatch_error("Turbidity stats", expected, stats)
+    assert turbidity_monitor.stats(2) is None
+
+    # the alerts are numbered by entry id, a client polling from before the restart sees the new one
+    results = sync(test_client, 90)
+    alerts = test_client.get(f'/api/plants/1/alerts/?after={seen}').get_json()['alerts']
+    assert [alert['seq'] for alert in alerts] == [results[0]['id']], mismatch_error("Alerts", [results[0]['id']], alerts)
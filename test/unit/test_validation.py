@@ -0,0 +1,58 @@
+from datetime import datetime, timezone
+from application.validation import PLANT_SCHEMA, CONFIGURATION_SCHEMA, ENTRY_SCHEMAS
+from utils_test import mismatch_error
+
+
+def test_schema_coerces_values():
+    """
+    GIVEN a payload with numeric strings and an ISO 8601 timestamp
+    WHEN it is validated
+    THEN the values are coerced and unknown keys are dropped
+    """
+    entry = {"user_id": "1", "created_at": "2024-04-01T08:00:00", "utn": "12", "color": "brown"}
+    values, errors = ENTRY_SCHEMAS["raw_water"].validate(entry)
+    assert errors == []
+    expected = {"user_id": 1, "created_at": datetime(2024, 4, 1, 8, 0), "utn": 12}
+    assert values == expected, mismatch_error("Validated values", expected, values)
+
+    values, _ = ENTRY_SCHEMAS["raw_water"].validate({"user_id": 1, "utn": 3})
+    assert isinstance(values["created_at"], datetime), "created_at does not default to now"
+
+    # timestamps with an offset are stored naive, on the local clock of the defaults
+    values, _ = ENTRY_SCHEMAS["raw_water"].validate({"user_id": 1, "utn": 3, "created_at": "2024-04-01T08:00:00Z"})
+    expected = datetime(2024, 4, 1, 8, 0, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert values["created_at"] == expected, mismatch_error("created_at", expected, values["created_at"])
+
+# ------------------------------------------------------------------------------------------
+
+def test_schema_reports_every_error():
+    """
+    GIVEN a payload with several invalid fields, nested ones included
+    WHEN it is validated
+    THEN every error is reported at once, nested fields prefixed by their section
+    """
+    dosage = {"user_id": True, "calibration": {"slider_position": "half", "inflow_rate": 0, "starting_volume": 1,
+                                               "ending_volume": 1}}
+    _, errors = ENTRY_SCHEMAS["dosage"].validate(dosage)
+    expected = ["user_id must be an integer", "calibration.slider_position must be a number",
+                "calibration.inflow_rate must be positive", "missing calibration.elapsed_seconds"]
+    assert errors == expected, mismatch_error("Errors", expected, errors)
+
+    _, errors = PLANT_SCHEMA.validate({"name": "A", "phone_number": "1", "chemical_type": "Cl",
+                                       "chemical_concentration": 0.1, "num_filters": 1})
+    assert errors == ["Chemical 'Cl' invalid.", "missing num_clarifiers"]
+
+# ------------------------------------------------------------------------------------------
+
+def test_schema_bulk_and_partial():
+    """
+    GIVEN a bulk payload and a partial schema
+    WHEN the items are validated in one pass
+    THEN every item gets its own result and the partial schema accepts missing fields
+    """
+    results = PLANT_SCHEMA.validate_all(["plant", {"name": "A"}])
+    assert results[0] == (None, ["plant must be an object"])
+    assert len(results[1][1]) == 5
+
+    assert CONFIGURATION_SCHEMA.validate({"num_filters": 2}) == ({"num_filters": 2}, [])
+    assert CONFIGURATION_SCHEMA.validate({"chemical_concentration": -1})[1] == ["chemical_concentration must be positive"]
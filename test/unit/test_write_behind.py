@@ -0,0 +1,78 @@
+import pytest
+from flask import current_app
+from application.models import RawWaterEntry, DosageEntry
+from application.write_behind import WriteBehindQueue
+from utils_test import mismatch_error, calibration_for
+
+@pytest.fixture
+def write_behind(test_client, init_database):
+    """
+    Switch the app to write-behind mode for a test, with a writer that is not started yet.
+    """
+    queue = WriteBehindQueue(current_app._get_current_object(), maxsize=100, flush_interval=0.05, flush_items=40)
+    current_app.extensions["write_behind"] = queue
+    yield queue
+    queue.stop()
+    del current_app.extensions["write_behind"]
+
+def raw_water(utn):
+    return {"type": "raw_water", "user_id": 1, "utn": utn}
+
+
+def test_write_behind_coalesces_commits(test_client, write_behind, validate_response):
+    """
+    GIVEN a burst of single entry syncs in write-behind mode
+    WHEN the writer flushes the queue
+    THEN every entry is written with an order of magnitude fewer commits than requests
+    """
+    before = RawWaterEntry.query.count()
+    provisional_ids = []
+    for utn in range(80):
+        response = test_client.post('/api/plants/1/entries:batch', json={"entries": [raw_water(utn)]})
+        validate_response(response, 202, "application/json")
+        result = response.get_json()['results'][0]
+        assert result['status'] == "queued"
+        provisional_ids.append(result['provisional_id'])
+    pending = test_client.get(f'/api/entries/pending/{provisional_ids[0]}/').get_json()
+    assert pending['status'] == "pending"
+
+    write_behind.start()
+    write_behind.stop()
+    assert RawWaterEntry.query.count() == before + 80
+    assert write_behind.commits <= 8, mismatch_error("Commits", "at most 8", write_behind.commits)
+
+    resolved = test_client.get(f'/api/entries/pending/{provisional_ids[-1]}/').get_json()
+    assert resolved['status'] == "created"
+    assert RawWaterEntry.query.get(resolved['id']).utn == 79
+
+# ------------------------------------------------------------------------------------------
+
+def test_write_behind_backpressure(test_client, write_behind):
+    """
+    GIVEN a write-behind queue that is almost full
+    WHEN a batch that does not fit is synced
+    THEN the batch is rejected as a whole with 503 and a Retry-After header
+    """
+    response = test_client.post('/api/plants/1/entries:batch', json={"entries": [raw_water(i) for i in range(90)]})
+    assert response.status_code == 202
+    response = test_client.post('/api/plants/1/entries:batch', json={"entries": [raw_water(i) for i in range(20)]})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == "1"
+    assert write_behind.pending() == 90
+
+# ------------------------------------------------------------------------------------------
+
+def test_write_behind_flushes_on_stop(test_client, write_behind):
+    """
+    GIVEN running write-behind mode with a long flush interval
+    WHEN the queue is stopped before the interval elapses
+    THEN the queued entries, calibrations included, are written
+    """
+    write_behind.flush_interval = 60
+    write_behind.start()
+    before = DosageEntry.query.count()
+    entries = [{"type": "dosage", "user_id": 1, "calibration": calibration_for(2.0)}, raw_water(5)]
+    assert test_client.post('/api/plants/1/entries:batch', json={"entries": entries}).status_code == 202
+    write_behind.stop(timeout=5)
+    assert DosageEntry.query.count() == before + 1
+    assert write_behind.pending() == 0
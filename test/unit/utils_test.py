@@ -9,3 +9,31 @@ def mismatch_error(key, expected, got):
         :return: A formatted error message string.
         """
         return f"Mismatch in {key}: Expected '{expected}' for '{key}', but got '{got}' instead."
+
+#calibration payload whose server-derived chemical dose is `dose` for a plant with a 0.1 concentration
+def calibration_for(dose, slider_position=0.5):
+        """
+        Builds the measured values of a calibration yielding a given chemical dose.
+
+        :param dose: The calculated_chemical_dose the server should derive.
+        :param slider_position: The slider position of the calibration.
+        :return: A calibration payload dictionary.
+        """
+        return {
+            "slider_position": slider_position,
+            "inflow_rate": 1,
+            "starting_volume": 100000,
+            "ending_volume": 100000 - round(dose * 1000),
+            "elapsed_seconds": 100
+        }
+
+#calibrated dosage entry payload of the first user
+def dosage_entry(created_at, dose):
+        """
+        Builds a dosage entry of user 1 whose calibration yields a given chemical dose.
+
+        :param created_at: The ISO 8601 timestamp of the entry.
+        :param dose: The calculated_chemical_dose the server should derive.
+        :return: A dosage entry payload dictionary.
+        """
+        return {"type": "dosage", "user_id": 1, "created_at": created_at, "calibration": calibration_for(dose)}